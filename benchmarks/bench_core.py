@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Compare the ORM-based adapters with the SQLAlchemy Core-based ones.
+
+Run it as ``python benchmarks/bench_core.py``.
+
+"""
+
+from common import setup_database, timeit, report, model
+
+from repoze.what.plugins.sql import SqlGroupsAdapter, SqlPermissionsAdapter, \
+                                    SqlCoreGroupsAdapter, \
+                                    SqlCorePermissionsAdapter
+
+
+def run_operations(groups, permissions, users=100):
+    """Return the timings of the read operations of the two adapters."""
+    session = groups.dbsession
+    
+    def find_groups():
+        for i in range(users):
+            groups.find_sections({'repoze.what.userid': u'user%d' % i})
+        session.expunge_all()
+    
+    def find_permissions():
+        for i in range(users):
+            permissions.find_sections(u'group%d' % i)
+        session.expunge_all()
+    
+    def section_items():
+        for i in range(users):
+            groups._get_section_items(u'group%d' % i)
+        session.expunge_all()
+    
+    def all_sections():
+        groups._get_all_sections()
+        session.expunge_all()
+    
+    return [
+        ('find_sections() x %d (groups)' % users, timeit(find_groups)),
+        ('find_sections() x %d (permissions)' % users,
+         timeit(find_permissions)),
+        ('_get_section_items() x %d' % users, timeit(section_items)),
+        ('_get_all_sections()', timeit(all_sections)),
+        ]
+
+
+def main():
+    setup_database()
+    session = model.DBSession
+    orm = run_operations(
+        SqlGroupsAdapter(model.Group, model.User, session),
+        SqlPermissionsAdapter(model.Permission, model.Group, session))
+    core = run_operations(
+        SqlCoreGroupsAdapter(model.Group.__table__, model.User.__table__,
+                             model.user_group_table, session),
+        SqlCorePermissionsAdapter(model.Permission.__table__,
+                                  model.Group.__table__,
+                                  model.group_permission_table, session))
+    report('ORM adapters', orm)
+    report('Core adapters', core)
+
+
+if __name__ == '__main__':
+    main()
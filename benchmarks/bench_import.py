@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Measure how long it takes to import :mod:`repoze.what.plugins.sql`.
+
+Run it as ``python benchmarks/bench_import.py [runs]``. On Python versions
+which support ``-X importtime``, the modules imported by the plugin and their
+cumulative cost are reported too.
+
+"""
+
+import subprocess
+import sys
+import time
+
+
+PACKAGE = 'repoze.what.plugins.sql'
+
+
+def time_import(statement, runs):
+    """Return the best wall-clock time for ``statement`` in a new process."""
+    best = None
+    for run in range(runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', statement])
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def report_importtime():
+    """Print the ``-X importtime`` breakdown of the plugin, if supported."""
+    if sys.version_info < (3, 7):
+        return
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % PACKAGE],
+        stderr=subprocess.PIPE)
+    lines = process.communicate()[1].decode('utf-8').splitlines()
+    for line in lines:
+        if 'repoze' in line or 'sqlalchemy' in line:
+            sys.stdout.write(line + '\n')
+
+
+def main(runs=5):
+    baseline = time_import('pass', runs)
+    package = time_import('import %s' % PACKAGE, runs)
+    sqlalchemy = time_import('import %s; import sqlalchemy.orm' % PACKAGE,
+                             runs)
+    sys.stdout.write('interpreter startup:      %.1f ms\n' % (baseline * 1000))
+    sys.stdout.write('import plugin:            %.1f ms\n' % (package * 1000))
+    sys.stdout.write('import plugin + SA ORM:   %.1f ms\n' %
+                     (sqlalchemy * 1000))
+    report_importtime()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Compare the strategies to load the groups of a user.
+
+Run it as ``python benchmarks/bench_loaders.py [groups per user]``.
+
+"""
+
+import sys
+
+from common import setup_database, timeit, report, model
+
+from repoze.what.plugins.sql import SqlGroupsAdapter
+
+
+def main(groups_per_user=300, users=50):
+    setup_database(users=users, groups=groups_per_user * 2,
+                   groups_per_user=groups_per_user)
+    session = model.DBSession
+    results = []
+    for strategy in ('joined', 'subquery', 'selectin', 'none'):
+        adapter = SqlGroupsAdapter(model.Group, model.User, session)
+        adapter.loader_strategy = strategy
+        
+        def find_groups():
+            for i in range(users):
+                adapter.find_sections({'repoze.what.userid': u'user%d' % i})
+            session.expunge_all()
+        
+        try:
+            find_groups()
+        except ValueError:
+            sys.stdout.write('Strategy "%s" not supported, skipped\n' %
+                             strategy)
+            continue
+        label = '%s: find_sections() x %d' % (strategy, users)
+        results.append((label, timeit(find_groups)))
+    report('Users in %d groups' % groups_per_user, results)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
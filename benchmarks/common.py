@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Utilities shared by the benchmarks.
+
+The benchmarks reuse the model of the test suite and populate it in an SQLite
+database (in memory, unless the ``DBURL`` environment variable says
+otherwise).
+
+"""
+
+import os
+import random
+import sys
+import time
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_HERE, os.pardir, 'tests'))
+
+from sqlalchemy import create_engine
+
+from fixture import model
+
+
+def setup_database(users=2000, groups=200, permissions=100,
+                   groups_per_user=20, permissions_per_group=10, seed=0):
+    """
+    Create and populate the database of the benchmarks.
+
+    The association tables are filled with plain INSERTs to keep the set-up
+    fast.
+
+    """
+    engine = create_engine(os.environ.get('DBURL', 'sqlite://'))
+    model.init_model(engine)
+    model.metadata.drop_all(engine)
+    model.metadata.create_all(engine)
+    rnd = random.Random(seed)
+    connection = engine.connect()
+    connection.execute(model.User.__table__.insert(),
+                       [{'user_id': i + 1, 'user_name': u'user%d' % i}
+                        for i in range(users)])
+    connection.execute(model.Group.__table__.insert(),
+                       [{'group_id': i + 1, 'group_name': u'group%d' % i}
+                        for i in range(groups)])
+    connection.execute(model.Permission.__table__.insert(),
+                       [{'permission_id': i + 1,
+                         'permission_name': u'perm%d' % i}
+                        for i in range(permissions)])
+    memberships = []
+    for user_id in range(1, users + 1):
+        for group_id in rnd.sample(range(1, groups + 1), groups_per_user):
+            memberships.append({'user_id': user_id, 'group_id': group_id})
+    connection.execute(model.user_group_table.insert(), memberships)
+    grants = []
+    for group_id in range(1, groups + 1):
+        for perm_id in rnd.sample(range(1, permissions + 1),
+                                  permissions_per_group):
+            grants.append({'group_id': group_id, 'permission_id': perm_id})
+    connection.execute(model.group_permission_table.insert(), grants)
+    connection.close()
+    return engine
+
+
+def timeit(function, repeat=3, number=1):
+    """Return the best time, in seconds, of ``number`` calls to ``function``."""
+    best = None
+    for run in range(repeat):
+        start = time.time()
+        for call in range(number):
+            function()
+        elapsed = (time.time() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def report(title, results):
+    """Print the ``(label, seconds)`` pairs in ``results`` as a table."""
+    sys.stdout.write('%s\n%s\n' % (title, '-' * len(title)))
+    for label, seconds in results:
+        sys.stdout.write('%-45s %10.3f ms\n' % (label, seconds * 1000))
+    sys.stdout.write('\n')
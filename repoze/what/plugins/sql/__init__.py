@@ -17,7 +17,12 @@
 
 from repoze.what.plugins.sql.adapters import SqlGroupsAdapter, \
                                              SqlPermissionsAdapter, \
-                                             configure_sql_adapters
+                                             UserRecord, \
+                                             configure_sql_adapters, \
+                                             warm_up_sql_adapters
+from repoze.what.plugins.sql.core import SqlCoreGroupsAdapter, \
+                                         SqlCorePermissionsAdapter
 
 __all__ = ['SqlGroupsAdapter', 'SqlPermissionsAdapter',
-           'configure_sql_adapters']
+           'configure_sql_adapters', 'UserRecord', 'SqlCoreGroupsAdapter',
+           'SqlCorePermissionsAdapter', 'warm_up_sql_adapters']
@@ -57,22 +57,323 @@ field and table names involved:
     permissions adapter, then your groups must also be handled by SQLAlchemy.
 @attention: When using the SQL group adapter, it will load the authenticated
     used object into repoze.who's identity dict (under the "user" key).
+@note: SQLAlchemy is not imported until an adapter actually talks to the
+    database, so importing this module is cheap for processes that never do.
 
 """
-try: #pragma:no cover
-    from sqlalchemy.exceptions import SQLAlchemyError, InvalidRequestError
-except ImportError: #pragma:no cover
-    from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.orm import eagerload
+from contextlib import contextmanager
+from threading import local
 
 from repoze.what.adapters import BaseSourceAdapter, SourceError
 
-__all__ = ['SqlGroupsAdapter', 'SqlPermissionsAdapter',
-           'configure_sql_adapters']
+from repoze.what.plugins.sql.cache import get_request_memo
+from repoze.what.plugins.sql.changelog import INCLUDE, EXCLUDE, CREATE, EDIT, \
+                                              DELETE
+from repoze.what.plugins.sql.tenancy import TenantCaches, current_tenant, \
+                                            _require_current_tenant
+
+__all__ = ['SqlGroupsAdapter', 'SqlPermissionsAdapter', 'UserRecord',
+           'configure_sql_adapters', 'warm_up_sql_adapters']
+
+
+def _bind_single_flight(single_flight, key, loader):
+    """Return a function which runs ``loader`` through ``single_flight``."""
+    return lambda: single_flight.do(key, loader)
+
+
+def _bind_circuit_breaker(circuit_breaker, key, loader):
+    """Return a function which runs ``loader`` through ``circuit_breaker``."""
+    return lambda: circuit_breaker.call(loader, key)
+
+
+def _bind_revalidating_cache(adapter, key, loader, refresh_loader):
+    """
+    Return a function which gets the result of ``loader`` from the
+    ``revalidating_cache`` of ``adapter``, which refreshes it with
+    ``refresh_loader``.
+    
+    """
+    dbsession = adapter.dbsession
+    if hasattr(dbsession, 'remove'):
+        tenant = key[1]
+        def refresh():
+            # Run in another thread, with its own session:
+            with current_tenant(tenant):
+                try:
+                    return refresh_loader()
+                finally:
+                    dbsession.remove()
+    else:
+        # The session must not be used by other threads:
+        refresh = None
+    return lambda: adapter.revalidating_cache.get(key, loader, refresh)
+
+
+class _BaseSessionAdapter(BaseSourceAdapter):
+    """
+    Base class for the source adapters which use an SQLAlchemy session.
+    
+    The adapters keep no per-query state, so they may be shared by many
+    threads as long as ``dbsession`` gives each thread its own session (e.g.,
+    it's a ``scoped_session``). The state of a :meth:`batch` is kept per
+    thread too.
+    
+    """
+
+    def __init__(self, dbsession):
+        """
+        Create a source adapter on top of ``dbsession``.
+
+        :param dbsession: The SQLAlchemy session.
+
+        """
+        super(_BaseSessionAdapter, self).__init__()
+        self.dbsession = dbsession
+        # The SingleFlight to coalesce concurrent identical reads, if any:
+        self.single_flight = None
+        # The RevalidatingCache of the sections found, if any:
+        self.revalidating_cache = None
+        # The CircuitBreaker of the database calls, if any:
+        self.circuit_breaker = None
+        # The state of the current thread (e.g., whether it's in a batch):
+        self._thread_state = local()
+        # Whether warm_up_sql_adapters() has been run on this adapter:
+        self.warmed_up = False
+        # The ChangeLog where the write operations are recorded, if any:
+        self.changelog = None
+
+    def _get_in_batch(self):
+        return getattr(self._thread_state, 'in_batch', False)
+
+    def _set_in_batch(self, in_batch):
+        self._thread_state.in_batch = in_batch
+
+    # Whether the write operations of the current thread are run in a batch:
+    _in_batch = property(_get_in_batch, _set_in_batch)
+
+    @contextmanager
+    def batch(self):
+        """
+        Run all the write operations in the ``with`` block in one transaction.
+        
+        Inside the block, the adapter doesn't commit after every operation:
+        Pending changes are only flushed when a subsequent query needs them,
+        and they are all committed at once when the block is left. If an
+        exception is raised, the whole batch is rolled back and the exception
+        is propagated.
+        
+        Like the individual write operations, a batch runs in a subtransaction
+        of ``dbsession``, so if the session already had a transaction in
+        progress, that one must be rolled back too after a failed batch.
+        
+        Example::
+        
+            with groups.batch():
+                for group_name, members in new_groups.items():
+                    groups.create_section(group_name)
+                    groups.include_items(group_name, members)
+        
+        Nested batches join the outermost one.
+        
+        """
+        if self._in_batch:
+            yield self
+            return
+        self.dbsession.begin(subtransactions=True)
+        self._in_batch = True
+        try:
+            try:
+                yield self
+            finally:
+                self._in_batch = False
+            self.dbsession.commit()
+            self._forget_shared_results()
+        except:
+            self.dbsession.rollback()
+            # The sections cached by BaseSourceAdapter may reflect the changes
+            # that have just been rolled back:
+            self.loaded_sections = {}
+            self.all_sections_loaded = False
+            self._forget_request_memo()
+            self._forget_shared_results()
+            raise
+
+    def reconcile(self, desired, chunk_size=1000):
+        """
+        Make each section in ``desired`` contain exactly the items given.
+        
+        :param desired: The items that each section should contain, by
+            section name; other sections are left alone.
+        :type desired: dict
+        :param chunk_size: The number of sections reconciled at once.
+        :return: The items that were ``included`` in and ``excluded`` from
+            each section that changed, by section name.
+        :rtype: dict
+        :raise NonExistingSectionError: If a section doesn't exist.
+        :raise SourceError: If an item doesn't exist.
+        
+        Unlike calling :meth:`exclude_items` and :meth:`include_items` for
+        every section, the current items of a whole chunk of sections are
+        loaded in one query and only the difference is written, with one
+        DELETE per section and one INSERT per chunk. For example::
+        
+            changes = groups.reconcile({
+                u'admins': set([u'rms']),
+                u'developers': set([u'linus', u'guido']),
+                })
+            # changes == {u'developers': {'included': set([u'guido']),
+            #                             'excluded': set([u'rms'])}}
+        
+        Each chunk is committed on its own, unless the reconciliation is run
+        in a :meth:`batch`.
+        
+        """
+        from repoze.what.plugins.sql.bulk import _reconcile
+        self._check_writable()
+        return _reconcile(self, desired, chunk_size)
+
+    def create_sections(self, sections, chunk_size=1000):
+        """
+        Create the sections in ``sections`` which don't exist yet.
+        
+        :param sections: The names of the sections.
+        :param chunk_size: The number of names looked up at once.
+        :return: The names of the sections created.
+        :rtype: set
+        
+        Unlike calling :meth:`create_section` for every section, the existing
+        names are looked up with one query per chunk and the new sections
+        are inserted with a single statement, which is committed once (or
+        along with the :meth:`batch` it's run in). For example::
+        
+            groups.create_sections([u'admins', u'designers', u'artists'])
+            # returns set([u'designers', u'artists'])
+        
+        """
+        from repoze.what.plugins.sql.bulk import _create_sections
+        self._check_writable()
+        return _create_sections(self, sections, chunk_size)
+
+    def _begin(self):
+        """Start the transaction of a write operation, unless in a batch."""
+        if not self._in_batch:
+            self.dbsession.begin(subtransactions=True)
+
+    def _commit(self):
+        """Commit the transaction of a write operation, unless in a batch."""
+        # The results memoized in this request may be outdated now:
+        self._forget_request_memo()
+        if not self._in_batch:
+            self.dbsession.commit()
+            # Once committed, so that no refresh brings back the old sections:
+            self._forget_shared_results()
+
+    def _log_changes(self, operation, entries):
+        """
+        Record the ``(section, item)`` pairs affected by ``operation`` in the
+        change log, if any, along with the current tenant.
+        
+        It must be called within the transaction of the write operation.
+        
+        """
+        if self.changelog is not None:
+            self.changelog.record(self.dbsession, self.changelog_source,
+                                  operation, entries, self._get_tenant())
+
+    def _read(self, kind, key, loader, refresh_loader=None):
+        """
+        Return the result of the read operation ``loader``.
+        
+        Within a request wrapped by
+        :class:`~repoze.what.plugins.sql.middleware.AdapterMemoMiddleware`,
+        the result is memoized by ``kind`` and ``key`` until the request ends
+        (or until the next write operation). And if the adapter has a
+        :class:`~repoze.what.plugins.sql.cache.SingleFlight`, concurrent
+        reads of the same ``kind`` and ``key`` share the same call.
+        
+        The sections found (i.e., the reads of the ``"sections"`` kind) are
+        also cached across requests by the adapter's
+        :class:`~repoze.what.plugins.sql.cache.RevalidatingCache`, if any.
+        It calls ``refresh_loader`` (by default, ``loader``) in the
+        background, after the current request may have finished.
+        
+        If the adapter has a
+        :class:`~repoze.what.plugins.sql.breaker.CircuitBreaker`,
+        ``loader`` is only called while it's closed; otherwise, the last
+        result it returned for the same ``kind`` and ``key`` is used.
+        
+        Callers always get their own copy of the resulting sets.
+        
+        """
+        memo_key = (self, self._get_tenant(), kind, key)
+        if refresh_loader is None:
+            refresh_loader = loader
+        if self.circuit_breaker is not None:
+            loader = _bind_circuit_breaker(self.circuit_breaker, memo_key,
+                                           loader)
+            refresh_loader = _bind_circuit_breaker(self.circuit_breaker,
+                                                   memo_key, refresh_loader)
+        if self.single_flight is not None:
+            loader = _bind_single_flight(self.single_flight, memo_key, loader)
+        if self.revalidating_cache is not None and kind == 'sections':
+            loader = _bind_revalidating_cache(self, memo_key, loader,
+                                              refresh_loader)
+        memo = get_request_memo()
+        if memo is None:
+            result = loader()
+        elif memo_key in memo:
+            result = memo[memo_key]
+        else:
+            result = memo[memo_key] = loader()
+        if isinstance(result, set):
+            result = set(result)
+        return result
+
+    # BaseSourceAdapter
+    def _check_writable(self):
+        super(_BaseSessionAdapter, self)._check_writable()
+        if self.circuit_breaker is not None:
+            # Failing fast rather than waiting for a database that's down:
+            self.circuit_breaker.check()
+
+    def _forget_request_memo(self):
+        """Discard the results memoized in the current request, if any."""
+        memo = get_request_memo()
+        if memo:
+            memo.clear()
+
+    def _forget_shared_results(self):
+        """
+        Discard the results kept across requests by the revalidating cache
+        and the circuit breaker, if any.
+        
+        """
+        if self.revalidating_cache is not None:
+            self.revalidating_cache.clear()
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.clear()
+
+    def _forget_missing_section(self, section_name):
+        """Remove the section from the negative cache, if any."""
+        pass
+
+    def _get_tenant(self):
+        """Return the current tenant, if the adapter supports tenants."""
+        return None
+
+    def _expire_collections(self, section_names, item_names):
+        """
+        Expire the collections loaded from the session which may no longer
+        reflect the items of ``section_names`` or the sections of
+        ``item_names``.
+        
+        ``None`` stands for all the sections or items in the session.
+        
+        """
+        pass
 
 
-class _BaseSqlAdapter(BaseSourceAdapter):
+class _BaseSqlAdapter(_BaseSessionAdapter):
     """Base class for SQL source adapters."""
 
     def __init__(self, parent_class, children_class, dbsession):
@@ -84,15 +385,93 @@ class _BaseSqlAdapter(BaseSourceAdapter):
         :param dbsession: The SQLAlchemy session.
 
         """
-        super(_BaseSqlAdapter, self).__init__()
-        self.dbsession = dbsession
+        # The attribute with the tenant of the sections and items, if any,
+        # and the TenantCaches of the sections loaded (both are needed by
+        # BaseSourceAdapter.__init__()):
+        self.tenant_attribute = None
+        self.tenant_caches = None
+        super(_BaseSqlAdapter, self).__init__(dbsession)
         self.parent_class = parent_class
         self.children_class = children_class
+        self.loader_strategy = 'joined'
+        # The NegativeCache of the items that don't exist, if any:
+        self.negative_cache = None
+        # The cached result of _get_sections_loading(), along with the
+        # settings it was computed for:
+        self._sections_loading = None
+
+    def _get_loaded_sections(self):
+        if self.tenant_attribute is None:
+            return self._loaded_sections
+        return self._get_tenant_caches().get(self._get_tenant())
+
+    def _set_loaded_sections(self, sections):
+        if self.tenant_attribute is None:
+            self._loaded_sections = sections
+        else:
+            self._get_tenant_caches().set(self._get_tenant(), sections)
+
+    # The sections cached by BaseSourceAdapter, for the current tenant if the
+    # adapter supports tenants:
+    loaded_sections = property(_get_loaded_sections, _set_loaded_sections)
+
+    def _get_all_sections_loaded(self):
+        if self.tenant_attribute is None:
+            return self._all_sections_loaded
+        return self._get_tenant_caches().get(self._get_tenant()) \
+            .all_sections_loaded
+
+    def _set_all_sections_loaded(self, loaded):
+        if self.tenant_attribute is None:
+            self._all_sections_loaded = loaded
+        else:
+            cache = self._get_tenant_caches().get(self._get_tenant())
+            # The sections may have been too many to be cached:
+            cache.all_sections_loaded = loaded and not cache.discarded
+
+    # Whether all the sections are cached by BaseSourceAdapter:
+    all_sections_loaded = property(_get_all_sections_loaded,
+                                   _set_all_sections_loaded)
+
+    def _get_tenant_caches(self):
+        if self.tenant_caches is None:
+            self.tenant_caches = TenantCaches()
+        return self.tenant_caches
+
+    def _get_tenant(self):
+        """
+        Return the current tenant, if the adapter supports tenants.
+        
+        :raises SourceError: If it does, but there's no current tenant.
+        
+        """
+        if self.tenant_attribute is None:
+            return None
+        return _require_current_tenant()
+
+    def _filter_tenant(self, query, mapped_class):
+        """Restrict ``query`` to the rows of the current tenant, if any."""
+        if self.tenant_attribute is None:
+            return query
+        tenant_field = getattr(mapped_class, self.tenant_attribute)
+        return query.filter(tenant_field==self._get_tenant())
+
+    # BaseSourceAdapter
+    def get_all_sections(self):
+        # Unlike BaseSourceAdapter, returning the sections even if they're
+        # too many to be cached for the current tenant:
+        if self.all_sections_loaded:
+            return self.loaded_sections
+        sections = self._get_all_sections()
+        self.loaded_sections = sections
+        self.all_sections_loaded = True
+        return sections
 
     # BaseSourceAdapter
     def _get_all_sections(self):
         sections = {}
-        sections_as_rows = self.dbsession.query(self.parent_class).all()
+        query = self.dbsession.query(self.parent_class)
+        sections_as_rows = self._filter_tenant(query, self.parent_class).all()
         for section_as_row in sections_as_rows:
             section_name = getattr(section_as_row,
                                    self.translations['section_name'])
@@ -101,6 +480,10 @@ class _BaseSqlAdapter(BaseSourceAdapter):
 
     # BaseSourceAdapter
     def _get_section_items(self, section):
+        return self._read('section_items', section,
+                          lambda: self._load_section_items(section))
+
+    def _load_section_items(self, section):
         section_as_row = self._get_section_as_row(section)
         # A short-cut a translation:
         item_name = self.translations['item_name']
@@ -108,25 +491,23 @@ class _BaseSqlAdapter(BaseSourceAdapter):
         items_as_rowset = getattr(section_as_row, self.translations['items'])
         return set((getattr(i, item_name) for i in items_as_rowset))
 
-    # TODO: Factor out the common code in _include_items and _exclude_items
-
     # BaseSourceAdapter
     def _include_items(self, section, items):
-        self.dbsession.begin(subtransactions=True)
+        self._begin()
         item, included_items = self._get_items_as_rowset(section)
-        for item_to_include in items:
-            item_as_row = self._get_item_as_row(item_to_include)
+        for item_as_row in self._get_items_as_rows(items):
             included_items.append(item_as_row)
-        self.dbsession.commit()
+        self._log_changes(INCLUDE, [(section, i) for i in items])
+        self._commit()
 
     # BaseSourceAdapter
     def _exclude_items(self, section, items):
-        self.dbsession.begin(subtransactions=True)
+        self._begin()
         item, included_items = self._get_items_as_rowset(section)
-        for item_to_exclude in items:
-            item_as_row = self._get_item_as_row(item_to_exclude)
+        for item_as_row in self._get_items_as_rows(items):
             included_items.remove(item_as_row)
-        self.dbsession.commit()
+        self._log_changes(EXCLUDE, [(section, i) for i in items])
+        self._commit()
 
     # BaseSourceAdapter
     def _item_is_included(self, section, item):
@@ -134,30 +515,70 @@ class _BaseSqlAdapter(BaseSourceAdapter):
 
     # BaseSourceAdapter
     def _create_section(self, section):
-        self.dbsession.begin(subtransactions=True)
+        self._begin()
         section_as_row = self.parent_class()
         # Creating the section with an empty set of items:
         setattr(section_as_row, self.translations['section_name'], section)
         setattr(section_as_row, self.translations['items'], [])
+        if self.tenant_attribute is not None:
+            setattr(section_as_row, self.tenant_attribute, self._get_tenant())
         self.dbsession.add(section_as_row)
-        self.dbsession.commit()
+        self._log_changes(CREATE, [(section, None)])
+        self._commit()
+        self._forget_missing_section(section)
 
     # BaseSourceAdapter
     def _edit_section(self, section, new_section):
-        self.dbsession.begin(subtransactions=True)
-        section_as_row = self._get_section_as_row(section)
-        setattr(section_as_row, self.translations['section_name'], new_section)
-        self.dbsession.commit()
+        section_name = self.translations['section_name']
+        field = getattr(self.parent_class, section_name)
+        self._begin()
+        # Renaming the section with a single UPDATE, without loading it. The
+        # pending changes are flushed first, in case they involve the section
+        # (e.g., if it was created in this batch); the sections already in
+        # the session are renamed too.
+        self.dbsession.flush()
+        query = self.dbsession.query(self.parent_class).filter(field==section)
+        query = self._filter_tenant(query, self.parent_class)
+        query.update({section_name: new_section},
+                     synchronize_session='evaluate')
+        self._log_changes(EDIT, [(section, new_section)])
+        self._commit()
+        self._forget_missing_section(new_section)
 
     # BaseSourceAdapter
     def _delete_section(self, section):
-        self.dbsession.begin(subtransactions=True)
-        section_as_row = self._get_section_as_row(section)
-        self.dbsession.delete(section_as_row)
-        self.dbsession.commit()
+        tables = self._get_tables()
+        if tables is None:
+            self._begin()
+            section_as_row = self._get_section_as_row(section)
+            self.dbsession.delete(section_as_row)
+            self._log_changes(DELETE, [(section, None)])
+            self._commit()
+            return
+        from sqlalchemy import select
+        field = getattr(self.parent_class, self.translations['section_name'])
+        self._begin()
+        # Deleting the items of the section and then the section itself, with
+        # two statements, instead of loading the items for the ORM to cascade:
+        self.dbsession.flush()
+        section_key = select([tables.section_key],
+                             tables.section_name==section)
+        self.dbsession.execute(tables.association.delete(
+            tables.association_section.in_(section_key)))
+        self.dbsession.query(self.parent_class).filter(field==section) \
+            .delete(synchronize_session='evaluate')
+        # The items in the session may still have the section in their
+        # collections:
+        self._expire_collections((), None)
+        self._log_changes(DELETE, [(section, None)])
+        self._commit()
 
     # BaseSourceAdapter
     def _section_exists(self, section):
+        return self._read('section_exists', section,
+                          lambda: self._load_section_exists(section))
+
+    def _load_section_exists(self, section):
         # TODO: There must be a more elegant way to do this with SQLAlchemy
         try:
             self._get_section_as_row(section)
@@ -175,8 +596,10 @@ class _BaseSqlAdapter(BaseSourceAdapter):
         """
         # "field" usually equals to {tg_package}.model.Group.group_name
         # or {tg_package}.model.Permission.permission_name
+        from sqlalchemy.orm.exc import NoResultFound
         field = getattr(self.parent_class, self.translations['section_name'])
         query = self.dbsession.query(self.parent_class)
+        query = self._filter_tenant(query, self.parent_class)
         try:
             section_as_row = query.filter(field==section_name).one()
         except NoResultFound:
@@ -193,26 +616,167 @@ class _BaseSqlAdapter(BaseSourceAdapter):
         with a permission source, the item is a group.
 
         """
+        from sqlalchemy.orm.exc import NoResultFound
+        if self._is_missing_item(item_name):
+            raise SourceError(self._missing_item_message(item_name))
         # "field" usually equals to {tg_package}.model.User.user_name
         # or {tg_package}.model.Group.group_name
         field = getattr(self.children_class, self.translations['item_name'])
         
-        # Eagerload the sections, unless they are dynamically computed by a
-        # property on the "self.children_class":
+        # Load the sections along with the item, unless they are dynamically
+        # computed by a property on the "self.children_class" or the loader
+        # strategy says otherwise:
         query = self.dbsession.query(self.children_class)
-        try:
-            query = query.options(eagerload(self.translations['sections']))
-        except InvalidRequestError:
-            pass
+        query = self._filter_tenant(query, self.children_class)
+        loader_option = self._get_sections_loading()[1]
+        if loader_option is not None:
+            query = query.options(loader_option)
         
         try:
             item_as_row = query.filter(field==item_name).one()
         except NoResultFound:
-            msg = 'Item (%s) "%s" does not exist in the child table'
-            msg = msg % (self.translations['item_name'], item_name)
-            raise SourceError(msg)
+            self._remember_missing_item(item_name)
+            raise SourceError(self._missing_item_message(item_name))
         return item_as_row
 
+    def _missing_item_message(self, item_name):
+        msg = 'Item (%s) "%s" does not exist in the child table'
+        return msg % (self.translations['item_name'], item_name)
+
+    def _is_missing_item(self, item_name):
+        """Check if the item is known not to exist by the negative cache."""
+        return self.negative_cache is not None and \
+               self._get_negative_key(self.children_class, item_name) in \
+               self.negative_cache
+
+    def _remember_missing_item(self, item_name):
+        """Record in the negative cache that the item doesn't exist."""
+        if self.negative_cache is not None:
+            self.negative_cache.add(
+                self._get_negative_key(self.children_class, item_name))
+
+    def _forget_missing_section(self, section_name):
+        """
+        Remove the section from the negative cache.
+        
+        The negative cache is usually shared with an adapter whose items are
+        the sections of this one (e.g., the groups of the permission adapter).
+        
+        """
+        if self.negative_cache is not None:
+            self.negative_cache.discard(
+                self._get_negative_key(self.parent_class, section_name))
+
+    def _get_negative_key(self, mapped_class, name):
+        """Return the key of the row called ``name`` in the negative cache."""
+        if self.tenant_attribute is None:
+            return (mapped_class, name)
+        return (mapped_class, name, self._get_tenant())
+
+    def _check_translations(self):
+        """
+        Make sure the translations refer to existing attributes.
+        
+        :raises SourceError: If any of them doesn't.
+        
+        """
+        from sqlalchemy.orm import class_mapper
+        for (mapped_class, translations) in (
+            (self.parent_class, ('section_name', 'items')),
+            (self.children_class, ('item_name', 'sections'))):
+            # Compiling the mappers, so that the backrefs are defined:
+            class_mapper(mapped_class)
+            for translation in translations:
+                _check_attribute(mapped_class, self.translations[translation],
+                                 translation)
+            if self.tenant_attribute is not None:
+                _check_attribute(mapped_class, self.tenant_attribute,
+                                 'tenant_attribute')
+        self._get_sections_loading()
+
+    def _expire_collections(self, section_names, item_names):
+        from sqlalchemy.orm.attributes import instance_state
+        section_name = self.translations['section_name']
+        item_name = self.translations['item_name']
+        expirations = [(self.parent_class, section_name, section_names,
+                        self.translations['items'])]
+        if self._get_sections_loading()[0]:
+            expirations.append((self.children_class, item_name, item_names,
+                                self.translations['sections']))
+        for instance in list(self.dbsession.identity_map.values()):
+            for (mapped_class, name, names, collection) in expirations:
+                if not isinstance(instance, mapped_class):
+                    continue
+                # Not loading the expired names:
+                name = instance_state(instance).dict.get(name, None)
+                if name is None or names is None or name in names:
+                    self.dbsession.expire(instance, [collection])
+
+    def _get_sections_loading(self):
+        """
+        Return whether the "sections" of the items are a relationship, and
+        the query option to load them along with the items (if any).
+        
+        This is worked out once for every combination of loader strategy and
+        "sections" translation, instead of on every query.
+        
+        """
+        key = (self.loader_strategy, self.translations['sections'])
+        if self._sections_loading is None or self._sections_loading[0] != key:
+            is_relationship = _is_relationship(self.children_class, key[1])
+            if is_relationship:
+                option = _make_loader_option(key[0], key[1])
+            else:
+                # Still validating the strategy:
+                _make_loader_option(key[0], key[1], validate_only=True)
+                option = None
+            self._sections_loading = (key, (is_relationship, option))
+        return self._sections_loading[1]
+
+    def _get_tables(self):
+        """
+        Return the :class:`~repoze.what.plugins.sql.core._AclTables` behind
+        the relationship between sections and items, so that they can be
+        queried without the ORM.
+        
+        :return: The tables, or ``None`` if the items of the sections are
+            not stored in an association table, the sections of the items
+            are computed by a property or the adapter supports tenants.
+        
+        """
+        from sqlalchemy.orm import class_mapper
+        from repoze.what.plugins.sql.core import _AclTables
+        # The statements on the tables would see all the tenants:
+        if self.tenant_attribute is not None or \
+           not self._get_sections_loading()[0]:
+            return None
+        parent_mapper = class_mapper(self.parent_class)
+        children_mapper = class_mapper(self.children_class)
+        items = parent_mapper.get_property(self.translations['items'])
+        if getattr(items, 'secondary', None) is None or \
+           len(items.synchronize_pairs) != 1 or \
+           len(items.secondary_synchronize_pairs) != 1:
+            return None
+        section_name = parent_mapper.get_property(
+            self.translations['section_name']).columns[0]
+        item_name = children_mapper.get_property(
+            self.translations['item_name']).columns[0]
+        section_keys = items.synchronize_pairs[0]
+        item_keys = items.secondary_synchronize_pairs[0]
+        return _AclTables(section_keys[0].table, item_keys[0].table,
+                          items.secondary, section_name.key, item_name.key,
+                          section_keys, item_keys)
+
+    def _get_items_as_rows(self, item_names):
+        """
+        Return the SQLAlchemy rows for the items called ``item_names``.
+        
+        All of them are looked up before the caller modifies any collection,
+        so that the changes are flushed together instead of once per item.
+        
+        """
+        return [self._get_item_as_row(item_name) for item_name in item_names]
+
     def _get_items_as_rowset(self, section_name):
         """
         Return the items of the section called ``section_name``.
@@ -231,6 +795,111 @@ class _BaseSqlAdapter(BaseSourceAdapter):
         return section_as_row, items_as_rowset
 
 
+def _check_attribute(mapped_class, attribute, translation):
+    """
+    Make sure ``mapped_class`` has ``attribute``, set by ``translation``.
+    
+    :raises SourceError: If it doesn't.
+    
+    """
+    if not hasattr(mapped_class, attribute):
+        msg = 'Class "%s" has no attribute "%s" (translation "%s")'
+        raise SourceError(msg % (mapped_class.__name__, attribute,
+                                 translation))
+
+
+def _is_relationship(mapped_class, attribute):
+    """
+    Check whether ``attribute`` of ``mapped_class`` is an SQLAlchemy
+    relationship (as opposed to, say, a Python property).
+    
+    """
+    from sqlalchemy.orm import class_mapper
+    # Getting the mapper compiles the mappers, so backrefs are set up:
+    class_mapper(mapped_class)
+    prop = getattr(getattr(mapped_class, attribute, None), 'property', None)
+    return getattr(prop, 'direction', None) is not None
+
+
+# The SQLAlchemy loader functions for each strategy, by order of preference:
+_LOADERS = {
+    'joined': ('joinedload', 'eagerload'),
+    'subquery': ('subqueryload', ),
+    'selectin': ('selectinload', ),
+    'none': (),
+    }
+
+
+def _make_loader_option(strategy, relationship, validate_only=False):
+    """
+    Return the query option which loads ``relationship`` with the loader
+    ``strategy``, or ``None`` if it must be loaded lazily.
+    
+    :raises ValueError: If the strategy is unknown or not supported by the
+        installed version of SQLAlchemy.
+    
+    """
+    from sqlalchemy import orm
+    if strategy is None:
+        strategy = 'none'
+    if strategy not in _LOADERS:
+        raise ValueError('Unknown loader strategy "%s"; use one of: %s' %
+                         (strategy, ', '.join(sorted(_LOADERS))))
+    if strategy == 'none':
+        return None
+    for loader_name in _LOADERS[strategy]:
+        loader = getattr(orm, loader_name, None)
+        if loader is not None:
+            break
+    else:
+        raise ValueError('The "%s" loader strategy is not supported by this '
+                         'version of SQLAlchemy' % strategy)
+    if validate_only:
+        return None
+    return loader(relationship)
+
+
+class UserRecord(object):
+    """
+    Read-only snapshot of some columns of a user.
+    
+    The SQL groups adapter stores it in the ``credentials`` instead of the
+    user object when :attr:`SqlGroupsAdapter.user_record_columns` is set. The
+    columns are available as attributes, and as it uses ``__slots__``, it
+    takes much less memory than the mapped object and holds no reference to
+    the session.
+    
+    """
+    
+    __slots__ = ()
+    
+    def __init__(self, values):
+        for (column, value) in zip(self.__slots__, values):
+            object.__setattr__(self, column, value)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is read-only' % self.__class__.__name__)
+    
+    def __repr__(self):
+        values = ['%s=%r' % (c, getattr(self, c)) for c in self.__slots__]
+        return '<UserRecord: %s>' % ', '.join(values)
+
+
+# The UserRecord subclasses, by column names:
+_user_record_classes = {}
+
+
+def _get_user_record_class(columns):
+    """Return the :class:`UserRecord` subclass with ``columns`` as slots."""
+    columns = tuple(columns)
+    record_class = _user_record_classes.get(columns)
+    if record_class is None:
+        record_class = type('UserRecord', (UserRecord, ),
+                            {'__slots__': columns})
+        _user_record_classes[columns] = record_class
+    return record_class
+
+
 #{ Source adapters
 
 
@@ -294,8 +963,94 @@ class SqlGroupsAdapter(_BaseSqlAdapter):
         property name, you'd also need to set the translation for "sections"
         (see above).
     
+    .. attribute:: loader_strategy
+    
+        How the groups of a user are loaded along with the user:
+        
+        * ``"joined"`` (the default): In the same query, with a JOIN. It's
+          the fastest for users in a few groups, but the user row is repeated
+          once per group.
+        * ``"subquery"``: In a second query (SQLAlchemy 0.6+).
+        * ``"selectin"``: In a second query, with an IN clause (SQLAlchemy
+          1.2+).
+        * ``"none"``: Lazily, when they're accessed.
+        
+        It's ignored when the groups are computed by a property.
+        ``benchmarks/bench_loaders.py`` compares them on your database.
+    
+    .. attribute:: user_record_columns
+    
+        The names of the attributes of ``user_class`` to be loaded into a
+        :class:`UserRecord` when the groups of a user are looked up, or
+        ``None`` (the default) to load the user object instead.
+        
+        The record is stored in the ``credentials`` under the
+        ``repoze.what.userobj`` key, and it's loaded in the same query as the
+        names of the groups. For example::
+        
+            groups.user_record_columns = ('user_id', 'user_name', 'email')
+        
+        If the ``credentials`` already contain a user object (e.g., loaded
+        by a :mod:`repoze.who` plugin), its groups are used as usual.
+    
+    .. attribute:: negative_cache
+    
+        The :class:`~repoze.what.plugins.sql.cache.NegativeCache` where the
+        users that don't exist are remembered for a while, or ``None`` (the
+        default) to query the database every time.
+    
+    .. attribute:: single_flight
+    
+        The :class:`~repoze.what.plugins.sql.cache.SingleFlight` which makes
+        concurrent threads share the same query when they look up the same
+        data at the same time, or ``None`` (the default).
+    
+    .. attribute:: revalidating_cache
+    
+        The :class:`~repoze.what.plugins.sql.cache.RevalidatingCache` where
+        the groups of each user are cached across requests, or ``None`` (the
+        default). Once they've expired, they're still served for a while and
+        refreshed in the background. As the cached groups don't come with the
+        user object, it's not stored in the ``credentials`` on a cache hit.
+    
+    .. attribute:: circuit_breaker
+    
+        The :class:`~repoze.what.plugins.sql.breaker.CircuitBreaker` which
+        stops the adapter from querying the database while it's failing or
+        too slow, or ``None`` (the default). While it's open, the last groups
+        found for each user are served and write operations fail right away.
+    
+    .. attribute:: changelog
+    
+        The :class:`~repoze.what.plugins.sql.changelog.ChangeLog` where the
+        changes to the groups are recorded, or ``None`` (the default).
+    
+    .. attribute:: tenant_attribute
+    
+        The name of the attribute of ``group_class`` and ``user_class`` with
+        the tenant each row belongs to, or ``None`` (the default) if there's
+        a single tenant. When it's set, the adapter only sees the groups and
+        users of the current tenant (see
+        :mod:`repoze.what.plugins.sql.tenancy`).
+    
+    .. attribute:: tenant_caches
+    
+        The :class:`~repoze.what.plugins.sql.tenancy.TenantCaches` where the
+        groups loaded are cached per tenant; by default, one with the default
+        limits is created when it's first needed.
+    
+    .. versionadded:: 1.1
+        The :attr:`loader_strategy`, :attr:`user_record_columns`,
+        :attr:`negative_cache`, :attr:`single_flight`,
+        :attr:`revalidating_cache`, :attr:`circuit_breaker`,
+        :attr:`changelog`, :attr:`tenant_attribute` and
+        :attr:`tenant_caches` attributes.
+    
     """
 
+    # The source of the changes recorded in the change log:
+    changelog_source = u'group'
+
     def __init__(self, group_class, user_class, dbsession):
         """
         Create an SQL groups source adapter.
@@ -314,11 +1069,28 @@ class SqlGroupsAdapter(_BaseSqlAdapter):
             'item_name': 'user_name',
             'items': 'users'
         }
+        self.user_record_columns = None
 
     # BaseSourceAdapter
     def _find_sections(self, credentials):
+        user_name = credentials['repoze.what.userid']
+        # The background refreshes must not touch the credentials of a
+        # request which may be over:
+        return self._read('sections', user_name,
+                          lambda: self._load_sections(credentials),
+                          lambda: self._load_sections(
+                              {'repoze.what.userid': user_name}))
+
+    def _load_sections(self, credentials):
         id_ = credentials['repoze.what.userid']
         user = credentials.get('repoze.what.userobj', None)
+        if self.user_record_columns is not None and \
+           (user is None or isinstance(user, UserRecord)):
+            record_and_groups = self._get_user_record(id_)
+            if record_and_groups is None:
+                return set()
+            credentials['repoze.what.userobj'] = record_and_groups[0]
+            return record_and_groups[1]
         if user is None:
             try:
                 user = self._get_item_as_row(id_)
@@ -330,6 +1102,50 @@ class SqlGroupsAdapter(_BaseSqlAdapter):
         return set([getattr(group, self.translations['section_name'])
                     for group in user_memberships])
 
+    def _check_translations(self):
+        super(SqlGroupsAdapter, self)._check_translations()
+        for column in self.user_record_columns or ():
+            _check_attribute(self.children_class, column,
+                             'user_record_columns')
+
+    def _get_user_record(self, user_name):
+        """
+        Return the :class:`UserRecord` for the user called ``user_name`` and
+        the names of the groups, or ``None`` if the user doesn't exist.
+        
+        """
+        if self._is_missing_item(user_name):
+            return None
+        record_class = _get_user_record_class(self.user_record_columns)
+        sections = self.translations['sections']
+        if not self._get_sections_loading()[0]:
+            # The groups are computed by the user object itself:
+            try:
+                user = self._get_item_as_row(user_name)
+            except SourceError:
+                return None
+            record = record_class([getattr(user, column) for column in
+                                   self.user_record_columns])
+            groups = set([getattr(g, self.translations['section_name'])
+                          for g in getattr(user, sections)])
+            return record, groups
+        
+        columns = [getattr(self.children_class, column) for column in
+                   self.user_record_columns]
+        group_name = getattr(self.parent_class,
+                             self.translations['section_name'])
+        field = getattr(self.children_class, self.translations['item_name'])
+        query = self.dbsession.query(*(columns + [group_name]))
+        query = self._filter_tenant(query, self.children_class)
+        query = query.outerjoin(getattr(self.children_class, sections))
+        rows = query.filter(field==user_name).all()
+        if not rows:
+            self._remember_missing_item(user_name)
+            return None
+        record = record_class(rows[0][:-1])
+        groups = set([row[-1] for row in rows if row[-1] is not None])
+        return record, groups
+
 
 class SqlPermissionsAdapter(_BaseSqlAdapter):
     """
@@ -391,8 +1207,71 @@ class SqlPermissionsAdapter(_BaseSqlAdapter):
         different property name, you'd also need to set the translation for
         "sections" (see above).
     
+    .. attribute:: loader_strategy
+    
+        How the permissions granted to a group are loaded along with the
+        group: ``"joined"`` (the default), ``"subquery"``, ``"selectin"`` or
+        ``"none"``. See :attr:`SqlGroupsAdapter.loader_strategy`.
+    
+    .. attribute:: negative_cache
+    
+        The :class:`~repoze.what.plugins.sql.cache.NegativeCache` where the
+        groups that don't exist are remembered for a while, or ``None`` (the
+        default) to query the database every time. When it's shared with the
+        group adapter, the groups that adapter creates or renames are
+        forgotten right away.
+    
+    .. attribute:: single_flight
+    
+        The :class:`~repoze.what.plugins.sql.cache.SingleFlight` which makes
+        concurrent threads share the same query when they look up the same
+        data at the same time, or ``None`` (the default).
+    
+    .. attribute:: revalidating_cache
+    
+        The :class:`~repoze.what.plugins.sql.cache.RevalidatingCache` where
+        the permissions of each group are cached across requests, or ``None``
+        (the default). Once they've expired, they're still served for a while
+        and refreshed in the background.
+    
+    .. attribute:: circuit_breaker
+    
+        The :class:`~repoze.what.plugins.sql.breaker.CircuitBreaker` which
+        stops the adapter from querying the database while it's failing or
+        too slow, or ``None`` (the default). While it's open, the last
+        permissions found for each group are served and write operations
+        fail right away.
+    
+    .. attribute:: changelog
+    
+        The :class:`~repoze.what.plugins.sql.changelog.ChangeLog` where the
+        changes to the permissions are recorded, or ``None`` (the default).
+    
+    .. attribute:: tenant_attribute
+    
+        The name of the attribute of ``permission_class`` and
+        ``group_class`` with the tenant each row belongs to, or ``None`` (the
+        default) if there's a single tenant. When it's set, the adapter only
+        sees the permissions and groups of the current tenant (see
+        :mod:`repoze.what.plugins.sql.tenancy`).
+    
+    .. attribute:: tenant_caches
+    
+        The :class:`~repoze.what.plugins.sql.tenancy.TenantCaches` where the
+        permissions loaded are cached per tenant; by default, one with the
+        default limits is created when it's first needed.
+    
+    .. versionadded:: 1.1
+        The :attr:`loader_strategy`, :attr:`negative_cache`,
+        :attr:`single_flight`, :attr:`revalidating_cache`,
+        :attr:`circuit_breaker`, :attr:`changelog`, :attr:`tenant_attribute`
+        and :attr:`tenant_caches` attributes.
+    
     """
 
+    # The source of the changes recorded in the change log:
+    changelog_source = u'permission'
+
     def __init__(self, permission_class, group_class, dbsession):
         """
         Create an SQL permissions source adapter.
@@ -417,6 +1296,10 @@ class SqlPermissionsAdapter(_BaseSqlAdapter):
 
     # BaseSourceAdapter
     def _find_sections(self, group_name):
+        return self._read('sections', group_name,
+                          lambda: self._load_sections(group_name))
+
+    def _load_sections(self, group_name):
         try:
             group = self._get_item_as_row(group_name)
         except SourceError:
@@ -432,7 +1315,12 @@ class SqlPermissionsAdapter(_BaseSqlAdapter):
 
 
 def configure_sql_adapters(user_class, group_class, permission_class, session,
-                           group_translations={}, permission_translations={}):
+                           group_translations={}, permission_translations={},
+                           user_record_columns=None, loader_strategy='joined',
+                           negative_cache=None, single_flight=None,
+                           changelog=None, check_indexes=False,
+                           tenant_attribute=None, revalidating_cache=None,
+                           circuit_breaker=None):
     """
     Configure and return group and permission adapters that share the same model.
     
@@ -442,6 +1330,29 @@ def configure_sql_adapters(user_class, group_class, permission_class, session,
     :param dbsession: The SQLALchemy/Elixir session to be used.
     :param group_translations: The dictionary of translations for the group.
     :param permission_translations: The dictionary of translations for the permissions.
+    :param user_record_columns: The columns of the user to be loaded into
+        a :class:`UserRecord` instead of loading the user object (see
+        :attr:`SqlGroupsAdapter.user_record_columns`).
+    :param loader_strategy: How the sections of the items are loaded by both
+        adapters (see :attr:`SqlGroupsAdapter.loader_strategy`).
+    :param negative_cache: The :class:`NegativeCache` to be shared by both
+        adapters, if any.
+    :param single_flight: The :class:`SingleFlight` to be shared by both
+        adapters, if any.
+    :param changelog: The :class:`ChangeLog` where both adapters record
+        their changes, if any.
+    :param check_indexes: Whether to warn about the indexes needed by the
+        adapters which are missing in the database, with a
+        :class:`~repoze.what.plugins.sql.indexes.MissingIndexWarning`.
+    :param tenant_attribute: The name of the attribute of the three classes
+        with the tenant each row belongs to, if any (see
+        :attr:`SqlGroupsAdapter.tenant_attribute`).
+    :param revalidating_cache: The :class:`RevalidatingCache` to be shared by
+        both adapters, if any.
+    :param circuit_breaker: The
+        :class:`~repoze.what.plugins.sql.breaker.CircuitBreaker` to be shared
+        by both adapters, if any.
+    :raises ValueError: If the ``loader_strategy`` is not supported.
     :return: The ``group`` and ``permission`` adapters, configured.
     :rtype: dict 
     
@@ -463,15 +1374,154 @@ def configure_sql_adapters(user_class, group_class, permission_class, session,
         # ...
 
     """
+    # Validating the strategy now, rather than on the first request:
+    _make_loader_option(loader_strategy, None, validate_only=True)
     r = {}
     if group_class is not None:
         group = SqlGroupsAdapter(group_class, user_class, session)
         group.translations.update(group_translations)
+        group.user_record_columns = user_record_columns
+        group.loader_strategy = loader_strategy
+        group.negative_cache = negative_cache
+        group.single_flight = single_flight
+        group.changelog = changelog
+        group.tenant_attribute = tenant_attribute
+        group.revalidating_cache = revalidating_cache
+        group.circuit_breaker = circuit_breaker
         r['group'] = group
     if permission_class is not None:
         permission = SqlPermissionsAdapter(permission_class, group_class, session)
         permission.translations.update(permission_translations)
+        permission.loader_strategy = loader_strategy
+        permission.negative_cache = negative_cache
+        permission.single_flight = single_flight
+        permission.changelog = changelog
+        permission.tenant_attribute = tenant_attribute
+        permission.revalidating_cache = revalidating_cache
+        permission.circuit_breaker = circuit_breaker
         r['permission'] = permission
+    if check_indexes:
+        _warn_missing_indexes(r)
     return r
 
+
+def _warn_missing_indexes(adapters):
+    """Warn about the indexes needed by ``adapters`` which are missing."""
+    import warnings
+    from repoze.what.plugins.sql.indexes import find_missing_indexes, \
+                                                MissingIndexWarning
+    for index in find_missing_indexes(adapters):
+        msg = 'Table "%s" needs %s index on (%s)' % (
+            index.table.name, 'a unique' if index.unique else 'an',
+            ', '.join(index.columns))
+        warnings.warn(msg, MissingIndexWarning, stacklevel=3)
+
+
+def warm_up_sql_adapters(adapters, hot_users=(), pool_size=None,
+                         load_members=False):
+    """
+    Get the adapters returned by :func:`configure_sql_adapters` ready to
+    serve requests.
+    
+    :param adapters: The ``group`` and ``permission`` adapters.
+    :type adapters: dict
+    :param hot_users: The names of the users whose groups and permissions
+        should be loaded (e.g., the most recently active ones).
+    :param pool_size: The number of connections to be opened in the pool of
+        the engine; by default, the size of the pool.
+    :param load_members: Whether to load the members of the groups of the
+        ``hot_users`` and the groups granted their permissions, too.
+    :raises SourceError: If a translation refers to an attribute that doesn't
+        exist, or if the database can't be reached.
+    :raises ValueError: If ``hot_users`` are given but nothing would keep
+        what's loaded for them: Neither ``load_members`` is set nor the
+        adapters have a ``revalidating_cache``.
+    
+    The first requests served by a new process are usually slow, because
+    connections are opened lazily and nothing is cached. This function:
+    
+    #. Opens ``pool_size`` connections and returns them to the pool.
+    #. Compiles the mappers and checks the translations of the adapters.
+    #. Looks up the groups of the ``hot_users`` and the permissions granted
+       to those groups, as loading their credentials does. The results are
+       kept by the ``revalidating_cache`` of the adapters (and by their
+       ``circuit_breaker``, if any, for when the database is down); without
+       a revalidating cache, the next requests look them up again.
+    #. If ``load_members`` is set, loads the members of those groups and the
+       groups granted those permissions into the adapters' cache of
+       sections. Beware that a group every user belongs to has as many
+       members as there are users.
+    
+    Then it sets the ``warmed_up`` attribute of the adapters, which
+    readiness checks may report. For example::
+    
+        adapters = configure_sql_adapters(User, Group, Permission, DBSession)
+        warm_up_sql_adapters(adapters, hot_users=recent_user_names())
+        
+        def is_ready():
+            return all(a.warmed_up for a in adapters.values())
+    
+    It can be used on the SQLAlchemy Core adapters too.
+    
+    """
+    from sqlalchemy.exc import SQLAlchemyError
+    if hot_users and not load_members:
+        for adapter in adapters.values():
+            if getattr(adapter, 'revalidating_cache', None) is None:
+                raise ValueError('The sections of the hot users would not be '
+                                 'kept without a revalidating cache')
+    engines = []
+    for adapter in adapters.values():
+        check_translations = getattr(adapter, '_check_translations', None)
+        if check_translations is not None:
+            check_translations()
+        engine = adapter.dbsession.get_bind()
+        if engine not in engines:
+            engines.append(engine)
+    try:
+        for engine in engines:
+            _fill_pool(engine, pool_size)
+    except SQLAlchemyError as exc:
+        raise SourceError('Could not connect to the database: %s' % exc)
+    
+    group_adapter = adapters.get('group')
+    permission_adapter = adapters.get('permission')
+    groups = set()
+    if group_adapter is not None:
+        for user_name in hot_users:
+            credentials = {'repoze.what.userid': user_name}
+            groups |= group_adapter.find_sections(credentials)
+        if load_members:
+            for group in groups:
+                group_adapter.get_section_items(group)
+    if permission_adapter is not None:
+        permissions = set()
+        for group in groups:
+            permissions |= permission_adapter.find_sections(group)
+        if load_members:
+            for permission in permissions:
+                permission_adapter.get_section_items(permission)
+    
+    for adapter in adapters.values():
+        adapter.warmed_up = True
+
+
+def _fill_pool(engine, pool_size=None):
+    """
+    Open ``pool_size`` connections to ``engine`` at once, and return them to
+    its pool.
+    
+    """
+    if pool_size is None:
+        pool_size = getattr(engine.pool, 'size', 1)
+        if callable(pool_size):
+            pool_size = pool_size()
+    connections = []
+    try:
+        for i in range(pool_size):
+            connections.append(engine.connect())
+    finally:
+        for connection in connections:
+            connection.close()
+
 #}
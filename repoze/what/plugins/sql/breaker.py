@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Circuit breaker for the database calls of the SQL adapters.
+
+When the database stalls, every lookup waits until the connection pool gives
+up, and the threads serving the requests pile up in the meantime. A
+:class:`CircuitBreaker` set on the adapters' ``circuit_breaker`` attribute
+keeps track of how their reads go, and *opens* when too many of them fail or
+are too slow::
+
+    from repoze.what.plugins.sql.breaker import CircuitBreaker
+
+    breaker = CircuitBreaker(failure_rate=0.5, slow_call_duration=2)
+    adapters = configure_sql_adapters(User, Group, Permission, DBSession,
+                                      circuit_breaker=breaker)
+
+While it's open, the database is left alone: Each read returns the last
+result it got for the same lookup (e.g., the last groups found for the same
+user), or raises a :class:`CircuitOpenError` if there's none, and write
+operations fail right away with a :class:`CircuitOpenError`. Once
+``reset_timeout`` seconds have passed, it's *half-open*: A few reads are let
+through to probe the database, and the breaker is closed again if they
+succeed or opened again if any of them fails.
+
+Its :attr:`~CircuitBreaker.state` and :meth:`~CircuitBreaker.get_stats` can
+be exported for monitoring.
+
+"""
+
+from collections import deque
+from threading import Lock
+from time import time
+
+from repoze.what.adapters import SourceError
+
+from repoze.what.plugins.sql.cache import OrderedDict, _set_newest
+
+__all__ = ['CircuitBreaker', 'CircuitOpenError', 'CLOSED', 'OPEN',
+           'HALF_OPEN']
+
+
+# The states of a circuit breaker:
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(SourceError):
+    """
+    Exception raised when the database is not called because the circuit
+    breaker is open.
+
+    """
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker which stops calling the database while it's failing.
+
+    The outcome of the last ``window_size`` calls is kept, and the breaker
+    opens when at least ``min_calls`` of them have been made and the share of
+    failures reaches ``failure_rate``. A call fails when it raises an
+    exception other than :class:`~repoze.what.adapters.SourceError` (which
+    the adapters raise when, for example, a section doesn't exist), or when
+    it takes longer than ``slow_call_duration`` seconds.
+
+    It's safe to share among threads and adapters.
+
+    """
+
+    def __init__(self, failure_rate=0.5, window_size=20, min_calls=10,
+                 slow_call_duration=None, reset_timeout=30,
+                 half_open_calls=1, max_results=10000):
+        """
+        Create a closed circuit breaker.
+
+        :param failure_rate: The share of failed calls in the window which
+            opens the breaker, between 0 and 1.
+        :param window_size: The number of recent calls whose outcome is kept.
+        :param min_calls: The minimum number of calls in the window for the
+            breaker to open.
+        :param slow_call_duration: The number of seconds after which a call
+            counts as failed even if it succeeds, or ``None`` to ignore how
+            long calls take.
+        :param reset_timeout: The number of seconds the breaker stays open
+            before it lets calls through to probe the database.
+        :param half_open_calls: The number of probes let through at once
+            while half-open, all of which must succeed for the breaker to
+            close.
+        :param max_results: The maximum number of last known good results
+            kept; the oldest ones are forgotten first.
+
+        """
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.slow_call_duration = slow_call_duration
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.max_results = max_results
+        # Whether each of the latest calls failed:
+        self._outcomes = deque(maxlen=window_size)
+        self._state = CLOSED
+        self._opened_at = None
+        # The probes let through and those which succeeded, while half-open:
+        self._probes = 0
+        self._successful_probes = 0
+        # The last known good result of each key:
+        self._results = OrderedDict()
+        # Increased when the results are cleared, so that the calls started
+        # before then don't store outdated results:
+        self._generation = 0
+        self._rejected_calls = 0
+        self._trips = 0
+        self._lock = Lock()
+
+    @property
+    def state(self):
+        """
+        The current state: :data:`CLOSED`, :data:`OPEN` or
+        :data:`HALF_OPEN`.
+
+        """
+        self._lock.acquire()
+        try:
+            self._update_state()
+            return self._state
+        finally:
+            self._lock.release()
+
+    def call(self, function, key=None):
+        """
+        Call ``function`` unless the breaker is open.
+
+        :param function: The function which calls the database.
+        :param key: The key of the result, to be returned instead of calling
+            ``function`` while the breaker is open; or ``None`` if it must
+            not be kept.
+        :return: The result of ``function``, or its last known good result.
+        :raises CircuitOpenError: If the breaker is open and there's no
+            known result for ``key``.
+
+        """
+        self._lock.acquire()
+        try:
+            allowed = self._allow_call()
+            generation = self._generation
+            if not allowed:
+                self._rejected_calls += 1
+                if key is not None and key in self._results:
+                    return self._results[key]
+        finally:
+            self._lock.release()
+        if not allowed:
+            raise CircuitOpenError('The database is not available')
+        started = time()
+        try:
+            result = function()
+        except SourceError:
+            # The database did answer:
+            self._record(False)
+            raise
+        except:
+            self._record(True)
+            raise
+        duration = time() - started
+        self._record(self.slow_call_duration is not None and
+                     duration > self.slow_call_duration)
+        if key is not None:
+            self._remember(key, result, generation)
+        return result
+
+    def discard(self, key):
+        """Forget the last known good result of ``key``, if any."""
+        self._lock.acquire()
+        try:
+            self._results.pop(key, None)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """
+        Forget all the last known good results (e.g., because the data has
+        changed).
+
+        """
+        self._lock.acquire()
+        try:
+            self._results.clear()
+            self._generation += 1
+        finally:
+            self._lock.release()
+
+    def check(self):
+        """
+        Make sure the breaker is closed, before writing to the database.
+
+        :raises CircuitOpenError: If it's open or half-open.
+
+        """
+        if self.state != CLOSED:
+            raise CircuitOpenError('The database is not available')
+
+    def reset(self):
+        """Close the breaker and forget the outcome of the latest calls."""
+        self._lock.acquire()
+        try:
+            self._close()
+        finally:
+            self._lock.release()
+
+    def get_stats(self):
+        """
+        Return the current state of the breaker, for monitoring.
+
+        :return: The ``state``, the number of ``calls`` in the window and how
+            many of them ``failed``, the number of ``rejected_calls`` and
+            ``trips`` (i.e., times it opened) so far and the number of
+            ``known_results``.
+        :rtype: dict
+
+        """
+        self._lock.acquire()
+        try:
+            self._update_state()
+            return {
+                'state': self._state,
+                'calls': len(self._outcomes),
+                'failed': len([o for o in self._outcomes if o]),
+                'rejected_calls': self._rejected_calls,
+                'trips': self._trips,
+                'known_results': len(self._results),
+                }
+        finally:
+            self._lock.release()
+
+    def _update_state(self):
+        """Make the breaker half-open if it's been open long enough."""
+        if self._state == OPEN and \
+           time() >= self._opened_at + self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+            self._successful_probes = 0
+
+    def _allow_call(self):
+        """Check whether a call may go ahead, counting it as a probe."""
+        self._update_state()
+        if self._state == OPEN:
+            return False
+        if self._state == HALF_OPEN:
+            if self._probes >= self.half_open_calls:
+                return False
+            self._probes += 1
+        return True
+
+    def _record(self, failed):
+        """Take the outcome of a call into account."""
+        self._lock.acquire()
+        try:
+            if self._state == OPEN:
+                # The call started before the breaker opened:
+                return
+            if self._state == HALF_OPEN:
+                if failed:
+                    self._open()
+                else:
+                    self._successful_probes += 1
+                    if self._successful_probes >= self.half_open_calls:
+                        self._close()
+                return
+            self._outcomes.append(failed)
+            calls = len(self._outcomes)
+            failures = len([o for o in self._outcomes if o])
+            if calls >= self.min_calls and \
+               failures >= self.failure_rate * calls:
+                self._open()
+        finally:
+            self._lock.release()
+
+    def _remember(self, key, result, generation):
+        self._lock.acquire()
+        try:
+            if generation != self._generation:
+                return
+            _set_newest(self._results, key, result, self.max_results)
+        finally:
+            self._lock.release()
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time()
+        self._trips += 1
+
+    def _close(self):
+        self._state = CLOSED
+        self._opened_at = None
+        self._outcomes.clear()
@@ -0,0 +1,537 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Bulk export and import of the sections and items of the SQL adapters.
+
+The items of each section (e.g., the members of each group) are written as
+one record per section/item pair, either in newline-delimited JSON::
+
+    {"item": "rms", "section": "admins"}
+    {"item": null, "section": "php"}
+
+or in CSV, with a header::
+
+    section,item
+    admins,rms
+    php,
+
+Sections without items are written with a null (or empty) item, so that
+they're recreated on import.
+
+Records are read and written in chunks, so memory use doesn't depend on the
+size of the source. When the items are stored in an association table, the
+records are loaded and inserted with plain SQL statements; otherwise (e.g.,
+when the sections are computed by a property), the adapters' own methods are
+used.
+
+Both functions return a dictionary with the number of ``records`` processed,
+the ``seconds`` it took and the resulting ``records_per_second``, which
+is also passed to the ``progress`` callback (if any) after every chunk. The
+import also reports the number of items ``included`` and the number of
+``sections_created``.
+
+The ``reconcile()`` and ``create_sections()`` methods of the adapters are
+implemented here too.
+
+"""
+
+import csv
+import json
+from time import time
+
+from repoze.what.adapters import NonExistingSectionError, SourceError
+
+from repoze.what.plugins.sql.changelog import INCLUDE, EXCLUDE, CREATE
+
+__all__ = ['export_sections', 'import_sections']
+
+
+FORMATS = ('jsonl', 'csv')
+
+_CSV_HEADER = ['section', 'item']
+
+
+def export_sections(adapter, stream, format='jsonl', chunk_size=1000,
+                    progress=None):
+    """
+    Write the items of all the sections of ``adapter`` to ``stream``.
+
+    :param adapter: The SQL source adapter.
+    :param stream: The file-like object to write to.
+    :param format: ``"jsonl"`` or ``"csv"``.
+    :param chunk_size: The number of records fetched from the database at
+        once.
+    :param progress: A callable to be passed the statistics after every
+        chunk, if any.
+    :return: The statistics.
+    :rtype: dict
+    :raises ValueError: If the ``format`` is not supported.
+
+    For example::
+
+        with open('memberships.jsonl', 'w') as stream:
+            export_sections(groups, stream)
+
+    """
+    write = _get_writer(stream, format)
+    stats = _Stats(progress)
+    tables = adapter._get_tables()
+    if tables is None:
+        sections = adapter.get_all_sections()
+        for section in sorted(sections):
+            records = [(section, item) for item in sorted(sections[section])]
+            for record in records or [(section, None)]:
+                write(*record)
+            stats.add(max(1, len(records)))
+        return stats.finish()
+
+    query = _select_all_items(tables).order_by(tables.section_name,
+                                               tables.item_name)
+    result = adapter.dbsession.execute(query)
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        for (section, item) in rows:
+            write(section, item)
+        stats.add(len(rows))
+    return stats.finish()
+
+
+def import_sections(adapter, stream, format='jsonl', chunk_size=1000,
+                    progress=None):
+    """
+    Include the items read from ``stream`` in their sections, creating the
+    sections that don't exist.
+
+    :param adapter: The SQL source adapter.
+    :param stream: The file-like object to read from.
+    :param format: ``"jsonl"`` or ``"csv"``.
+    :param chunk_size: The number of records imported at once.
+    :param progress: A callable to be passed the statistics after every
+        chunk, if any.
+    :return: The statistics.
+    :rtype: dict
+    :raises ValueError: If the ``format`` is not supported.
+    :raises SourceError: If an item doesn't exist.
+
+    The items already included in their sections are skipped. Each chunk is
+    imported in its own transaction; to import all the records or none,
+    run the import in a batch::
+
+        with groups.batch():
+            import_sections(groups, stream)
+
+    The adapter's cache is cleared afterwards, and so is the session's
+    identity map, as the collections loaded by the ORM may be outdated.
+
+    """
+    stats = _Stats(progress)
+    stats['included'] = stats['sections_created'] = 0
+    tables = adapter._get_tables()
+    try:
+        for chunk in _read_chunks(_get_reader(stream, format), chunk_size):
+            if tables is None:
+                _import_chunk_with_adapter(adapter, chunk, stats)
+            else:
+                _import_chunk(adapter, tables, chunk, stats)
+            stats.add(len(chunk))
+        # Writing the changes a batch may have left pending, or they'd be
+        # discarded when the session is expired below:
+        adapter.dbsession.flush()
+    finally:
+        adapter.loaded_sections = {}
+        adapter.all_sections_loaded = False
+        adapter.dbsession.expire_all()
+    return stats.finish()
+
+
+def _import_chunk(adapter, tables, chunk, stats):
+    """Import the ``chunk`` of records with plain SQL statements."""
+    from sqlalchemy import select, and_
+    dbsession = adapter.dbsession
+    _flush_pending_changes(dbsession)
+    section_names = set([section for (section, item) in chunk])
+    edges = set([record for record in chunk if record[1] is not None])
+    item_names = set([item for (section, item) in edges])
+    # Looking everything up before writing anything:
+    section_ids = _get_keys(dbsession, tables.section_name, tables.section_key,
+                            section_names)
+    item_ids = _get_item_keys(adapter, tables, item_names)
+
+    adapter._begin()
+    new_sections = section_names - set(section_ids)
+    if new_sections:
+        dbsession.execute(tables.parent.insert(),
+                          [{tables.section_name.name: section}
+                           for section in new_sections])
+        section_ids.update(_get_keys(dbsession, tables.section_name,
+                                     tables.section_key, new_sections))
+        stats['sections_created'] += len(new_sections)
+        adapter._log_changes(CREATE, [(section, None)
+                                      for section in new_sections])
+
+    pairs = set([(section_ids[section], item_ids[item])
+                 for (section, item) in edges])
+    if pairs:
+        # Skipping the items which were already included:
+        query = select([tables.association_section, tables.association_item],
+                       and_(tables.association_section.in_(
+                                set([pair[0] for pair in pairs])),
+                            tables.association_item.in_(
+                                set([pair[1] for pair in pairs]))))
+        for row in dbsession.execute(query):
+            pairs.discard(tuple(row))
+    if pairs:
+        dbsession.execute(tables.association.insert(),
+                          [{tables.association_section.name: section_id,
+                            tables.association_item.name: item_id}
+                           for (section_id, item_id) in pairs])
+        stats['included'] += len(pairs)
+        adapter._log_changes(INCLUDE, [
+            (section, item) for (section, item) in edges
+            if (section_ids[section], item_ids[item]) in pairs])
+    adapter._commit()
+    for section in new_sections:
+        adapter._forget_missing_section(section)
+
+
+def _import_chunk_with_adapter(adapter, chunk, stats):
+    """Import the ``chunk`` of records with the methods of ``adapter``."""
+    sections = {}
+    for (section, item) in chunk:
+        items = sections.setdefault(section, set())
+        if item is not None:
+            items.add(item)
+    with adapter.batch():
+        for (section, items) in sections.items():
+            if adapter._section_exists(section):
+                items = items - adapter._get_section_items(section)
+            else:
+                adapter.create_section(section)
+                stats['sections_created'] += 1
+            if items:
+                adapter.include_items(section, items)
+                stats['included'] += len(items)
+
+
+#{ Reconciliation
+
+
+def _reconcile(adapter, desired, chunk_size):
+    """Implement the ``reconcile()`` method of ``adapter``."""
+    tables = adapter._get_tables()
+    changes = {}
+    for chunk in _read_chunks(sorted(desired), chunk_size):
+        chunk = dict([(section, set(desired[section])) for section in chunk])
+        if tables is None:
+            _reconcile_chunk_with_adapter(adapter, chunk, changes)
+        else:
+            _reconcile_chunk(adapter, tables, chunk, changes, chunk_size)
+    return changes
+
+
+def _reconcile_chunk(adapter, tables, desired, changes, chunk_size):
+    """
+    Reconcile the ``desired`` sections with plain SQL statements, looking up
+    or excluding up to ``chunk_size`` items at once.
+
+    """
+    from sqlalchemy import select, and_
+    dbsession = adapter.dbsession
+    _flush_pending_changes(dbsession)
+    section_ids = _get_keys(dbsession, tables.section_name, tables.section_key,
+                            set(desired))
+    for section in desired:
+        if section not in section_ids:
+            msg = u'Section "%s" is not defined in the source' % section
+            raise NonExistingSectionError(msg)
+    # The current items of every section, with their keys:
+    current = dict([(section_id, {}) for section_id in section_ids.values()])
+    query = select([tables.association_section, tables.item_name,
+                    tables.item_key],
+                   tables.association_section.in_(section_ids.values()),
+                   from_obj=[tables.association.join(
+                       tables.children,
+                       tables.item_key==tables.association_item)])
+    for (section_id, item, item_id) in dbsession.execute(query):
+        current[section_id][item] = item_id
+    new_items = set()
+    for (section, items) in desired.items():
+        new_items |= items - set(current[section_ids[section]])
+    item_ids = _get_item_keys(adapter, tables, new_items, chunk_size)
+
+    adapter._begin()
+    rows = []
+    changed_items = set()
+    included_entries = []
+    excluded_entries = []
+    for (section, items) in desired.items():
+        section_id = section_ids[section]
+        current_items = current[section_id]
+        included = items - set(current_items)
+        excluded = set(current_items) - items
+        excluded_ids = [current_items[item] for item in sorted(excluded)]
+        for chunk in _read_chunks(excluded_ids, chunk_size):
+            dbsession.execute(tables.association.delete(and_(
+                tables.association_section==section_id,
+                tables.association_item.in_(chunk))))
+        for item in included:
+            rows.append({tables.association_section.name: section_id,
+                         tables.association_item.name: item_ids[item]})
+        included_entries.extend([(section, item) for item in included])
+        excluded_entries.extend([(section, item) for item in excluded])
+        if included or excluded:
+            changes[section] = {'included': included, 'excluded': excluded}
+            changed_items |= included | excluded
+    if rows:
+        dbsession.execute(tables.association.insert(), rows)
+    adapter._log_changes(EXCLUDE, excluded_entries)
+    adapter._log_changes(INCLUDE, included_entries)
+    adapter._commit()
+
+    changed_sections = [section for section in desired if section in changes]
+    for section in changed_sections:
+        if section in adapter.loaded_sections:
+            adapter.loaded_sections[section] = set(desired[section])
+    adapter._expire_collections(changed_sections, changed_items)
+
+
+def _reconcile_chunk_with_adapter(adapter, desired, changes):
+    """Reconcile the ``desired`` sections with the methods of ``adapter``."""
+    with adapter.batch():
+        for (section, items) in desired.items():
+            current = set(adapter.get_section_items(section))
+            included = items - current
+            excluded = current - items
+            if excluded:
+                adapter.exclude_items(section, excluded)
+            if included:
+                adapter.include_items(section, included)
+            if included or excluded:
+                changes[section] = {'included': included,
+                                    'excluded': excluded}
+
+
+#{ Section creation
+
+
+def _create_sections(adapter, sections, chunk_size):
+    """Implement the ``create_sections()`` method of ``adapter``."""
+    tables = adapter._get_tables()
+    sections = set(sections)
+    if tables is None:
+        new_sections = set()
+        with adapter.batch():
+            for section in sections:
+                if not adapter._section_exists(section):
+                    adapter.create_section(section)
+                    new_sections.add(section)
+        return new_sections
+    from sqlalchemy import select
+    dbsession = adapter.dbsession
+    _flush_pending_changes(dbsession)
+    new_sections = set(sections)
+    for chunk in _read_chunks(sorted(sections), chunk_size):
+        query = select([tables.section_name], tables.section_name.in_(chunk))
+        for row in dbsession.execute(query):
+            new_sections.discard(row[0])
+    if new_sections:
+        adapter._begin()
+        dbsession.execute(tables.parent.insert(),
+                          [{tables.section_name.name: section}
+                           for section in sorted(new_sections)])
+        adapter._log_changes(CREATE, [(section, None)
+                                      for section in sorted(new_sections)])
+        adapter._commit()
+    for section in new_sections:
+        adapter._forget_missing_section(section)
+        adapter.loaded_sections[section] = set()
+    return new_sections
+
+
+#{ Utilities
+
+
+def _select_all_items(tables):
+    """
+    Return the query of every section/item pair, with a null item for the
+    sections without items.
+
+    """
+    from sqlalchemy import select
+    return select([tables.section_name, tables.item_name],
+                  from_obj=[tables.outerjoin()])
+
+
+def _load_all_sections(adapter):
+    """
+    Return the items of every section of ``adapter``, by section name.
+
+    They're loaded with a single query when they're stored in an association
+    table, and with the adapter's own method otherwise.
+
+    """
+    get_tables = getattr(adapter, '_get_tables', None)
+    tables = get_tables and get_tables()
+    if tables is None:
+        return adapter._get_all_sections()
+    sections = {}
+    for (section, item) in adapter.dbsession.execute(
+        _select_all_items(tables)):
+        items = sections.setdefault(section, set())
+        if item is not None:
+            items.add(item)
+    return sections
+
+
+def _get_item_keys(adapter, tables, item_names, chunk_size=None):
+    """
+    Return the keys of the items called ``item_names``, by name.
+
+    :raises SourceError: If any of the items doesn't exist.
+
+    """
+    item_ids = _get_keys(adapter.dbsession, tables.item_name, tables.item_key,
+                         item_names, chunk_size)
+    for item_name in item_names:
+        if item_name not in item_ids:
+            msg = 'Item (%s) "%s" does not exist in the child table'
+            raise SourceError(msg % (adapter.translations['item_name'],
+                                     item_name))
+    return item_ids
+
+
+def _get_keys(dbsession, name_column, key_column, names, chunk_size=None):
+    """
+    Return the keys of the rows called ``names``, by name, looking up
+    ``chunk_size`` names per query (or all of them at once if it's ``None``).
+
+    """
+    from sqlalchemy import select
+    keys = {}
+    for chunk in _read_chunks(sorted(names), chunk_size):
+        query = select([name_column, key_column], name_column.in_(chunk))
+        keys.update([tuple(row) for row in dbsession.execute(query)])
+    return keys
+
+
+def _flush_pending_changes(dbsession):
+    """
+    Write the changes pending in ``dbsession``, before running plain SQL
+    statements on it: Unlike the ORM queries, they don't trigger the
+    autoflush.
+
+    """
+    dbsession.flush()
+
+
+def _read_chunks(records, chunk_size):
+    """Split the iterable of ``records`` into lists of ``chunk_size``."""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+#{ Formats
+
+
+if str is bytes: #pragma:no cover
+    # Python 2's csv module only deals with byte strings.
+    def _encode(value):
+        return value.encode('utf-8')
+    def _decode(value):
+        return value.decode('utf-8')
+else: #pragma:no cover
+    _encode = _decode = lambda value: value
+
+
+def _get_writer(stream, format):
+    """Return a function which writes a section/item pair to ``stream``."""
+    _check_format(format)
+    if format == 'jsonl':
+        def write(section, item):
+            record = {'section': section, 'item': item}
+            stream.write(json.dumps(record, sort_keys=True) + '\n')
+    else:
+        writer = csv.writer(stream)
+        writer.writerow(_CSV_HEADER)
+        def write(section, item):
+            if item is None:
+                item = u''
+            writer.writerow([_encode(section), _encode(item)])
+    return write
+
+
+def _get_reader(stream, format):
+    """Iterate over the section/item pairs in ``stream``."""
+    _check_format(format)
+    if format == 'jsonl':
+        for line in stream:
+            if line.strip():
+                record = json.loads(line)
+                yield record['section'], record.get('item')
+    else:
+        reader = csv.reader(stream)
+        for row in reader:
+            if row == _CSV_HEADER:
+                continue
+            section, item = [_decode(value) for value in row]
+            yield section, item or None
+
+
+def _check_format(format):
+    if format not in FORMATS:
+        raise ValueError('Unsupported format %r; use one of %s' %
+                         (format, ', '.join(FORMATS)))
+
+
+#{ Statistics
+
+
+class _Stats(dict):
+    """The statistics of an export or import."""
+
+    def __init__(self, progress):
+        super(_Stats, self).__init__(records=0, seconds=0.0,
+                                     records_per_second=0.0)
+        self.progress = progress
+        self.start = time()
+
+    def add(self, records):
+        """Account for a chunk of ``records``."""
+        self['records'] += records
+        self._update()
+        if self.progress is not None:
+            self.progress(dict(self))
+
+    def finish(self):
+        """Return the final statistics."""
+        self._update()
+        return dict(self)
+
+    def _update(self):
+        self['seconds'] = time() - self.start
+        if self['seconds']:
+            self['records_per_second'] = self['records'] / self['seconds']
+
+
+#}
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Caching utilities for the SQL adapters.
+
+All of them are safe to share among threads.
+
+"""
+
+import sys
+from threading import Event, Lock, Thread, local
+from time import time
+
+try: #pragma:no cover
+    from collections import OrderedDict
+except ImportError: #pragma:no cover
+    # Python < 2.7; the eviction order becomes arbitrary.
+    OrderedDict = dict
+
+from repoze.what.adapters import SourceError
+
+__all__ = ['NegativeCache', 'SingleFlight', 'SingleFlightTimeout',
+           'RevalidatingCache', 'get_request_memo', 'set_request_memo']
+
+
+# The state of the request being served by the current thread:
+_request = local()
+
+
+def _set_newest(entries, key, value, max_size):
+    """
+    Store ``value`` under ``key`` as the newest entry of the ``OrderedDict``
+    ``entries``, and forget the oldest ones beyond ``max_size``.
+
+    """
+    entries.pop(key, None)
+    entries[key] = value
+    while len(entries) > max_size:
+        if OrderedDict is dict: #pragma:no cover
+            entries.popitem()
+        else:
+            entries.popitem(last=False)
+
+
+def get_request_memo():
+    """
+    Return the memo of the request being served by the current thread.
+
+    :return: The memo, or ``None`` if the request isn't wrapped by
+        :class:`~repoze.what.plugins.sql.middleware.AdapterMemoMiddleware`.
+    :rtype: dict
+
+    """
+    return getattr(_request, 'memo', None)
+
+
+def set_request_memo(memo):
+    """
+    Set the memo of the request being served by the current thread.
+
+    :param memo: The new memo, or ``None`` to stop memoizing.
+    :type memo: dict
+    :return: The previous memo, if any.
+
+    """
+    previous = get_request_memo()
+    _request.memo = memo
+    return previous
+
+
+class NegativeCache(object):
+    """
+    Bounded cache of the items which are known not to exist.
+
+    When an adapter looks up an item which doesn't exist (e.g., a forged
+    user name), it remembers so for ``ttl`` seconds and won't query the
+    database for it again in the meantime.
+
+    It's meant to be shared by the group and permission adapters (see
+    :func:`configure_sql_adapters`): When the group adapter creates or
+    renames a group, the permission adapter forgets that such a group didn't
+    exist.
+
+    The adapters use ``(mapped class, name)`` pairs as keys (or
+    ``(mapped class, name, tenant)`` if they support tenants). If an
+    application creates items by other means (e.g., when it registers a new
+    user), it can call :meth:`discard` so that they're found right away::
+
+        negative_cache.discard((User, new_user.user_name))
+
+    Otherwise, they're only found once their entry expires.
+
+    """
+
+    def __init__(self, max_size=10000, ttl=30):
+        """
+        Create a negative cache.
+
+        :param max_size: The maximum number of items to remember; the oldest
+            ones are forgotten first.
+        :param ttl: The number of seconds each item is remembered.
+
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._expirations = OrderedDict()
+        self._lock = Lock()
+
+    def __contains__(self, key):
+        self._lock.acquire()
+        try:
+            expiration = self._expirations.get(key)
+            if expiration is None:
+                return False
+            if expiration <= time():
+                del self._expirations[key]
+                return False
+            return True
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._expirations)
+
+    def add(self, key):
+        """Remember that ``key`` doesn't exist."""
+        self._lock.acquire()
+        try:
+            _set_newest(self._expirations, key, time() + self.ttl,
+                        self.max_size)
+        finally:
+            self._lock.release()
+
+    def discard(self, key):
+        """Forget that ``key`` didn't exist, if it was remembered."""
+        self._lock.acquire()
+        try:
+            self._expirations.pop(key, None)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Forget all the items."""
+        self._lock.acquire()
+        try:
+            self._expirations.clear()
+        finally:
+            self._lock.release()
+
+
+class RevalidatingCache(object):
+    """
+    Bounded cache which keeps serving expired entries while they're
+    refreshed in the background (i.e., stale-while-revalidate).
+
+    Entries are fresh for ``ttl`` seconds. During the following ``grace``
+    seconds, they're still returned right away, but the first lookup also
+    starts a thread to load them again; the request which finds them expired
+    doesn't wait for the database. Entries older than that are loaded again
+    by the lookup itself.
+
+    The SQL adapters use it when it's set on their ``revalidating_cache``
+    attribute, to cache the sections found for each user or group across
+    requests. Their ``dbsession`` must be a ``scoped_session``; otherwise,
+    the entries are never refreshed in the background. The cache is cleared
+    whenever an adapter writes to the database.
+
+    """
+
+    def __init__(self, ttl=60, grace=300, max_size=10000, max_refreshes=4):
+        """
+        Create a stale-while-revalidate cache.
+
+        :param ttl: The number of seconds each entry is fresh.
+        :param grace: The number of seconds an expired entry is served while
+            it's refreshed.
+        :param max_size: The maximum number of entries; the oldest ones are
+            forgotten first.
+        :param max_refreshes: The maximum number of refreshes in progress at
+            any time; expired entries are served without being refreshed
+            while there are that many.
+
+        """
+        self.ttl = ttl
+        self.grace = grace
+        self.max_size = max_size
+        self.max_refreshes = max_refreshes
+        # The value of each key, along with the time it expires:
+        self._entries = OrderedDict()
+        # The keys being refreshed:
+        self._refreshing = set()
+        # Increased when the cache is cleared, so that the refreshes started
+        # before then don't store outdated values:
+        self._generation = 0
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, loader, refresh=None):
+        """
+        Return the value of ``key``.
+
+        :param key: The key of the entry.
+        :param loader: The function which loads the value, if it's not cached
+            or it's too old to be served.
+        :param refresh: The function which loads the value in the background
+            when it has expired, or ``None`` to only load it with ``loader``.
+
+        """
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            generation = self._generation
+        finally:
+            self._lock.release()
+        if entry is not None:
+            (value, expiration) = entry
+            now = time()
+            if now < expiration:
+                return value
+            if refresh is not None and now < expiration + self.grace:
+                self._start_refresh(key, refresh)
+                return value
+        value = loader()
+        self._store(key, value, generation)
+        return value
+
+    def discard(self, key):
+        """Forget the value of ``key``, if it's cached."""
+        self._lock.acquire()
+        try:
+            self._entries.pop(key, None)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Forget all the entries."""
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._generation += 1
+        finally:
+            self._lock.release()
+
+    def _start_refresh(self, key, refresh):
+        self._lock.acquire()
+        try:
+            if key in self._refreshing or \
+               len(self._refreshing) >= self.max_refreshes:
+                return
+            self._refreshing.add(key)
+            generation = self._generation
+        finally:
+            self._lock.release()
+        thread = Thread(target=self._refresh,
+                        args=(key, refresh, generation))
+        thread.setDaemon(True)
+        thread.start()
+
+    def _refresh(self, key, refresh, generation):
+        try:
+            try:
+                value = refresh()
+            except Exception:
+                # The expired value is served until the grace period is
+                # over, when the error will be raised by the lookup itself.
+                pass
+            else:
+                self._store(key, value, generation)
+        finally:
+            self._lock.acquire()
+            try:
+                self._refreshing.discard(key)
+            finally:
+                self._lock.release()
+
+    def _store(self, key, value, generation):
+        self._lock.acquire()
+        try:
+            if generation != self._generation:
+                return
+            _set_newest(self._entries, key, (value, time() + self.ttl),
+                        self.max_size)
+        finally:
+            self._lock.release()
+
+
+class SingleFlightTimeout(SourceError):
+    """
+    Exception raised when a call waited too long for an identical call to
+    finish in another thread.
+
+    """
+    pass
+
+
+class _Flight(object):
+    """A call in progress, shared by all the threads that made it."""
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesce concurrent identical calls, so that only one of them runs.
+
+    The first thread to make a call with a given key runs it, while the
+    threads which make the same call before it finishes wait for its outcome:
+    They all get the same result, or the same exception.
+
+    The SQL adapters use it when it's set on their ``single_flight``
+    attribute, so that identical lookups in concurrent requests share a
+    single query. As the result is shared, those lookups must not rely on
+    the side effects of the call (e.g., only the thread that ran the lookup
+    gets the user object stored in its ``credentials``).
+
+    """
+
+    def __init__(self, timeout=10):
+        """
+        Create a single-flight group.
+
+        :param timeout: The number of seconds a thread may wait for the call
+            made by another thread, after which :class:`SingleFlightTimeout`
+            is raised in the waiting thread.
+
+        """
+        self.timeout = timeout
+        self._flights = {}
+        self._lock = Lock()
+
+    def do(self, key, function):
+        """
+        Return the result of ``function()``, unless a call with the same
+        ``key`` is in progress, in which case its outcome is returned.
+
+        :raises SingleFlightTimeout: If the call in progress doesn't finish
+            in time.
+
+        """
+        self._lock.acquire()
+        try:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = _Flight()
+        finally:
+            self._lock.release()
+        
+        if is_leader:
+            try:
+                flight.result = function()
+            except:
+                flight.error = sys.exc_info()[1]
+                raise
+            finally:
+                self._lock.acquire()
+                try:
+                    del self._flights[key]
+                finally:
+                    self._lock.release()
+                flight.done.set()
+            return flight.result
+        
+        flight.done.wait(self.timeout)
+        if not flight.done.isSet():
+            raise SingleFlightTimeout('Timed out waiting for %r' % (key, ))
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
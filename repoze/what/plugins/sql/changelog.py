@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Log of the changes made by the SQL adapters.
+
+When an adapter has a :class:`ChangeLog`, every write operation appends an
+entry to its table in the same transaction as the change itself, so the log
+never disagrees with the data. Consumers which keep a copy of the groups and
+permissions (e.g., caches or snapshots) can then apply only what changed
+since the last entry they saw, instead of reloading everything::
+
+    from repoze.what.plugins.sql.changelog import ChangeLog, \\
+                                                  make_changelog_table
+
+    changelog_table = make_changelog_table(metadata)
+    changelog = ChangeLog(changelog_table)
+    adapters = configure_sql_adapters(User, Group, Permission, DBSession,
+                                      changelog=changelog)
+
+    # Later, in the consumer:
+    for change in changelog.changes_since(DBSession, last_mark):
+        apply(change)
+        last_mark = change.mark
+
+The adapters shared by many tenants record the tenant of each entry, so
+that consumers can apply the changes of each tenant separately.
+
+The entries are numbered by the database, so a transaction that commits
+after another one may have written lower numbers. Consumers which read the
+log while it's being written should re-read a few entries before their mark,
+or read it from a transaction that can't see uncommitted changes to the
+table (e.g., with a lock on it).
+
+"""
+
+from collections import namedtuple
+
+__all__ = ['ChangeLog', 'Change', 'make_changelog_table', 'INCLUDE',
+           'EXCLUDE', 'CREATE', 'EDIT', 'DELETE']
+
+
+#{ Operations
+
+#: Some items were included in a section.
+INCLUDE = u'include'
+#: Some items were excluded from a section.
+EXCLUDE = u'exclude'
+#: A section was created.
+CREATE = u'create'
+#: A section was renamed; the new name is the ``item`` of the entry.
+EDIT = u'edit'
+#: A section was deleted.
+DELETE = u'delete'
+
+#}
+
+
+#: An entry in the log.
+Change = namedtuple('Change', 'mark source operation section item tenant')
+
+
+def make_changelog_table(metadata, name='repoze_what_changelog',
+                         tenant_type=None):
+    """
+    Define the table of a change log in ``metadata``.
+
+    :param metadata: The SQLAlchemy metadata of the application.
+    :param name: The name of the table.
+    :param tenant_type: The SQLAlchemy type of the tenants, if it's not
+        ``Unicode(255)`` (e.g., ``Integer``).
+    :return: The table.
+    :rtype: sqlalchemy.Table
+
+    The table must be created along with the rest of the application's
+    tables (e.g., with ``metadata.create_all()``).
+
+    """
+    from sqlalchemy import Table, Column, Integer, Unicode
+    if tenant_type is None:
+        tenant_type = Unicode(255)
+    return Table(name, metadata,
+        Column('mark', Integer, autoincrement=True, primary_key=True),
+        Column('source', Unicode(32), nullable=False),
+        Column('operation', Unicode(16), nullable=False),
+        Column('section', Unicode(255), nullable=False),
+        Column('item', Unicode(255)),
+        Column('tenant', tenant_type),
+        )
+
+
+class ChangeLog(object):
+    """
+    The log of the changes made by the SQL adapters.
+
+    The adapters which use it are those with this object in their
+    ``changelog`` attribute. Each entry says which adapter made the change
+    (``"group"`` or ``"permission"``), what the operation was, the section
+    and item it affected and the tenant it was made for (``None`` unless the
+    adapter is shared by many tenants).
+
+    """
+
+    def __init__(self, table):
+        """
+        Use ``table`` to store the change log.
+
+        :param table: The table defined with :func:`make_changelog_table`.
+
+        """
+        self.table = table
+
+    def record(self, dbsession, source, operation, entries, tenant=None):
+        """
+        Append some entries to the log.
+
+        :param dbsession: The session whose transaction made the changes.
+        :param source: The kind of adapter which made the changes.
+        :param operation: The operation (e.g., :data:`INCLUDE`).
+        :param entries: The ``(section, item)`` pairs affected; the item is
+            ``None`` if the operation only affected the section.
+        :param tenant: The tenant the changes were made for, if any.
+
+        """
+        rows = [{'source': source, 'operation': operation, 'section': section,
+                 'item': item, 'tenant': tenant}
+                for (section, item) in entries]
+        if rows:
+            dbsession.execute(self.table.insert(), rows)
+
+    def changes_since(self, dbsession, mark=0, limit=None):
+        """
+        Return the entries appended after the one marked ``mark``.
+
+        :param dbsession: The SQLAlchemy session.
+        :param mark: The mark of the last entry seen; by default, all the
+            entries are returned.
+        :param limit: The maximum number of entries to return, if any.
+        :return: The entries, oldest first.
+        :rtype: list of :class:`Change`
+
+        """
+        from sqlalchemy import select
+        query = select([self.table.c.mark, self.table.c.source,
+                        self.table.c.operation, self.table.c.section,
+                        self.table.c.item, self.table.c.tenant],
+                       self.table.c.mark > mark)
+        query = query.order_by(self.table.c.mark)
+        if limit is not None:
+            query = query.limit(limit)
+        return [Change(*row) for row in dbsession.execute(query)]
+
+    def latest_mark(self, dbsession):
+        """
+        Return the mark of the latest entry.
+
+        :param dbsession: The SQLAlchemy session.
+        :return: The mark, or ``0`` if the log is empty.
+        :rtype: int
+
+        """
+        from sqlalchemy import select, func
+        query = select([func.max(self.table.c.mark)])
+        return dbsession.execute(query).scalar() or 0
+
+    def prune(self, dbsession, mark):
+        """
+        Remove the entries up to the one marked ``mark``, inclusive.
+
+        :param dbsession: The SQLAlchemy session.
+        :param mark: The mark of the last entry to remove, which all the
+            consumers must have seen.
+
+        The removal is not committed.
+
+        """
+        dbsession.execute(self.table.delete(self.table.c.mark <= mark))
@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+SQL source adapters based on the SQLAlchemy Core.
+
+These adapters work on plain :class:`sqlalchemy.Table` objects instead of
+mapped classes: They issue SELECT, INSERT, UPDATE and DELETE statements on the
+parent table (groups or permissions), the children table (users or groups)
+and the association table between them, and only ever load names. So they
+don't need an ORM model, and they don't pay for the identity map or for
+hydrating objects.
+
+The association table must have a foreign key to the parent table and another
+one to the children table; both are found automatically.
+
+Like the ORM-based adapters, they can run write operations in a ``batch()``,
+record them in a ``changelog``, coalesce concurrent reads with a
+``single_flight``, cache the sections found in a ``revalidating_cache`` and
+leave a failing database alone with a ``circuit_breaker``.
+
+"""
+
+from repoze.what.adapters import SourceError
+
+from repoze.what.plugins.sql.adapters import _BaseSessionAdapter
+from repoze.what.plugins.sql.changelog import INCLUDE, EXCLUDE, CREATE, EDIT, \
+                                              DELETE
+
+__all__ = ['SqlCoreGroupsAdapter', 'SqlCorePermissionsAdapter']
+
+
+class _AclTables(object):
+    """
+    The tables and columns that represent the sections and items of a source.
+
+    .. attribute:: section_name
+        The column with the name of the sections, in the parent table.
+    .. attribute:: section_key
+        The column in the parent table that the association table refers to.
+    .. attribute:: association_section
+        The column in the association table that refers to ``section_key``.
+
+    And likewise with ``item_name``, ``item_key`` and ``association_item`` for
+    the children table.
+
+    The keys are found from the foreign keys of the association table, unless
+    they're passed as ``(section_key, association_section)`` and
+    ``(item_key, association_item)`` pairs.
+
+    """
+
+    def __init__(self, parent, children, association, section_name,
+                 item_name, section_keys=None, item_keys=None):
+        self.parent = parent
+        self.children = children
+        self.association = association
+        self.section_name = parent.c[section_name]
+        self.item_name = children.c[item_name]
+        if section_keys is None:
+            section_keys = _find_foreign_key(association, parent)
+        if item_keys is None:
+            item_keys = _find_foreign_key(association, children)
+        self.section_key, self.association_section = section_keys
+        self.item_key, self.association_item = item_keys
+
+    def join(self):
+        """Return the join of the parent, association and children tables."""
+        return self.parent.join(
+            self.association, self.section_key == self.association_section
+            ).join(self.children, self.item_key == self.association_item)
+
+    def outerjoin(self):
+        """Like :meth:`join`, but also keep the sections without items."""
+        return self.parent.outerjoin(
+            self.association, self.section_key == self.association_section
+            ).outerjoin(self.children, self.item_key == self.association_item)
+
+
+def _find_foreign_key(association, table):
+    """
+    Return the column of ``table`` referred to by ``association``, along with
+    the referring column.
+
+    :raises SourceError: If there's not exactly one such foreign key.
+
+    """
+    keys = []
+    for column in association.c:
+        for foreign_key in column.foreign_keys:
+            if foreign_key.references(table):
+                keys.append((foreign_key.column, column))
+    if len(keys) != 1:
+        msg = 'Table "%s" must have exactly one foreign key to table "%s"'
+        raise SourceError(msg % (association.name, table.name))
+    return keys[0]
+
+
+class _BaseSqlCoreAdapter(_BaseSessionAdapter):
+    """Base class for the SQL source adapters based on SQLAlchemy Core."""
+
+    def __init__(self, parent_table, children_table, association_table,
+                 dbsession):
+        """
+        Create an SQL source adapter.
+
+        :param parent_table: The table of the sections.
+        :param children_table: The table of the items.
+        :param association_table: The table which links both.
+        :param dbsession: The SQLAlchemy session.
+
+        """
+        super(_BaseSqlCoreAdapter, self).__init__(dbsession)
+        self.parent_table = parent_table
+        self.children_table = children_table
+        self.association_table = association_table
+
+    # BaseSourceAdapter
+    def _get_all_sections(self):
+        from sqlalchemy import select
+        tables = self._get_tables()
+        query = select([tables.section_name, tables.item_name],
+                       from_obj=[tables.outerjoin()])
+        sections = {}
+        for (section, item) in self.dbsession.execute(query):
+            items = sections.setdefault(section, set())
+            if item is not None:
+                items.add(item)
+        return sections
+
+    # BaseSourceAdapter
+    def _get_section_items(self, section):
+        return self._read('section_items', section,
+                          lambda: self._load_section_items(section))
+
+    def _load_section_items(self, section):
+        from sqlalchemy import select
+        tables = self._get_tables()
+        query = select([tables.item_name], tables.section_name==section,
+                       from_obj=[tables.join()])
+        items = set([row[0] for row in self.dbsession.execute(query)])
+        if not items:
+            # Making sure the section exists:
+            self._get_section_id(section)
+        return items
+
+    # BaseSourceAdapter
+    def _include_items(self, section, items):
+        from sqlalchemy import select, and_
+        tables = self._get_tables()
+        section_id = self._get_section_id(section)
+        item_ids = set(self._get_item_ids(items).values())
+        # Skipping the items which were already included:
+        if item_ids:
+            query = select([tables.association_item],
+                           and_(tables.association_section==section_id,
+                                tables.association_item.in_(item_ids)))
+            for row in self.dbsession.execute(query):
+                item_ids.discard(row[0])
+        self._begin()
+        if item_ids:
+            rows = [{tables.association_section.name: section_id,
+                     tables.association_item.name: item_id}
+                    for item_id in item_ids]
+            self.dbsession.execute(tables.association.insert(), rows)
+        self._log_changes(INCLUDE, [(section, item) for item in items])
+        self._commit()
+
+    # BaseSourceAdapter
+    def _exclude_items(self, section, items):
+        from sqlalchemy import and_
+        tables = self._get_tables()
+        section_id = self._get_section_id(section)
+        item_ids = list(self._get_item_ids(items).values())
+        self._begin()
+        if item_ids:
+            self.dbsession.execute(tables.association.delete(
+                and_(tables.association_section==section_id,
+                     tables.association_item.in_(item_ids))))
+        self._log_changes(EXCLUDE, [(section, item) for item in items])
+        self._commit()
+
+    # BaseSourceAdapter
+    def _item_is_included(self, section, item):
+        return self._read('item_is_included', (section, item),
+                          lambda: self._load_item_is_included(section, item))
+
+    def _load_item_is_included(self, section, item):
+        from sqlalchemy import select, and_
+        tables = self._get_tables()
+        query = select([tables.association_item],
+                       and_(tables.section_name==section,
+                            tables.item_name==item),
+                       from_obj=[tables.join()]).limit(1)
+        return self.dbsession.execute(query).first() is not None
+
+    # BaseSourceAdapter
+    def _create_section(self, section):
+        tables = self._get_tables()
+        self._begin()
+        self.dbsession.execute(tables.parent.insert(),
+                               {tables.section_name.name: section})
+        self._log_changes(CREATE, [(section, None)])
+        self._commit()
+
+    # BaseSourceAdapter
+    def _edit_section(self, section, new_section):
+        tables = self._get_tables()
+        self._begin()
+        self.dbsession.execute(tables.parent.update(
+            tables.section_name==section,
+            {tables.section_name.name: new_section}))
+        self._log_changes(EDIT, [(section, new_section)])
+        self._commit()
+
+    # BaseSourceAdapter
+    def _delete_section(self, section):
+        tables = self._get_tables()
+        section_id = self._get_section_id(section)
+        self._begin()
+        self.dbsession.execute(tables.association.delete(
+            tables.association_section==section_id))
+        self.dbsession.execute(tables.parent.delete(
+            tables.section_key==section_id))
+        self._log_changes(DELETE, [(section, None)])
+        self._commit()
+
+    # BaseSourceAdapter
+    def _section_exists(self, section):
+        return self._read('section_exists', section,
+                          lambda: self._load_section_exists(section))
+
+    def _load_section_exists(self, section):
+        try:
+            self._get_section_id(section)
+            return True
+        except SourceError:
+            return False
+
+    def _check_translations(self):
+        try:
+            self._get_tables()
+        except KeyError as exc:
+            msg = 'Column %s does not exist (check the translations)'
+            raise SourceError(msg % exc)
+
+    def _get_tables(self):
+        """Return the :class:`_AclTables` for the current translations."""
+        return _AclTables(self.parent_table, self.children_table,
+                          self.association_table,
+                          self.translations['section_name'],
+                          self.translations['item_name'])
+
+    def _find_item_sections(self, item):
+        """Return the names of the sections that include ``item``."""
+        return self._read('sections', item,
+                          lambda: self._load_item_sections(item))
+
+    def _load_item_sections(self, item):
+        from sqlalchemy import select
+        tables = self._get_tables()
+        query = select([tables.section_name], tables.item_name==item,
+                       from_obj=[tables.join()])
+        return set([row[0] for row in self.dbsession.execute(query)])
+
+    def _get_section_id(self, section_name):
+        """
+        Return the key of the section called ``section_name``.
+
+        :raises SourceError: If the section doesn't exist.
+
+        """
+        from sqlalchemy import select
+        tables = self._get_tables()
+        query = select([tables.section_key],
+                       tables.section_name==section_name).limit(1)
+        row = self.dbsession.execute(query).first()
+        if row is None:
+            msg = 'Section (%s) "%s" is not defined in the parent table'
+            msg = msg % (self.translations['section_name'], section_name)
+            raise SourceError(msg)
+        return row[0]
+
+    def _get_item_ids(self, item_names):
+        """
+        Return the keys of the items called ``item_names``, by name.
+
+        :raises SourceError: If any of the items doesn't exist.
+
+        """
+        from sqlalchemy import select
+        tables = self._get_tables()
+        item_names = set(item_names)
+        if not item_names:
+            return {}
+        query = select([tables.item_name, tables.item_key],
+                       tables.item_name.in_(item_names))
+        item_ids = dict([tuple(row) for row in self.dbsession.execute(query)])
+        for item_name in item_names:
+            if item_name not in item_ids:
+                msg = 'Item (%s) "%s" does not exist in the child table'
+                msg = msg % (self.translations['item_name'], item_name)
+                raise SourceError(msg)
+        return item_ids
+
+
+#{ Source adapters
+
+
+class SqlCoreGroupsAdapter(_BaseSqlCoreAdapter):
+    """
+    The SQL group source adapter based on SQLAlchemy Core.
+
+    It's the counterpart of :class:`SqlGroupsAdapter` for applications which
+    define their tables without the ORM. It assumes that the column with the
+    name of the groups is ``group_name`` and the column with the name of the
+    users is ``user_name``; otherwise, set the ``section_name`` and
+    ``item_name`` translations respectively.
+
+    Example::
+
+        # ...
+        from repoze.what.plugins.sql import SqlCoreGroupsAdapter
+        from my_model import users_table, groups_table, memberships_table, \\
+                             DBSession
+
+        groups = SqlCoreGroupsAdapter(groups_table, users_table,
+                                      memberships_table, DBSession)
+        # We have "users.username" instead of "users.user_name":
+        groups.translations['item_name'] = 'username'
+
+        # ...
+
+    """
+
+    # The source of the changes recorded in the change log:
+    changelog_source = u'group'
+
+    def __init__(self, group_table, user_table, user_group_table, dbsession):
+        """
+        Create an SQL groups source adapter.
+
+        :param group_table: The table of the groups.
+        :param user_table: The table of the users.
+        :param user_group_table: The table of the memberships.
+        :param dbsession: The SQLALchemy session to be used.
+
+        """
+        super(SqlCoreGroupsAdapter, self).__init__(group_table, user_table,
+                                                   user_group_table,
+                                                   dbsession)
+        self.translations = {
+            'section_name': 'group_name',
+            'item_name': 'user_name',
+        }
+
+    # BaseSourceAdapter
+    def _find_sections(self, credentials):
+        return self._find_item_sections(credentials['repoze.what.userid'])
+
+
+class SqlCorePermissionsAdapter(_BaseSqlCoreAdapter):
+    """
+    The SQL permission source adapter based on SQLAlchemy Core.
+
+    It's the counterpart of :class:`SqlPermissionsAdapter` for applications
+    which define their tables without the ORM. It assumes that the column with
+    the name of the permissions is ``permission_name`` and the column with the
+    name of the groups is ``group_name``; otherwise, set the ``section_name``
+    and ``item_name`` translations respectively.
+
+    Example::
+
+        # ...
+        from repoze.what.plugins.sql import SqlCorePermissionsAdapter
+        from my_model import groups_table, permissions_table, \\
+                             grants_table, DBSession
+
+        permissions = SqlCorePermissionsAdapter(permissions_table,
+                                                groups_table, grants_table,
+                                                DBSession)
+
+        # ...
+
+    """
+
+    # The source of the changes recorded in the change log:
+    changelog_source = u'permission'
+
+    def __init__(self, permission_table, group_table, group_permission_table,
+                 dbsession):
+        """
+        Create an SQL permissions source adapter.
+
+        :param permission_table: The table of the permissions.
+        :param group_table: The table of the groups.
+        :param group_permission_table: The table of the permissions granted
+            to each group.
+        :param dbsession: The SQLALchemy session to be used.
+
+        """
+        super(SqlCorePermissionsAdapter, self).__init__(permission_table,
+                                                        group_table,
+                                                        group_permission_table,
+                                                        dbsession)
+        self.translations = {
+            'section_name': 'permission_name',
+            'item_name': 'group_name',
+        }
+
+    # BaseSourceAdapter
+    def _find_sections(self, group_name):
+        return self._find_item_sections(group_name)
+
+
+#}
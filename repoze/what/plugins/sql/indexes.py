@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Indexes needed by the SQL adapters.
+
+The adapters look up sections and items by name, and go through the
+association tables in both directions: From a section to its items (e.g.,
+the members of a group) and from an item to its sections (e.g., the groups
+of a user). Without the right indexes, each of those lookups scans a whole
+table.
+
+This module works out those indexes from the tables behind the adapters'
+translations, finds the ones missing in the database and produces the DDL to
+create them::
+
+    from repoze.what.plugins.sql.indexes import find_missing_indexes, \\
+                                                get_index_ddl
+
+    missing = find_missing_indexes(adapters)
+    for statement in get_index_ddl(missing, engine.dialect):
+        print(statement + ';')
+
+:func:`~repoze.what.plugins.sql.adapters.configure_sql_adapters` can also
+check them when it's called with ``check_indexes=True``.
+
+"""
+
+from collections import namedtuple
+
+__all__ = ['RecommendedIndex', 'MissingIndexWarning', 'recommend_indexes',
+           'find_missing_indexes', 'get_index_ddl']
+
+
+class MissingIndexWarning(UserWarning):
+    """Warning issued when the indexes needed by the adapters are missing."""
+    pass
+
+
+class RecommendedIndex(namedtuple('RecommendedIndex', 'table columns unique')):
+    """
+    An index needed by the adapters.
+
+    .. attribute:: table
+        The :class:`sqlalchemy.Table`.
+    .. attribute:: columns
+        The names of the columns, in order.
+    .. attribute:: unique
+        Whether the index must be unique.
+
+    An existing index satisfies it if its leading columns are these ones (and
+    only these ones, if it must be unique).
+
+    """
+
+    @property
+    def name(self):
+        """The name of the index, as created by :func:`get_index_ddl`."""
+        return 'ix_%s_%s' % (self.table.name, '_'.join(self.columns))
+
+    def is_satisfied_by(self, columns, unique):
+        """
+        Check whether an index on ``columns`` satisfies this one.
+
+        :param columns: The names of the columns of the index, in order.
+        :param unique: Whether the index is unique.
+        :rtype: bool
+
+        """
+        columns = tuple(columns)
+        if self.unique:
+            return unique and columns == self.columns
+        return columns[:len(self.columns)] == self.columns
+
+
+def recommend_indexes(adapters):
+    """
+    Return the indexes needed by ``adapters``.
+
+    :param adapters: The ``group`` and ``permission`` adapters (e.g., as
+        returned by
+        :func:`~repoze.what.plugins.sql.adapters.configure_sql_adapters`).
+    :type adapters: dict
+    :return: The indexes, without duplicates.
+    :rtype: list of :class:`RecommendedIndex`
+
+    They are a unique index on the names of the sections and another on the
+    names of the items, plus an index on the association table for each
+    direction. Adapters whose items are not stored in an association table
+    (e.g., because the sections are computed by a property) need none.
+
+    """
+    indexes = []
+    for adapter in adapters.values():
+        get_tables = getattr(adapter, '_get_tables', None)
+        tables = get_tables and get_tables()
+        if tables is None:
+            continue
+        association_section = tables.association_section.name
+        association_item = tables.association_item.name
+        for index in (
+            RecommendedIndex(tables.parent, (tables.section_name.name, ),
+                             True),
+            RecommendedIndex(tables.children, (tables.item_name.name, ),
+                             True),
+            RecommendedIndex(tables.association,
+                             (association_section, association_item), False),
+            RecommendedIndex(tables.association,
+                             (association_item, association_section), False),
+            ):
+            if index not in indexes:
+                indexes.append(index)
+    return indexes
+
+
+def find_missing_indexes(adapters):
+    """
+    Return the indexes needed by ``adapters`` which are missing in the
+    database.
+
+    :param adapters: The ``group`` and ``permission`` adapters.
+    :type adapters: dict
+    :return: The missing indexes.
+    :rtype: list of :class:`RecommendedIndex`
+    :raises SourceError: If the database can't be reached.
+
+    The indexes, primary keys and unique constraints of the tables are
+    reflected from the database of each adapter's session.
+
+    """
+    from sqlalchemy.exc import SQLAlchemyError
+    from sqlalchemy.engine.reflection import Inspector
+    from repoze.what.adapters import SourceError
+    missing = []
+    inspectors = {}
+    existing = {}
+    try:
+        for (name, adapter) in adapters.items():
+            for index in recommend_indexes({name: adapter}):
+                if index in missing:
+                    continue
+                bind = adapter.dbsession.get_bind()
+                if bind not in inspectors:
+                    inspectors[bind] = Inspector.from_engine(bind)
+                key = (bind, index.table.schema, index.table.name)
+                if key not in existing:
+                    existing[key] = _get_existing_indexes(
+                        inspectors[bind], index.table)
+                if not [columns for (columns, unique) in existing[key]
+                        if index.is_satisfied_by(columns, unique)]:
+                    missing.append(index)
+    except SQLAlchemyError as exc:
+        raise SourceError('Could not inspect the database: %s' % exc)
+    return missing
+
+
+def get_index_ddl(indexes, dialect):
+    """
+    Return the statements that create ``indexes``.
+
+    :param indexes: The indexes to create.
+    :type indexes: list of :class:`RecommendedIndex`
+    :param dialect: The SQLAlchemy dialect of the database (e.g.,
+        ``engine.dialect``).
+    :return: The ``CREATE INDEX`` statements.
+    :rtype: list of str
+
+    The tables' metadata is not modified, so the indexes won't be created
+    by ``metadata.create_all()``.
+
+    """
+    from sqlalchemy import MetaData, Table, Column, Index
+    from sqlalchemy.schema import CreateIndex
+    statements = []
+    for index in indexes:
+        # Defining the index on a copy of the table, to leave it untouched:
+        table = Table(index.table.name, MetaData(),
+                      schema=index.table.schema,
+                      *[Column(name, index.table.c[name].type)
+                        for name in index.columns])
+        columns = [table.c[name] for name in index.columns]
+        ddl = CreateIndex(Index(index.name, unique=index.unique, *columns))
+        statements.append(str(ddl.compile(dialect=dialect)).strip())
+    return statements
+
+
+def _get_existing_indexes(inspector, table):
+    """
+    Return the ``(columns, unique)`` pairs of the indexes, primary key and
+    unique constraints of ``table`` in the database.
+
+    """
+    # Unique constraints are reported as indexes, except by SQLite unless
+    # it's asked to include the indexes it creates for them:
+    existing = [(index['column_names'], index['unique']) for index in
+                inspector.get_indexes(table.name, table.schema,
+                                      include_auto_indexes=True)]
+    if hasattr(inspector, 'get_pk_constraint'):
+        primary_key = inspector.get_pk_constraint(
+            table.name, table.schema)['constrained_columns']
+    else:
+        # Older versions of SQLAlchemy:
+        primary_key = inspector.get_primary_keys(table.name, table.schema)
+    if primary_key:
+        existing.append((primary_key, True))
+    return existing
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""WSGI middleware for the SQL adapters."""
+
+from repoze.what.plugins.sql.cache import set_request_memo
+from repoze.what.plugins.sql.tenancy import set_current_tenant
+
+__all__ = ['AdapterMemoMiddleware', 'TenantMiddleware']
+
+
+class AdapterMemoMiddleware(object):
+    """
+    WSGI middleware which memoizes the results of the SQL adapters within
+    each request.
+
+    While a request is served, the SQL adapters remember the sections they
+    find and the items of the sections they load, so evaluating many
+    predicates which need the same data only queries the database once. The
+    memo is discarded when the request ends (and whenever an adapter writes
+    to the database), so requests never see each other's results.
+
+    The memo is available in the WSGI environment under the
+    ``repoze.what.sql.memo`` key, and it's also bound to the thread serving
+    the request, which is how the adapters find it.
+
+    It must wrap the :mod:`repoze.who` middleware, so that the groups and
+    permissions loaded along with the credentials are memoized too::
+
+        from repoze.what.middleware import setup_auth
+        from repoze.what.plugins.sql.middleware import AdapterMemoMiddleware
+
+        app = setup_auth(app, groups, permissions, **who_args)
+        app = AdapterMemoMiddleware(app)
+
+    """
+
+    environ_key = 'repoze.what.sql.memo'
+
+    def __init__(self, app):
+        """
+        Wrap ``app``.
+
+        :param app: The WSGI application to be wrapped.
+
+        """
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        memo = environ[self.environ_key] = {}
+        previous_memo = set_request_memo(memo)
+        try:
+            return self.app(environ, start_response)
+        finally:
+            set_request_memo(previous_memo)
+            memo.clear()
+            environ.pop(self.environ_key, None)
+
+
+class TenantMiddleware(object):
+    """
+    WSGI middleware which sets the current tenant of the SQL adapters in
+    each request.
+
+    The tenant is bound to the thread serving the request until it ends (see
+    :mod:`repoze.what.plugins.sql.tenancy`). By default, it's taken from the
+    ``repoze.what.tenant`` key of the WSGI environment, but it can be worked
+    out from the request in any other way. For example, from the host name::
+
+        def get_tenant(environ):
+            return environ['HTTP_HOST'].split('.')[0]
+
+        app = setup_auth(app, groups, permissions, **who_args)
+        app = TenantMiddleware(app, get_tenant)
+
+    Like :class:`AdapterMemoMiddleware`, it must wrap the :mod:`repoze.who`
+    middleware, which loads the groups and permissions of the user: The
+    permission adapters are only given the names of the groups, so the
+    tenant can't be passed along with the ``credentials``.
+
+    """
+
+    environ_key = 'repoze.what.tenant'
+
+    def __init__(self, app, get_tenant=None):
+        """
+        Wrap ``app``.
+
+        :param app: The WSGI application to be wrapped.
+        :param get_tenant: The callable which returns the tenant of the
+            request, given the WSGI environment; the tenant may be ``None``.
+
+        """
+        self.app = app
+        if get_tenant is None:
+            get_tenant = lambda environ: environ.get(self.environ_key)
+        self.get_tenant = get_tenant
+
+    def __call__(self, environ, start_response):
+        previous_tenant = set_current_tenant(self.get_tenant(environ))
+        try:
+            return self.app(environ, start_response)
+        finally:
+            set_current_tenant(previous_tenant)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Utilities to use the SQL adapters from many threads at once.
+
+The adapters may be shared by many threads, provided that their session
+gives each thread its own SQLAlchemy session; that's what a
+``scoped_session`` does::
+
+    DBSession = scoped_session(sessionmaker(bind=engine))
+
+Sessions themselves must never be shared by threads, so the functions in this
+module refuse adapters whose ``dbsession`` is a plain session. And as the
+threads of a :class:`WorkerPool` outlive the tasks they run, the sessions
+they use are removed from the registry when each task finishes (which
+returns their connection to the pool).
+
+"""
+
+import sys
+from threading import Event, Lock, Thread
+
+try: #pragma:no cover
+    from Queue import Queue
+except ImportError: #pragma:no cover
+    from queue import Queue
+
+from repoze.what.plugins.sql.cache import get_request_memo, set_request_memo
+from repoze.what.plugins.sql.tenancy import get_current_tenant, \
+                                            set_current_tenant
+
+__all__ = ['WorkerPool', 'find_permissions']
+
+
+class _Job(object):
+    """The calls made by :meth:`WorkerPool.map`, and their results."""
+
+    def __init__(self, size):
+        self.results = [None] * size
+        self.error = None
+        self.pending = size
+        self.done = Event()
+        self._lock = Lock()
+        if not size:
+            self.done.set()
+
+    def finish(self, index, result=None, error=None):
+        self._lock.acquire()
+        try:
+            self.results[index] = result
+            if error is not None and self.error is None:
+                self.error = error
+            self.pending -= 1
+            if not self.pending:
+                self.done.set()
+        finally:
+            self._lock.release()
+
+
+class WorkerPool(object):
+    """
+    Small pool of daemon threads which run functions concurrently.
+
+    The threads are started the first time they're needed. Functions run in
+    the pool must not use the pool themselves, or they may wait forever.
+
+    """
+
+    def __init__(self, size=4):
+        """
+        Create a pool of threads.
+
+        :param size: The number of threads.
+
+        """
+        self.size = size
+        self._tasks = Queue()
+        self._threads = []
+        self._lock = Lock()
+
+    def map(self, function, arguments):
+        """
+        Return the result of calling ``function`` with each of the
+        ``arguments``, in order.
+
+        The memo and the tenant of the current request (if any) are shared
+        with the threads for the duration of the calls. If any call raises an
+        exception, it's raised once all the calls have finished.
+
+        """
+        self._start()
+        arguments = list(arguments)
+        job = _Job(len(arguments))
+        memo = get_request_memo()
+        tenant = get_current_tenant()
+        for (index, argument) in enumerate(arguments):
+            self._tasks.put((function, argument, memo, tenant, job, index))
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.results
+
+    def _start(self):
+        if len(self._threads) == self.size:
+            return
+        self._lock.acquire()
+        try:
+            while len(self._threads) < self.size:
+                thread = Thread(target=self._work)
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._lock.release()
+
+    def _work(self):
+        while True:
+            (function, argument, memo, tenant, job, index) = \
+                self._tasks.get()
+            set_request_memo(memo)
+            set_current_tenant(tenant)
+            try:
+                result = function(argument)
+            except:
+                job.finish(index, error=sys.exc_info()[1])
+            else:
+                job.finish(index, result)
+            set_request_memo(None)
+            set_current_tenant(None)
+
+
+def find_permissions(permission_adapter, groups, pool, batch_size=None):
+    """
+    Return the permissions granted to ``groups``, looked up concurrently.
+
+    The groups are split into batches which are looked up in the threads of
+    ``pool``, each one using its own session.
+
+    :param permission_adapter: The SQL permission adapter.
+    :param groups: The names of the groups.
+    :param pool: The :class:`WorkerPool` to run the lookups.
+    :param batch_size: The number of groups looked up by each task; by
+        default, the groups are spread evenly among the threads of the pool.
+    :return: The names of the permissions.
+    :rtype: set
+    :raises ValueError: If the adapter's ``dbsession`` is not thread-local.
+
+    For example, to load the permissions of a user in the same way as
+    :mod:`repoze.what` does but in parallel::
+
+        pool = WorkerPool(4)
+        groups = group_adapter.find_sections(credentials)
+        permissions = find_permissions(permission_adapter, groups, pool)
+
+    """
+    dbsession = permission_adapter.dbsession
+    _check_thread_local_session(dbsession)
+    groups = list(groups)
+    if batch_size is None:
+        batch_size = max(1, -(-len(groups) // pool.size))
+    batches = [groups[i:i + batch_size]
+               for i in range(0, len(groups), batch_size)]
+
+    def find_batch_permissions(batch):
+        try:
+            permissions = set()
+            for group in batch:
+                permissions |= permission_adapter.find_sections(group)
+            return permissions
+        finally:
+            dbsession.remove()
+
+    permissions = set()
+    for batch_permissions in pool.map(find_batch_permissions, batches):
+        permissions |= batch_permissions
+    return permissions
+
+
+def _check_thread_local_session(dbsession):
+    """
+    Make sure ``dbsession`` gives each thread its own session.
+
+    :raises ValueError: If it's not a ``scoped_session``.
+
+    """
+    if not hasattr(dbsession, 'registry') or not hasattr(dbsession, 'remove'):
+        raise ValueError('The adapters can only be used by many threads '
+                         'with a scoped_session, not with %r' % dbsession)
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Direct queries on the groups and permissions of the SQL adapters.
+
+:mod:`repoze.what` loads all the groups of a user and all the permissions of
+those groups to evaluate any predicate. The functions in this module answer
+specific questions instead, with a single query across the users, groups and
+permissions tables (as named by the adapters' translations).
+
+The batch checks answer many such questions at once, with one query per
+chunk of ``(user, permission)`` or ``(user, group)`` pairs, which is handy
+to filter long lists by who may see each entry::
+
+    pairs = [(userid, entry.permission) for entry in entries]
+    allowed = check_permissions(groups, permissions, pairs)
+    entries = [e for (e, ok) in zip(entries, allowed) if ok]
+
+The users who hold a permission are found in the same way, either one page at
+a time or as a stream which fetches them in batches::
+
+    for user in iter_permission_users(groups, permissions, u'edit-site'):
+        notify(user)
+
+When the adapters don't store their items in association tables (e.g., when
+the sections are computed by a property), they fall back to the adapters'
+own methods, so they work with any pair of group and permission adapters.
+
+"""
+
+from repoze.what.adapters import NonExistingSectionError
+
+__all__ = ['has_permission', 'check_permissions', 'check_memberships',
+           'get_permission_users', 'iter_permission_users']
+
+
+def has_permission(group_adapter, permission_adapter, user, permission):
+    """
+    Check whether ``user`` is granted ``permission`` through any of their
+    groups.
+
+    :param group_adapter: The group source adapter.
+    :param permission_adapter: The permission source adapter.
+    :param user: The name of the user.
+    :param permission: The name of the permission.
+    :rtype: bool
+
+    For example::
+
+        if has_permission(groups, permissions, userid, u'edit-site'):
+            ...
+
+    """
+    tables = _get_acl_tables(group_adapter, permission_adapter)
+    if tables is None:
+        credentials = {'repoze.what.userid': user}
+        for group in group_adapter.find_sections(credentials):
+            if permission in permission_adapter.find_sections(group):
+                return True
+        return False
+    return group_adapter._read(
+        'has_permission', (user, permission),
+        lambda: _load_has_permission(group_adapter, tables, user, permission))
+
+
+def _load_has_permission(group_adapter, tables, user, permission):
+    from sqlalchemy import select, exists, and_
+    (join, user_name, permission_name) = _join_acl_tables(*tables)
+    query = select([exists([1], and_(user_name==user,
+                                     permission_name==permission),
+                           from_obj=[join])])
+    return bool(group_adapter.dbsession.execute(query).scalar())
+
+
+def check_permissions(group_adapter, permission_adapter, pairs,
+                      chunk_size=400):
+    """
+    Check whether each user is granted each permission in ``pairs``.
+
+    :param group_adapter: The group source adapter.
+    :param permission_adapter: The permission source adapter.
+    :param pairs: The ``(user, permission)`` pairs to check.
+    :param chunk_size: The maximum number of distinct pairs per query.
+    :return: Whether each pair is granted, in the same order as ``pairs``.
+    :rtype: list of bool
+
+    """
+    pairs = list(pairs)
+    tables = _get_acl_tables(group_adapter, permission_adapter)
+    if tables is None:
+        user_groups = {}
+        group_permissions = {}
+        granted = set()
+        for (user, permission) in set(pairs):
+            if user not in user_groups:
+                credentials = {'repoze.what.userid': user}
+                user_groups[user] = group_adapter.find_sections(credentials)
+            for group in user_groups[user]:
+                if group not in group_permissions:
+                    group_permissions[group] = \
+                        permission_adapter.find_sections(group)
+                if permission in group_permissions[group]:
+                    granted.add((user, permission))
+                    break
+    else:
+        (join, user_name, permission_name) = _join_acl_tables(*tables)
+        granted = _load_pairs(group_adapter.dbsession, join, user_name,
+                              permission_name, pairs, chunk_size)
+    return [pair in granted for pair in pairs]
+
+
+def check_memberships(group_adapter, pairs, chunk_size=400):
+    """
+    Check whether each user belongs to each group in ``pairs``.
+
+    :param group_adapter: The group source adapter.
+    :param pairs: The ``(user, group)`` pairs to check.
+    :param chunk_size: The maximum number of distinct pairs per query.
+    :return: Whether each user belongs to the group, in the same order as
+        ``pairs``.
+    :rtype: list of bool
+
+    """
+    pairs = list(pairs)
+    get_tables = getattr(group_adapter, '_get_tables', None)
+    tables = get_tables and get_tables()
+    if tables is None:
+        user_groups = {}
+        for (user, group) in pairs:
+            if user not in user_groups:
+                credentials = {'repoze.what.userid': user}
+                user_groups[user] = group_adapter.find_sections(credentials)
+        return [group in user_groups[user] for (user, group) in pairs]
+    granted = _load_pairs(group_adapter.dbsession, tables.join(),
+                          tables.item_name, tables.section_name, pairs,
+                          chunk_size)
+    return [pair in granted for pair in pairs]
+
+
+def get_permission_users(group_adapter, permission_adapter, permission,
+                         after=None, limit=None):
+    """
+    Return the users who are granted ``permission`` through any of their
+    groups.
+
+    :param group_adapter: The group source adapter.
+    :param permission_adapter: The permission source adapter.
+    :param permission: The name of the permission.
+    :param after: Only return the users whose name comes after this one.
+    :param limit: The maximum number of users to return, if any.
+    :return: The names of the users, sorted.
+    :rtype: list
+
+    To go through all the users a page at a time, pass the last user of a
+    page as ``after`` to get the next one. A permission that doesn't exist
+    is granted to nobody.
+
+    If the groups of the users are computed by a property, the users are
+    those of the groups as stored in the group source.
+
+    """
+    tables = _get_acl_tables(group_adapter, permission_adapter)
+    if tables is None:
+        users = _find_permission_users(group_adapter, permission_adapter,
+                                       permission)
+        if after is not None:
+            users = [user for user in users if user > after]
+        return users[:limit]
+    from sqlalchemy import select, and_
+    (join, user_name, permission_name) = _join_acl_tables(*tables)
+    criterion = permission_name==permission
+    if after is not None:
+        criterion = and_(criterion, user_name > after)
+    query = select([user_name], criterion, from_obj=[join]).distinct()
+    query = query.order_by(user_name).limit(limit)
+    return [row[0] for row in group_adapter.dbsession.execute(query)]
+
+
+def iter_permission_users(group_adapter, permission_adapter, permission,
+                          batch_size=1000):
+    """
+    Iterate over the users who are granted ``permission`` through any of
+    their groups.
+
+    :param group_adapter: The group source adapter.
+    :param permission_adapter: The permission source adapter.
+    :param permission: The name of the permission.
+    :param batch_size: The number of users fetched per query.
+    :return: The names of the users, sorted.
+
+    The users are fetched lazily, with :func:`get_permission_users`, so
+    memory use doesn't depend on how many users hold the permission.
+
+    """
+    after = None
+    while True:
+        users = get_permission_users(group_adapter, permission_adapter,
+                                     permission, after, batch_size)
+        for user in users:
+            yield user
+        if len(users) < batch_size:
+            break
+        after = users[-1]
+
+
+def _find_permission_users(group_adapter, permission_adapter, permission):
+    """
+    Return the sorted users who are granted ``permission``, with the
+    adapters' own methods.
+
+    """
+    try:
+        groups = permission_adapter.get_section_items(permission)
+    except NonExistingSectionError:
+        return []
+    users = set()
+    for group in groups:
+        users |= group_adapter.get_section_items(group)
+    return sorted(users)
+
+
+def _load_pairs(dbsession, join, user_name, section_name, pairs, chunk_size):
+    """
+    Return those of ``pairs`` found in the ``user_name`` and ``section_name``
+    columns of ``join``, with one query per ``chunk_size`` distinct pairs.
+
+    """
+    from sqlalchemy import select, and_
+    pairs = sorted(set(pairs))
+    found = set()
+    for start in range(0, len(pairs), chunk_size):
+        chunk = pairs[start:start + chunk_size]
+        users = set([user for (user, section) in chunk])
+        sections = set([section for (user, section) in chunk])
+        query = select([user_name, section_name],
+                       and_(user_name.in_(users), section_name.in_(sections)),
+                       from_obj=[join]).distinct()
+        found.update([tuple(row) for row in dbsession.execute(query)])
+    return found
+
+
+def _get_acl_tables(group_adapter, permission_adapter):
+    """
+    Return the tables of the memberships and the permissions granted to the
+    groups, or ``None`` if they can't be queried together.
+
+    """
+    get_group_tables = getattr(group_adapter, '_get_tables', None)
+    get_permission_tables = getattr(permission_adapter, '_get_tables', None)
+    if get_group_tables is None or get_permission_tables is None:
+        return None
+    group_tables = get_group_tables()
+    permission_tables = get_permission_tables()
+    if group_tables is None or permission_tables is None or \
+       group_tables.parent is not permission_tables.children:
+        return None
+    return (group_tables, permission_tables)
+
+
+def _join_acl_tables(group_tables, permission_tables):
+    """
+    Return the join from the users to the permissions, along with the
+    columns of their names.
+
+    The groups table is skipped when both association tables refer to the
+    same column of it.
+
+    """
+    join = group_tables.children.join(
+        group_tables.association,
+        group_tables.item_key==group_tables.association_item)
+    if group_tables.section_key is permission_tables.item_key:
+        join = join.join(permission_tables.association,
+                         group_tables.association_section==
+                         permission_tables.association_item)
+    else:
+        join = join.join(
+            group_tables.parent,
+            group_tables.association_section==group_tables.section_key)
+        join = join.join(
+            permission_tables.association,
+            permission_tables.item_key==permission_tables.association_item)
+    join = join.join(
+        permission_tables.parent,
+        permission_tables.association_section==permission_tables.section_key)
+    return (join, group_tables.item_name, permission_tables.section_name)
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Source adapters whose items are split across many databases.
+
+When the users are spread over several database shards, each shard has its
+own SQL adapter (and thus its own session), and a :class:`ShardedSqlAdapter`
+puts them together: It sends the lookups of each item to the shard chosen by
+a routing function, and gathers the items of the sections from all the
+shards::
+
+    from repoze.what.plugins.sql.parallel import WorkerPool
+    from repoze.what.plugins.sql.sharding import ShardedSqlAdapter, \\
+                                                 crc32_router
+
+    shards = {
+        'eu': SqlGroupsAdapter(Group, User, EuropeSession),
+        'us': SqlGroupsAdapter(Group, User, AmericaSession),
+        }
+    groups = ShardedSqlAdapter(shards, crc32_router(shards),
+                               pool=WorkerPool(2))
+
+The sections (e.g., the groups) must exist in every shard, while each item
+(e.g., each user) only lives in the shard it's routed to. Write operations
+on sections are applied to every shard in turn, and each shard commits its
+own changes, so a failure may leave the shards out of sync.
+
+"""
+
+from zlib import crc32
+
+from repoze.what.adapters import BaseSourceAdapter
+
+from repoze.what.plugins.sql.parallel import _check_thread_local_session
+
+__all__ = ['ShardedSqlAdapter', 'crc32_router']
+
+
+def crc32_router(shard_keys):
+    """
+    Return a routing function which spreads the items evenly among the
+    shards, by the CRC32 checksum of their names.
+
+    :param shard_keys: The keys of the shards.
+    :return: The routing function, which takes the name of an item and
+        returns the key of its shard.
+
+    Changing the number or the order of the shards moves most of the items
+    to a different shard.
+
+    """
+    shard_keys = sorted(shard_keys)
+
+    def route(item_name):
+        if not isinstance(item_name, bytes):
+            item_name = item_name.encode('utf-8')
+        return shard_keys[(crc32(item_name) & 0xffffffff) % len(shard_keys)]
+
+    return route
+
+
+class ShardedSqlAdapter(BaseSourceAdapter):
+    """
+    Source adapter which spreads the items of the sections across many SQL
+    adapters.
+
+    """
+
+    def __init__(self, shards, route, pool=None):
+        """
+        Put the adapters of the ``shards`` together.
+
+        :param shards: The adapter of each shard, by shard key.
+        :type shards: dict
+        :param route: The function which takes the name of an item and
+            returns the key of its shard.
+        :param pool: The :class:`~repoze.what.plugins.sql.parallel.WorkerPool`
+            to query all the shards at once, if any; otherwise, they're
+            queried one after another.
+        :raises ValueError: If there's a ``pool`` and the session of an
+            adapter is not thread-local.
+
+        """
+        super(ShardedSqlAdapter, self).__init__(
+            writable=all([shard.is_writable for shard in shards.values()]))
+        if pool is not None:
+            for shard in shards.values():
+                _check_thread_local_session(shard.dbsession)
+        self.shards = shards
+        self.route = route
+        self.pool = pool
+
+    def get_shard(self, item_name):
+        """Return the adapter of the shard where ``item_name`` lives."""
+        return self.shards[self.route(item_name)]
+
+    # BaseSourceAdapter
+    def _get_all_sections(self):
+        sections = {}
+        for shard_sections in self._gather(
+            lambda shard: shard._get_all_sections()):
+            for (section, items) in shard_sections.items():
+                sections.setdefault(section, set()).update(items)
+        return sections
+
+    # BaseSourceAdapter
+    def _get_section_items(self, section):
+        items = set()
+        for shard_items in self._gather(
+            lambda shard: shard._get_section_items(section)):
+            items |= shard_items
+        return items
+
+    # BaseSourceAdapter
+    def _find_sections(self, hint):
+        if isinstance(hint, dict):
+            # It's the credentials of a user:
+            item_name = hint['repoze.what.userid']
+        else:
+            item_name = hint
+        return self.get_shard(item_name).find_sections(hint)
+
+    # BaseSourceAdapter
+    def _include_items(self, section, items):
+        for (shard, shard_items) in self._split_items(items):
+            shard.include_items(section, shard_items)
+
+    # BaseSourceAdapter
+    def _exclude_items(self, section, items):
+        for (shard, shard_items) in self._split_items(items):
+            shard.exclude_items(section, shard_items)
+
+    # BaseSourceAdapter
+    def _item_is_included(self, section, item):
+        return self.get_shard(item)._item_is_included(section, item)
+
+    # BaseSourceAdapter
+    def _create_section(self, section):
+        for shard in self._get_shards():
+            shard.create_section(section)
+
+    # BaseSourceAdapter
+    def _edit_section(self, section, new_section):
+        for shard in self._get_shards():
+            shard.edit_section(section, new_section)
+
+    # BaseSourceAdapter
+    def _delete_section(self, section):
+        for shard in self._get_shards():
+            shard.delete_section(section)
+
+    # BaseSourceAdapter
+    def _section_exists(self, section):
+        # All the shards have the same sections:
+        return self._get_shards()[0]._section_exists(section)
+
+    def _get_shards(self):
+        """Return the adapters of the shards, sorted by key."""
+        return [self.shards[key] for key in sorted(self.shards)]
+
+    def _split_items(self, items):
+        """
+        Return the adapter of each shard where any of ``items`` lives, along
+        with those items.
+
+        """
+        items_by_shard = {}
+        for item in items:
+            items_by_shard.setdefault(self.route(item), set()).add(item)
+        return [(self.shards[key], items_by_shard[key])
+                for key in sorted(items_by_shard)]
+
+    def _gather(self, function):
+        """
+        Return the result of calling ``function`` with the adapter of each
+        shard, in the threads of the pool if there's one.
+
+        """
+        shards = self._get_shards()
+        if self.pool is None:
+            return [function(shard) for shard in shards]
+
+        def call(shard):
+            try:
+                return function(shard)
+            finally:
+                shard.dbsession.remove()
+
+        return self.pool.map(call, shards)
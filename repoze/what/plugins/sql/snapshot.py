@@ -0,0 +1,642 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Read-only snapshots of the groups and permissions, shared by processes.
+
+A snapshot is a compact binary file with the users, groups and permissions
+defined by a pair of source adapters, and the relationships between them.
+One process builds it with :func:`build_snapshot` (e.g., a cron job or the
+master of a pre-forking server), and every worker process memory-maps it with
+:class:`Snapshot` and looks up memberships directly in the mapped file. So
+the operating system keeps a single copy of the data in memory, however many
+workers there are::
+
+    # In the process that builds the snapshot:
+    adapters = configure_sql_adapters(User, Group, Permission, DBSession)
+    build_snapshot(adapters['group'], adapters['permission'],
+                   '/var/lib/myapp/acl.snapshot')
+
+    # In the workers:
+    snapshot = Snapshot('/var/lib/myapp/acl.snapshot', check_interval=30)
+    groups = SnapshotGroupsAdapter(snapshot)
+    permissions = SnapshotPermissionsAdapter(snapshot)
+
+The snapshot is replaced atomically when it's rebuilt, so readers always see
+a complete file: Either the old one, or the new one once they
+:meth:`~Snapshot.refresh`.
+
+Snapshots also make cold starts fast: A :class:`SnapshotUpdater` maps the
+existing snapshot right away if it's as recent as the database, and keeps it
+up-to-date in the background. Whether it's recent is told by the ``stamp``
+of the snapshot, an integer which must grow whenever the groups or
+permissions change, such as the latest mark of a
+:class:`~repoze.what.plugins.sql.changelog.ChangeLog`.
+
+The file starts with a header with the format version, the stamp and the
+position of every table. There's a
+table of names for the users, another one for the groups and another one for
+the permissions, each sorted by their UTF-8 encoding so that names are found
+with a binary search. Then, for each user, group and permission there are the
+lists of the indexes of the groups of the user, the users and permissions of
+the group, and the groups granted the permission. All the integers are
+unsigned, 32-bit and little-endian.
+
+"""
+
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from threading import Event, Lock, Thread
+from time import time
+
+from repoze.what.adapters import BaseSourceAdapter, SourceError
+
+__all__ = ['Snapshot', 'SnapshotGroupsAdapter', 'SnapshotPermissionsAdapter',
+           'SnapshotUpdater', 'build_snapshot']
+
+
+MAGIC = b'RWSQ'
+
+FORMAT_VERSION = 2
+
+# The magic string, the format version, the stamp, the number of names and the
+# position of their offsets and blob in every table, and the position of the
+# offsets and indexes in every relation:
+_HEADER = struct.Struct('<4sHHQ' + 'III' * 3 + 'II' * 4)
+
+# The tables of names:
+_USERS, _GROUPS, _PERMISSIONS = range(3)
+
+# The relations, with the tables they map from and to:
+_USER_GROUPS, _GROUP_USERS, _GROUP_PERMISSIONS, _PERMISSION_GROUPS = range(4)
+_RELATIONS = ((_USERS, _GROUPS), (_GROUPS, _USERS), (_GROUPS, _PERMISSIONS),
+              (_PERMISSIONS, _GROUPS))
+
+_text_type = type(u'')
+
+
+#{ Building snapshots
+
+
+def build_snapshot(group_adapter, permission_adapter, path, stamp=0):
+    """
+    Write a snapshot of the groups and permissions to ``path``.
+
+    :param group_adapter: The source adapter of the groups.
+    :param permission_adapter: The source adapter of the permissions.
+    :param path: The path to the snapshot, which is replaced atomically if
+        it exists.
+    :param stamp: The version of the data in the database, which should be
+        read before the data itself.
+    :type stamp: int
+    :return: The number of ``users``, ``groups`` and ``permissions``, and
+        the size of the file in ``bytes``.
+    :rtype: dict
+
+    The data is loaded straight from the adapters' source, not from their
+    cache, with one query per adapter when the items are stored in an
+    association table. Only the users which belong to a group are included.
+
+    """
+    from repoze.what.plugins.sql.bulk import _load_all_sections
+    group_users = _load_all_sections(group_adapter)
+    permission_groups = _load_all_sections(permission_adapter)
+
+    users = set()
+    for members in group_users.values():
+        users |= set(members)
+    groups = set(group_users)
+    for granted_groups in permission_groups.values():
+        groups |= set(granted_groups)
+    names = [_sort_names(users), _sort_names(groups),
+             _sort_names(permission_groups)]
+    indexes = [dict([(name, i) for (i, name) in enumerate(table)])
+               for table in names]
+
+    relations = [dict() for relation in _RELATIONS]
+    for (group, members) in group_users.items():
+        relations[_GROUP_USERS][group] = members
+        for user in members:
+            relations[_USER_GROUPS].setdefault(user, set()).add(group)
+    for (permission, granted_groups) in permission_groups.items():
+        relations[_PERMISSION_GROUPS][permission] = granted_groups
+        for group in granted_groups:
+            relations[_GROUP_PERMISSIONS].setdefault(group, set()).add(
+                permission)
+
+    writer = _Writer(_HEADER.size)
+    header = [MAGIC, FORMAT_VERSION, 0, stamp]
+    for table in names:
+        encoded_names = [_encode(name) for name in table]
+        blob_offsets = [0]
+        for name in encoded_names:
+            blob_offsets.append(blob_offsets[-1] + len(name))
+        header.append(len(table))
+        header.append(writer.write_integers(blob_offsets))
+        header.append(writer.write_bytes(b''.join(encoded_names)))
+    for (relation, (source, target)) in enumerate(_RELATIONS):
+        related = relations[relation]
+        target_indexes = indexes[target]
+        offsets = [0]
+        values = []
+        for name in names[source]:
+            values.extend(sorted([target_indexes[related_name] for
+                                  related_name in related.get(name, ())]))
+            offsets.append(len(values))
+        header.append(writer.write_integers(offsets))
+        header.append(writer.write_integers(values))
+    writer.write_header(_HEADER.pack(*header))
+
+    size = writer.save(path)
+    return {'users': len(names[_USERS]), 'groups': len(names[_GROUPS]),
+            'permissions': len(names[_PERMISSIONS]), 'bytes': size}
+
+
+def _encode(name):
+    if isinstance(name, _text_type):
+        return name.encode('utf-8')
+    return name
+
+
+def _sort_names(names):
+    """Sort ``names`` by their UTF-8 encoding, like the binary search."""
+    return sorted(names, key=_encode)
+
+
+class _Writer(object):
+    """The contents of a snapshot being built."""
+
+    def __init__(self, header_size):
+        self.chunks = []
+        self.size = 0
+        self.write_bytes(b'\0' * header_size)
+
+    def write_header(self, header):
+        """Replace the placeholder at the beginning with ``header``."""
+        self.chunks[0] = header
+
+    def write_bytes(self, data):
+        """Append ``data`` and return its position."""
+        position = self.size
+        self.chunks.append(data)
+        self.size += len(data)
+        # Keeping the integers aligned:
+        padding = -self.size % 4
+        if padding:
+            self.chunks.append(b'\0' * padding)
+            self.size += padding
+        return position
+
+    def write_integers(self, integers):
+        """Append ``integers`` and return their position."""
+        return self.write_bytes(struct.pack('<%dI' % len(integers),
+                                            *integers))
+
+    def save(self, path):
+        """
+        Write the contents to a temporary file and move it to ``path``.
+
+        :return: The size of the file.
+
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        descriptor, temporary_path = tempfile.mkstemp(prefix='.snapshot-',
+                                                      dir=directory)
+        try:
+            snapshot_file = os.fdopen(descriptor, 'wb')
+            try:
+                for chunk in self.chunks:
+                    snapshot_file.write(chunk)
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            finally:
+                snapshot_file.close()
+            os.chmod(temporary_path, 0o644)
+            os.rename(temporary_path, path)
+        except:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        return self.size
+
+
+#{ Reading snapshots
+
+
+class Snapshot(object):
+    """
+    A snapshot of the groups and permissions, memory-mapped read-only.
+
+    It's safe to share among threads.
+
+    """
+
+    def __init__(self, path, check_interval=None):
+        """
+        Map the snapshot at ``path``.
+
+        :param path: The path to the snapshot.
+        :param check_interval: If set, the number of seconds after which a
+            lookup checks whether the snapshot has been replaced, and maps
+            the new one if so. Otherwise, it's only remapped on
+            :meth:`refresh`.
+        :raises SourceError: If the file is not a valid snapshot.
+
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = Lock()
+        self._state = self._load()
+        self._checked = time()
+
+    def refresh(self):
+        """
+        Map the snapshot again if it has been replaced.
+
+        :return: Whether it was replaced.
+        :rtype: bool
+        :raises SourceError: If the new file is not a valid snapshot.
+
+        """
+        self._lock.acquire()
+        try:
+            self._checked = time()
+            if _stat(self.path) == self._state.stat:
+                return False
+            # The previous map is closed once no lookup uses it:
+            self._state = self._load()
+            return True
+        finally:
+            self._lock.release()
+
+    @property
+    def stamp(self):
+        """The version of the data in the snapshot."""
+        return self._get_state().stamp
+
+    def user_groups(self, user):
+        """Return the names of the groups to which ``user`` belongs."""
+        return self._get_related(_USER_GROUPS, user)
+
+    def group_users(self, group):
+        """Return the names of the users that belong to ``group``."""
+        return self._get_related(_GROUP_USERS, group)
+
+    def group_permissions(self, group):
+        """Return the names of the permissions granted to ``group``."""
+        return self._get_related(_GROUP_PERMISSIONS, group)
+
+    def permission_groups(self, permission):
+        """Return the names of the groups granted ``permission``."""
+        return self._get_related(_PERMISSION_GROUPS, permission)
+
+    def groups(self):
+        """Return the names of all the groups."""
+        return self._get_state().get_names(_GROUPS)
+
+    def permissions(self):
+        """Return the names of all the permissions."""
+        return self._get_state().get_names(_PERMISSIONS)
+
+    def has_group(self, group):
+        """Check whether ``group`` exists."""
+        return self._get_state().find(_GROUPS, group) is not None
+
+    def has_permission(self, permission):
+        """Check whether ``permission`` exists."""
+        return self._get_state().find(_PERMISSIONS, permission) is not None
+
+    def _get_related(self, relation, name):
+        state = self._get_state()
+        index = state.find(_RELATIONS[relation][0], name)
+        if index is None:
+            return set()
+        return state.get_related(relation, index)
+
+    def _get_state(self):
+        if self.check_interval is not None and \
+           time() - self._checked >= self.check_interval:
+            self.refresh()
+        return self._state
+
+    def _load(self):
+        try:
+            snapshot_file = open(self.path, 'rb')
+        except (IOError, OSError) as exc:
+            raise SourceError('Could not open snapshot: %s' % exc)
+        try:
+            stat = _stat(self.path)
+            buffer = mmap.mmap(snapshot_file.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+        finally:
+            snapshot_file.close()
+        return _MappedSnapshot(buffer, stat)
+
+
+def _stat(path):
+    """Return what identifies the version of the file at ``path``."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime, stat.st_size)
+
+
+class _MappedSnapshot(object):
+    """The contents of a snapshot file, mapped in memory."""
+
+    def __init__(self, buffer, stat):
+        self.buffer = buffer
+        self.stat = stat
+        try:
+            header = self._read_header()
+        except SourceError:
+            buffer.close()
+            raise
+        self.stamp = header[3]
+        self.tables = [header[4 + i * 3:7 + i * 3] for i in range(3)]
+        self.relations = [header[13 + i * 2:15 + i * 2] for i in range(4)]
+
+    def _read_header(self):
+        if len(self.buffer) < _HEADER.size:
+            raise SourceError('The snapshot is truncated')
+        header = _HEADER.unpack_from(self.buffer, 0)
+        if header[0] != MAGIC:
+            raise SourceError('The file is not a snapshot')
+        if header[1] != FORMAT_VERSION:
+            raise SourceError('Unsupported snapshot format version %s' %
+                              header[1])
+        return header
+
+    def get_name(self, table, index):
+        offsets_position, blob_position = self.tables[table][1:]
+        start, end = struct.unpack_from('<2I', self.buffer,
+                                        offsets_position + 4 * index)
+        name = self.buffer[blob_position + start:blob_position + end]
+        return name.decode('utf-8')
+
+    def get_names(self, table):
+        return set([self.get_name(table, index) for index in
+                    range(self.tables[table][0])])
+
+    def find(self, table, name):
+        """Return the index of ``name`` in ``table``, if it's there."""
+        name = _encode(name)
+        count, offsets_position, blob_position = self.tables[table]
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            start, end = struct.unpack_from('<2I', self.buffer,
+                                            offsets_position + 4 * middle)
+            current = self.buffer[blob_position + start:blob_position + end]
+            if current < name:
+                low = middle + 1
+            elif current > name:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def get_related(self, relation, index):
+        """Return the names related to the one at ``index``."""
+        offsets_position, values_position = self.relations[relation]
+        start, end = struct.unpack_from('<2I', self.buffer,
+                                        offsets_position + 4 * index)
+        target = _RELATIONS[relation][1]
+        values = struct.unpack_from('<%dI' % (end - start), self.buffer,
+                                    values_position + 4 * start)
+        return set([self.get_name(target, value) for value in values])
+
+
+class SnapshotUpdater(object):
+    """
+    Keep a snapshot as recent as the database.
+
+    When it's started, it maps the existing snapshot if it's valid and it
+    has the same stamp as the database. Otherwise, it builds the snapshot
+    first, unless ``allow_stale`` is set, in which case an outdated snapshot
+    is used until the new one is built in the background.
+
+    Then, every ``interval`` seconds, a background thread compares the stamps
+    and rebuilds the snapshot when they differ. So the adapters' session must
+    be thread-local (e.g., a ``scoped_session``).
+
+    For example::
+
+        updater = SnapshotUpdater(
+            '/var/lib/myapp/acl.snapshot', adapters['group'],
+            adapters['permission'],
+            lambda: changelog.latest_mark(DBSession))
+        updater.start()
+        groups = SnapshotGroupsAdapter(updater.snapshot)
+        permissions = SnapshotPermissionsAdapter(updater.snapshot)
+
+    With pre-forking servers, it should run in a single process; the workers
+    can map the same file with a :class:`Snapshot` which checks it
+    periodically.
+
+    .. attribute:: snapshot
+
+        The :class:`Snapshot`, once started.
+
+    .. attribute:: last_error
+
+        The exception raised by the last update in the background, if it
+        failed.
+
+    """
+
+    def __init__(self, path, group_adapter, permission_adapter, get_stamp,
+                 interval=60, allow_stale=False):
+        """
+        Set up the snapshot updater.
+
+        :param path: The path to the snapshot.
+        :param group_adapter: The source adapter of the groups.
+        :param permission_adapter: The source adapter of the permissions.
+        :param get_stamp: A callable which returns the version of the data in
+            the database.
+        :param interval: The number of seconds between updates, or ``None``
+            not to update it in the background.
+        :param allow_stale: Whether to use an outdated snapshot while the
+            new one is being built.
+
+        """
+        self.path = path
+        self.group_adapter = group_adapter
+        self.permission_adapter = permission_adapter
+        self.get_stamp = get_stamp
+        self.interval = interval
+        self.allow_stale = allow_stale
+        self.snapshot = None
+        self.last_error = None
+        self._stopped = Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Map the snapshot, building it first if necessary, and start updating
+        it in the background.
+
+        :raises SourceError: If the snapshot can't be built.
+
+        """
+        try:
+            snapshot = Snapshot(self.path)
+        except SourceError:
+            snapshot = None
+        if snapshot is None or \
+           (snapshot.stamp != self.get_stamp() and not self.allow_stale):
+            self._build()
+            snapshot = Snapshot(self.path)
+        self.snapshot = snapshot
+        if self.interval is not None:
+            from repoze.what.plugins.sql.parallel import \
+                 _check_thread_local_session
+            _check_thread_local_session(self.group_adapter.dbsession)
+            _check_thread_local_session(self.permission_adapter.dbsession)
+            self._stopped.clear()
+            self._thread = Thread(target=self._run)
+            self._thread.setDaemon(True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop updating the snapshot in the background."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def update(self):
+        """
+        Rebuild the snapshot and map it, if it's outdated.
+
+        :return: Whether it was outdated.
+        :rtype: bool
+
+        """
+        if self.snapshot.stamp == self.get_stamp():
+            return False
+        self._build()
+        self.snapshot.refresh()
+        return True
+
+    def _build(self):
+        # Reading the stamp first, so that the changes made while the
+        # snapshot is built cause another update:
+        stamp = self.get_stamp()
+        build_snapshot(self.group_adapter, self.permission_adapter, self.path,
+                       stamp)
+
+    def _run(self):
+        # An outdated snapshot is updated right away:
+        timeout = 0
+        while not self._stopped.wait(timeout) and not self._stopped.isSet():
+            timeout = self.interval
+            try:
+                try:
+                    self.update()
+                    self.last_error = None
+                except Exception:
+                    self.last_error = sys.exc_info()[1]
+            finally:
+                self.group_adapter.dbsession.remove()
+                self.permission_adapter.dbsession.remove()
+
+
+#{ Source adapters
+
+
+class _BaseSnapshotAdapter(BaseSourceAdapter):
+    """
+    Base class for the read-only source adapters on top of a snapshot.
+
+    The sections are not cached by the adapter, as the snapshot is already
+    in memory and it may be refreshed at any time.
+
+    """
+
+    def __init__(self, snapshot):
+        """
+        Create a source adapter on top of ``snapshot``.
+
+        :param snapshot: The :class:`Snapshot`.
+
+        """
+        super(_BaseSnapshotAdapter, self).__init__(writable=False)
+        self.snapshot = snapshot
+
+    def get_all_sections(self):
+        return self._get_all_sections()
+
+    def get_section_items(self, section):
+        self._check_section_existence(section)
+        return self._get_section_items(section)
+
+    # BaseSourceAdapter
+    def _get_all_sections(self):
+        return dict([(section, self._get_section_items(section))
+                     for section in self._get_section_names()])
+
+    # BaseSourceAdapter
+    def _item_is_included(self, section, item):
+        return item in self._get_section_items(section)
+
+
+class SnapshotGroupsAdapter(_BaseSnapshotAdapter):
+    """The read-only group source adapter on top of a :class:`Snapshot`."""
+
+    def _get_section_names(self):
+        return self.snapshot.groups()
+
+    # BaseSourceAdapter
+    def _get_section_items(self, section):
+        return self.snapshot.group_users(section)
+
+    # BaseSourceAdapter
+    def _find_sections(self, credentials):
+        return self.snapshot.user_groups(credentials['repoze.what.userid'])
+
+    # BaseSourceAdapter
+    def _section_exists(self, section):
+        return self.snapshot.has_group(section)
+
+
+class SnapshotPermissionsAdapter(_BaseSnapshotAdapter):
+    """
+    The read-only permission source adapter on top of a :class:`Snapshot`.
+
+    """
+
+    def _get_section_names(self):
+        return self.snapshot.permissions()
+
+    # BaseSourceAdapter
+    def _get_section_items(self, section):
+        return self.snapshot.permission_groups(section)
+
+    # BaseSourceAdapter
+    def _find_sections(self, group_name):
+        return self.snapshot.group_permissions(group_name)
+
+    # BaseSourceAdapter
+    def _section_exists(self, section):
+        return self.snapshot.has_permission(section)
+
+
+#}
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Support for many tenants sharing the same tables.
+
+When the users, groups and permissions of all the tenants are stored in the
+same tables, with a column that tells which tenant each row belongs to, a
+single pair of SQL adapters can serve them all. Set the name of that
+attribute on the adapters::
+
+    adapters = configure_sql_adapters(User, Group, Permission, DBSession,
+                                      tenant_attribute='tenant_id')
+
+From then on, the adapters only see the rows of the *current tenant*, which
+is bound to the thread serving the request (e.g., by
+:class:`~repoze.what.plugins.sql.middleware.TenantMiddleware`), and their
+queries fail with a :class:`~repoze.what.adapters.SourceError` when there's
+none. The sections each adapter has loaded are cached per tenant, in
+:class:`TenantCaches` which bound both the number of tenants and the number
+of sections per tenant. A snapshot built while a tenant is current only
+contains the groups and permissions of that tenant.
+
+Only the ORM-based adapters support tenants.
+
+"""
+
+from contextlib import contextmanager
+from threading import Lock, local
+
+from repoze.what.adapters import SourceError
+
+from repoze.what.plugins.sql.cache import OrderedDict, _set_newest
+
+__all__ = ['get_current_tenant', 'set_current_tenant', 'current_tenant',
+           'TenantCaches']
+
+
+# The tenant of the request being served by the current thread:
+_state = local()
+
+
+def get_current_tenant():
+    """
+    Return the tenant of the request being served by the current thread.
+
+    :return: The tenant, or ``None`` if it hasn't been set.
+
+    """
+    return getattr(_state, 'tenant', None)
+
+
+def set_current_tenant(tenant):
+    """
+    Set the tenant of the request being served by the current thread.
+
+    :param tenant: The key of the new tenant, or ``None`` to unset it.
+    :return: The previous tenant, if any.
+
+    """
+    previous = get_current_tenant()
+    _state.tenant = tenant
+    return previous
+
+
+@contextmanager
+def current_tenant(tenant_key):
+    """
+    Make ``tenant_key`` the current tenant within the ``with`` block.
+
+    For example, to do some maintenance outside of a request::
+
+        with current_tenant(u'acme'):
+            groups.create_section(u'designers')
+
+    """
+    previous = set_current_tenant(tenant_key)
+    try:
+        yield
+    finally:
+        set_current_tenant(previous)
+
+
+def _require_current_tenant():
+    """
+    Return the current tenant.
+
+    :raises SourceError: If there's none.
+
+    """
+    current = get_current_tenant()
+    if current is None:
+        raise SourceError('No tenant has been set for the current thread')
+    return current
+
+
+class TenantCaches(object):
+    """
+    The sections loaded by an adapter, cached per tenant.
+
+    Only the caches of the ``max_tenants`` most recently used tenants are
+    kept; the others are discarded. The cache of each tenant holds up to
+    ``max_sections`` sections, and it's emptied when it would exceed them.
+
+    Each adapter needs its own instance.
+
+    """
+
+    def __init__(self, max_tenants=1000, max_sections=None):
+        """
+        Create the caches.
+
+        :param max_tenants: The maximum number of tenants whose sections are
+            cached.
+        :param max_sections: The maximum number of sections cached per
+            tenant, or ``None`` for no limit.
+
+        """
+        self.max_tenants = max_tenants
+        self.max_sections = max_sections
+        self._caches = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._caches)
+
+    def __contains__(self, tenant_key):
+        return tenant_key in self._caches
+
+    def get(self, tenant_key):
+        """
+        Return the cache of ``tenant_key``, creating it if necessary.
+
+        :rtype: dict
+
+        """
+        self._lock.acquire()
+        try:
+            cache = self._caches.get(tenant_key)
+            if cache is None:
+                cache = _SectionCache(self.max_sections)
+            _set_newest(self._caches, tenant_key, cache, self.max_tenants)
+            return cache
+        finally:
+            self._lock.release()
+
+    def set(self, tenant_key, sections):
+        """
+        Replace the cache of ``tenant_key`` with ``sections``.
+
+        They're only kept if they don't exceed the maximum size.
+
+        """
+        cache = self.get(tenant_key)
+        cache.clear()
+        cache.all_sections_loaded = False
+        cache.discarded = self.max_sections is not None and \
+                          len(sections) > self.max_sections
+        if not cache.discarded:
+            dict.update(cache, sections)
+
+    def clear(self):
+        """Discard the caches of all the tenants."""
+        self._lock.acquire()
+        try:
+            self._caches.clear()
+        finally:
+            self._lock.release()
+
+
+class _SectionCache(dict):
+    """
+    The sections of a tenant, which is emptied when it would hold more than
+    ``max_sections``.
+
+    """
+
+    def __init__(self, max_sections):
+        super(_SectionCache, self).__init__()
+        self.max_sections = max_sections
+        # Whether it contains all the sections of the tenant:
+        self.all_sections_loaded = False
+        # Whether the last sections set were too many to be kept:
+        self.discarded = False
+
+    def __setitem__(self, section, items):
+        if self.max_sections is not None and section not in self and \
+           len(self) >= self.max_sections:
+            self.clear()
+            self.all_sections_loaded = False
+        super(_SectionCache, self).__setitem__(section, items)
@@ -30,6 +30,27 @@ def setup_database():
     init_model(engine)
     teardownDatabase()
     metadata.create_all(engine)
+    populate(DBSession)
+
+
+def setup_file_database(path, **engine_options):
+    """
+    Create and populate the test database in the SQLite file ``path``, so
+    that it's shared by all the threads.
+    
+    Return the scoped session bound to it.
+    
+    """
+    file_engine = create_engine('sqlite:///%s' % path, **engine_options)
+    metadata.create_all(file_engine)
+    session = scoped_session(sessionmaker(bind=file_engine))
+    populate(session)
+    session.remove()
+    return session
+
+
+def populate(DBSession):
+    """Add the test users, groups and permissions through ``DBSession``"""
 
     # Creating permissions
 
@@ -112,3 +133,36 @@ def teardownDatabase():
     DBSession.rollback()
     metadata.drop_all(engine)
 
+
+class CommitCounter(object):
+    """Session proxy which counts the commits"""
+    
+    def __init__(self, session):
+        self.session = session
+        self.commits = 0
+    
+    def commit(self):
+        self.commits += 1
+        self.session.commit()
+    
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+class QueryCounter(object):
+    """Session proxy which counts the queries"""
+    
+    def __init__(self, session):
+        self.session = session
+        self.queries = 0
+    
+    def query(self, *args, **kwargs):
+        self.queries += 1
+        return self.session.query(*args, **kwargs)
+    
+    def execute(self, *args, **kwargs):
+        self.queries += 1
+        return self.session.execute(*args, **kwargs)
+    
+    def __getattr__(self, name):
+        return getattr(self.session, name)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Stuff required to setup the test database shared by many tenants."""
+
+import os
+
+from sqlalchemy import create_engine
+
+from fixture.model_tenants import init_model, DBSession, metadata, \
+                                  Permission, Group, User
+
+engine = create_engine(os.environ.get('DBURL', 'sqlite://'))
+
+# The groups of each user and the permissions of each group, by tenant:
+TENANTS = {
+    u'acme': {
+        'users': {u'rms': (u'admins', u'developers'),
+                  u'linus': (u'developers', ),
+                  u'guido': ()},
+        'permissions': {u'edit-site': (u'admins', u'developers'),
+                        u'commit': (u'developers', )},
+        },
+    u'globex': {
+        'users': {u'rms': (u'trolls', ), u'sballmer': (u'admins', )},
+        'permissions': {u'edit-site': (u'admins', ),
+                        u'see-site': (u'trolls', )},
+        },
+    }
+
+
+def setup_database(bind=engine):
+    init_model(bind)
+    teardownDatabase(bind)
+    metadata.create_all(bind)
+
+    for (tenant, acl) in TENANTS.items():
+        groups = {}
+        for group_names in list(acl['users'].values()) + \
+                           list(acl['permissions'].values()):
+            for group_name in group_names:
+                if group_name not in groups:
+                    groups[group_name] = Group(tenant_id=tenant,
+                                               group_name=group_name)
+                    DBSession.add(groups[group_name])
+        for (user_name, group_names) in acl['users'].items():
+            user = User(tenant_id=tenant, user_name=user_name)
+            user.groups = [groups[name] for name in group_names]
+            DBSession.add(user)
+        for (permission_name, group_names) in acl['permissions'].items():
+            permission = Permission(tenant_id=tenant,
+                                    permission_name=permission_name)
+            permission.groups = [groups[name] for name in group_names]
+            DBSession.add(permission)
+
+    DBSession.commit()
+
+
+def teardownDatabase(bind=engine):
+    DBSession.rollback()
+    metadata.drop_all(bind)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Mock SQLAlchemy-powered model definition, where the users, groups and
+permissions of many tenants share the same tables.
+
+"""
+
+from sqlalchemy import Table, ForeignKey, Column, UniqueConstraint
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.types import Unicode, Integer
+from sqlalchemy.orm import scoped_session, sessionmaker, relation
+
+
+DBSession = scoped_session(sessionmaker(autoflush=True, autocommit=False))
+
+DeclarativeBase = declarative_base()
+
+metadata = DeclarativeBase.metadata
+
+def init_model(engine):
+    """Call me before using any of the tables or classes in the model."""
+    DBSession.configure(bind=engine)
+
+group_permission_table = Table('tenant_group_permission', metadata,
+    Column('group_id', Integer, ForeignKey('tenant_group.group_id',
+        onupdate="CASCADE", ondelete="CASCADE")),
+    Column('permission_id', Integer,
+        ForeignKey('tenant_permission.permission_id', onupdate="CASCADE",
+                   ondelete="CASCADE"))
+)
+
+user_group_table = Table('tenant_user_group', metadata,
+    Column('user_id', Integer, ForeignKey('tenant_user.user_id',
+        onupdate="CASCADE", ondelete="CASCADE")),
+    Column('group_id', Integer, ForeignKey('tenant_group.group_id',
+        onupdate="CASCADE", ondelete="CASCADE"))
+)
+
+# auth model
+
+class Group(DeclarativeBase):
+    
+    __tablename__ = 'tenant_group'
+    __table_args__ = (UniqueConstraint('tenant_id', 'group_name'), {})
+
+    group_id = Column(Integer, autoincrement=True, primary_key=True)
+
+    tenant_id = Column(Unicode(16), nullable=False)
+
+    group_name = Column(Unicode(16), nullable=False)
+
+    users = relation('User', secondary=user_group_table, backref='groups')
+
+
+class User(DeclarativeBase):
+    
+    __tablename__ = 'tenant_user'
+    __table_args__ = (UniqueConstraint('tenant_id', 'user_name'), {})
+
+    user_id = Column(Integer, autoincrement=True, primary_key=True)
+
+    tenant_id = Column(Unicode(16), nullable=False)
+
+    user_name = Column(Unicode(16), nullable=False)
+
+
+class Permission(DeclarativeBase):
+    
+    __tablename__ = 'tenant_permission'
+    __table_args__ = (UniqueConstraint('tenant_id', 'permission_name'), {})
+
+    permission_id = Column(Integer, autoincrement=True, primary_key=True)
+
+    tenant_id = Column(Unicode(16), nullable=False)
+
+    permission_name = Column(Unicode(16), nullable=False)
+
+    groups = relation(Group, secondary=group_permission_table,
+                      backref='permissions')
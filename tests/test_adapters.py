@@ -15,15 +15,26 @@
 
 """Test suite for the adapters provided by the  SQL plugin."""
 
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 
 from repoze.what.plugins.sql import SqlGroupsAdapter, SqlPermissionsAdapter, \
-                                    configure_sql_adapters
+                                    UserRecord, configure_sql_adapters, \
+                                    warm_up_sql_adapters, \
+                                    SqlCorePermissionsAdapter
+from repoze.what.adapters import SourceError
 from repoze.what.adapters.testutil import GroupsAdapterTester, \
                                           PermissionsAdapterTester
+from repoze.what.plugins.sql.cache import NegativeCache, SingleFlight, \
+                                          RevalidatingCache
 
 import databasesetup
 import databasesetup_translations
+from fixture import model
 from fixture.model import User, Group, Permission, DBSession
 from fixture.model_translations import Member, Team, Right, DBSession
 
@@ -60,6 +71,126 @@ class TestSqlGroupsAdapter(GroupsAdapterTester, _BaseSqlAdapterTester):
         assert len(groups) == 1
         assert groups == set(["nogroup"])
 
+
+class TestSqlGroupsAdapterWithUserRecords(GroupsAdapterTester,
+                                          _BaseSqlAdapterTester):
+    """Test suite for the SQL group source adapter loading user records"""
+    
+    def setUp(self):
+        super(TestSqlGroupsAdapterWithUserRecords, self).setUp()
+        databasesetup.setup_database()
+        self.adapter = SqlGroupsAdapter(databasesetup.Group,
+                                        databasesetup.User,
+                                        databasesetup.DBSession)
+        self.adapter.user_record_columns = ('user_id', 'user_name')
+        self.all_sections['nogroup'] = set()
+        # GroupsAdapterTester pops items from its class-level set otherwise:
+        self.new_items = set((u'guido', u'rasmus'))
+    
+    def test_record_is_stored_in_credentials(self):
+        credentials = {'repoze.what.userid': u'rms'}
+        groups = self.adapter.find_sections(credentials)
+        self.assertEqual(groups, set((u'admins', u'developers')))
+        record = credentials['repoze.what.userobj']
+        assert isinstance(record, UserRecord)
+        self.assertEqual(record.user_name, u'rms')
+        assert isinstance(record.user_id, int)
+        assert not hasattr(record, '__dict__')
+        self.assertRaises(AttributeError, setattr, record, 'user_name', u'x')
+    
+    def test_record_of_user_without_groups(self):
+        credentials = {'repoze.what.userid': u'guido'}
+        self.assertEqual(self.adapter.find_sections(credentials), set())
+        self.assertEqual(credentials['repoze.what.userobj'].user_name,
+                         u'guido')
+    
+    def test_non_existing_user(self):
+        credentials = {'repoze.what.userid': u'gustavo'}
+        self.assertEqual(self.adapter.find_sections(credentials), set())
+        assert 'repoze.what.userobj' not in credentials
+    
+    def test_user_object_in_credentials_is_used(self):
+        user = databasesetup.DBSession.query(User).filter_by(
+            user_name=u'linus').one()
+        credentials = {'repoze.what.userid': u'linus',
+                       'repoze.what.userobj': user}
+        self.assertEqual(self.adapter.find_sections(credentials),
+                         set((u'developers', )))
+        assert credentials['repoze.what.userobj'] is user
+    
+    def test_property(self):
+        self.adapter.translations['sections'] = "fake_groups"
+        credentials = {'repoze.what.userid': u'linus'}
+        self.assertEqual(self.adapter.find_sections(credentials),
+                         set((u'nogroup', )))
+        self.assertEqual(credentials['repoze.what.userobj'].user_name,
+                         u'linus')
+
+
+class TestSqlGroupsAdapterWithSubqueryLoader(TestSqlGroupsAdapter):
+    """Test suite for the SQL group source adapter loading groups apart"""
+    
+    def setUp(self):
+        super(TestSqlGroupsAdapterWithSubqueryLoader, self).setUp()
+        self.adapter.loader_strategy = 'subquery'
+        self.new_items = set((u'guido', u'rasmus'))
+
+
+class TestSqlGroupsAdapterWithLazyLoader(TestSqlGroupsAdapter):
+    """Test suite for the SQL group source adapter loading groups lazily"""
+    
+    def setUp(self):
+        super(TestSqlGroupsAdapterWithLazyLoader, self).setUp()
+        self.adapter.loader_strategy = 'none'
+        self.new_items = set((u'guido', u'rasmus'))
+
+
+class TestLoaderStrategy(_BaseSqlAdapterTester):
+    """Tests for the strategies to load the sections of an item"""
+    
+    def setUp(self):
+        super(TestLoaderStrategy, self).setUp()
+        databasesetup.setup_database()
+        self.adapter = SqlGroupsAdapter(databasesetup.Group,
+                                        databasesetup.User,
+                                        databasesetup.DBSession)
+    
+    def test_relationship_is_detected_once(self):
+        loading = self.adapter._get_sections_loading()
+        assert loading[0]
+        assert loading[1] is not None
+        assert self.adapter._get_sections_loading() is loading
+    
+    def test_property_is_detected(self):
+        self.adapter._get_sections_loading()
+        self.adapter.translations['sections'] = 'fake_groups'
+        self.assertEqual(self.adapter._get_sections_loading(), (False, None))
+    
+    def test_lazy_loading(self):
+        self.adapter.loader_strategy = 'none'
+        self.assertEqual(self.adapter._get_sections_loading(), (True, None))
+        self.adapter.loader_strategy = None
+        self.assertEqual(self.adapter._get_sections_loading(), (True, None))
+    
+    def test_unknown_strategy(self):
+        self.adapter.loader_strategy = 'psychic'
+        self.assertRaises(ValueError, self.adapter.find_sections,
+                          {'repoze.what.userid': u'rms'})
+        self.assertRaises(ValueError, configure_sql_adapters, User, Group,
+                          Permission, DBSession, loader_strategy='psychic')
+    
+    def test_selectin_strategy(self):
+        from sqlalchemy import orm
+        self.adapter.loader_strategy = 'selectin'
+        credentials = {'repoze.what.userid': u'rms'}
+        if hasattr(orm, 'selectinload'):
+            self.assertEqual(self.adapter.find_sections(credentials),
+                             set((u'admins', u'developers')))
+        else:
+            self.assertRaises(ValueError, self.adapter.find_sections,
+                              credentials)
+
+
 class TestSqlPermissionsAdapter(PermissionsAdapterTester,
                                 _BaseSqlAdapterTester):
     """Test suite for the SQL permission source adapter"""
@@ -137,6 +268,18 @@ class TestAdaptersConfigurator(unittest.TestCase):
         self.assertEquals(Group, group_adapter.parent_class,
                           permission_adapter.children_class)
         self.assertEqual(Permission, permission_adapter.parent_class)
+        self.assertEqual(group_adapter.user_record_columns, None)
+    
+    def test_with_loader_strategy(self):
+        adapters = configure_sql_adapters(User, Group, Permission, DBSession,
+                                          loader_strategy='none')
+        self.assertEqual(adapters['group'].loader_strategy, 'none')
+        self.assertEqual(adapters['permission'].loader_strategy, 'none')
+    
+    def test_with_user_record_columns(self):
+        adapters = configure_sql_adapters(User, Group, Permission, DBSession,
+                                          user_record_columns=('user_id', ))
+        self.assertEqual(adapters['group'].user_record_columns, ('user_id', ))
     
     def test_with_translations(self):
         group_translations = {
@@ -163,3 +306,403 @@ class TestAdaptersConfigurator(unittest.TestCase):
         self.assertEquals(group_adapter.translations['section_name'],
                           permission_adapter.translations['item_name'],
                           'group_name')
+
+
+class TestBatch(_BaseSqlAdapterTester):
+    """Tests for the batches of write operations"""
+    
+    def setUp(self):
+        super(TestBatch, self).setUp()
+        databasesetup.setup_database()
+        self.dbsession = databasesetup.CommitCounter(databasesetup.DBSession)
+        self.adapter = SqlGroupsAdapter(databasesetup.Group,
+                                        databasesetup.User,
+                                        self.dbsession)
+    
+    def test_operations_are_committed_once(self):
+        with self.adapter.batch():
+            for group in (u'designers', u'testers'):
+                self.adapter.create_section(group)
+                self.adapter.include_items(group, (u'guido', u'rasmus'))
+            self.adapter.exclude_items(u'developers', (u'linus', ))
+            self.adapter.edit_section(u'php', u'perl')
+            self.adapter.delete_section(u'python')
+            self.assertEqual(self.dbsession.commits, 0)
+        self.assertEqual(self.dbsession.commits, 1)
+        sections = self.adapter._get_all_sections()
+        self.assertEqual(sections[u'designers'], set((u'guido', u'rasmus')))
+        self.assertEqual(sections[u'testers'], set((u'guido', u'rasmus')))
+        self.assertEqual(sections[u'developers'], set((u'rms', )))
+        assert u'perl' in sections
+        assert u'php' not in sections
+        assert u'python' not in sections
+    
+    def test_nested_batches_join_the_outermost(self):
+        with self.adapter.batch():
+            with self.adapter.batch():
+                self.adapter.create_section(u'designers')
+            self.assertEqual(self.dbsession.commits, 0)
+            self.adapter.include_items(u'designers', (u'guido', ))
+        self.assertEqual(self.dbsession.commits, 1)
+        self.assertEqual(self.adapter._get_section_items(u'designers'),
+                         set((u'guido', )))
+    
+    def test_batch_is_rolled_back_on_errors(self):
+        try:
+            with self.adapter.batch():
+                self.adapter.create_section(u'designers')
+                self.adapter.include_items(u'admins', (u'guido', ))
+                self.adapter.include_items(u'designers', (u'gustavo', ))
+        except Exception:
+            pass
+        else:
+            self.fail('The unknown user should have aborted the batch')
+        self.assertEqual(self.dbsession.commits, 0)
+        # Rolling back the transaction that the batch was part of:
+        databasesetup.DBSession.rollback()
+        assert not self.adapter._section_exists(u'designers')
+        self.assertEqual(self.adapter.get_section_items(u'admins'),
+                         set((u'rms', )))
+    
+    def test_operations_outside_batches_commit_on_their_own(self):
+        self.adapter.create_section(u'designers')
+        self.adapter.include_items(u'designers', (u'guido', ))
+        self.assertEqual(self.dbsession.commits, 2)
+
+
+class TestNegativeCache(_BaseSqlAdapterTester):
+    """Tests for the cache of items that don't exist"""
+    
+    def setUp(self):
+        super(TestNegativeCache, self).setUp()
+        databasesetup.setup_database()
+        self.dbsession = databasesetup.QueryCounter(databasesetup.DBSession)
+        self.cache = NegativeCache()
+        adapters = configure_sql_adapters(
+            databasesetup.User, databasesetup.Group, databasesetup.Permission,
+            self.dbsession, negative_cache=self.cache)
+        self.groups = adapters['group']
+        self.permissions = adapters['permission']
+    
+    def test_unknown_user_is_looked_up_once(self):
+        credentials = {'repoze.what.userid': u'gustavo'}
+        self.assertEqual(self.groups.find_sections(credentials), set())
+        queries = self.dbsession.queries
+        self.assertEqual(self.groups.find_sections(credentials), set())
+        self.assertEqual(self.dbsession.queries, queries)
+        assert (databasesetup.User, u'gustavo') in self.cache
+    
+    def test_unknown_user_with_records(self):
+        self.groups.user_record_columns = ('user_name', )
+        credentials = {'repoze.what.userid': u'gustavo'}
+        self.assertEqual(self.groups.find_sections(credentials), set())
+        queries = self.dbsession.queries
+        self.assertEqual(self.groups.find_sections(credentials), set())
+        self.assertEqual(self.dbsession.queries, queries)
+    
+    def test_known_users_are_not_cached(self):
+        credentials = {'repoze.what.userid': u'rms'}
+        self.groups.find_sections(credentials)
+        self.assertEqual(len(self.cache), 0)
+    
+    def test_unknown_items_cannot_be_included(self):
+        self.permissions.find_sections(u'designers')
+        self.assertRaises(SourceError, self.permissions._include_items,
+                          u'commit', (u'designers', ))
+    
+    def test_created_group_is_forgotten(self):
+        self.assertEqual(self.permissions.find_sections(u'designers'), set())
+        self.groups.create_section(u'designers')
+        self.permissions.include_items(u'commit', (u'designers', ))
+        self.assertEqual(self.permissions.find_sections(u'designers'),
+                         set((u'commit', )))
+    
+    def test_renamed_group_is_forgotten(self):
+        self.assertEqual(self.permissions.find_sections(u'designers'), set())
+        self.groups.edit_section(u'developers', u'designers')
+        self.assertEqual(self.permissions.find_sections(u'designers'),
+                         set((u'commit', u'edit-site')))
+
+
+class TestSingleFlight(_BaseSqlAdapterTester):
+    """Tests for the coalescing of concurrent lookups in the adapters"""
+    
+    def setUp(self):
+        super(TestSingleFlight, self).setUp()
+        databasesetup.setup_database()
+        self.adapter = SqlPermissionsAdapter(databasesetup.Permission,
+                                             databasesetup.Group,
+                                             databasesetup.DBSession)
+        self.adapter.single_flight = SingleFlight()
+    
+    def test_concurrent_lookups_share_one_query(self):
+        calls = []
+        def slow_load_sections(group_name):
+            calls.append(group_name)
+            time.sleep(0.3)
+            return set((u'commit', u'edit-site'))
+        self.adapter._load_sections = slow_load_sections
+        results = []
+        start = threading.Event()
+        def find_permissions():
+            start.wait()
+            results.append(self.adapter.find_sections(u'developers'))
+        threads = [threading.Thread(target=find_permissions)
+                   for i in range(20)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [u'developers'])
+        self.assertEqual(results, [set((u'commit', u'edit-site'))] * 20)
+        # Each thread got its own set:
+        self.assertEqual(len(set([id(r) for r in results])), 20)
+    
+    def test_lookups_still_work(self):
+        self.assertEqual(self.adapter.find_sections(u'developers'),
+                         set((u'commit', u'edit-site')))
+        self.assertEqual(self.adapter.find_sections(u'designers'), set())
+
+
+class TestRevalidatingCache(_BaseSqlAdapterTester):
+    """Tests for the sections cached across requests by the adapters"""
+    
+    def setUp(self):
+        super(TestRevalidatingCache, self).setUp()
+        databasesetup.setup_database()
+        self.adapter = SqlPermissionsAdapter(databasesetup.Permission,
+                                             databasesetup.Group,
+                                             databasesetup.DBSession)
+        self.adapter.revalidating_cache = RevalidatingCache(ttl=0.05,
+                                                            grace=60)
+    
+    def test_sections_are_cached(self):
+        first = self.adapter.find_sections(u'developers')
+        self.assertEqual(first, set((u'commit', u'edit-site')))
+        first.add(u'tampered')
+        self.adapter._load_sections = None
+        self.assertEqual(self.adapter.find_sections(u'developers'),
+                         set((u'commit', u'edit-site')))
+    
+    def test_expired_sections_are_refreshed_in_the_background(self):
+        self.assertEqual(self.adapter.find_sections(u'developers'),
+                         set((u'commit', u'edit-site')))
+        refreshes = []
+        def load_sections(group_name):
+            refreshes.append(threading.currentThread())
+            return set((u'commit', ))
+        self.adapter._load_sections = load_sections
+        time.sleep(0.1)
+        self.assertEqual(self.adapter.find_sections(u'developers'),
+                         set((u'commit', u'edit-site')))
+        while self.adapter.revalidating_cache._refreshing:
+            time.sleep(0.01)
+        self.assertEqual(len(refreshes), 1)
+        assert refreshes[0] is not threading.currentThread()
+        self.assertEqual(self.adapter.find_sections(u'developers'),
+                         set((u'commit', )))
+    
+    def test_refreshes_use_their_own_credentials(self):
+        groups = SqlGroupsAdapter(databasesetup.Group, databasesetup.User,
+                                  databasesetup.DBSession)
+        groups.revalidating_cache = self.adapter.revalidating_cache
+        credentials = {'repoze.what.userid': u'rms'}
+        self.assertEqual(groups.find_sections(credentials),
+                         set((u'admins', u'developers')))
+        loaded = []
+        def load_sections(credentials):
+            loaded.append(credentials)
+            credentials['repoze.what.userobj'] = object()
+            return set((u'admins', ))
+        groups._load_sections = load_sections
+        time.sleep(0.1)
+        credentials = {'repoze.what.userid': u'rms'}
+        groups.find_sections(credentials)
+        while groups.revalidating_cache._refreshing:
+            time.sleep(0.01)
+        self.assertEqual(len(loaded), 1)
+        assert loaded[0] is not credentials
+        self.assertEqual(credentials, {'repoze.what.userid': u'rms'})
+
+    def test_writes_clear_the_cache(self):
+        self.adapter.find_sections(u'developers')
+        self.adapter.exclude_item(u'commit', u'developers')
+        self.assertEqual(len(self.adapter.revalidating_cache), 0)
+        self.assertEqual(self.adapter.find_sections(u'developers'),
+                         set((u'edit-site', )))
+    
+    def test_configuration(self):
+        cache = RevalidatingCache()
+        adapters = configure_sql_adapters(User, Group, Permission, DBSession,
+                                          revalidating_cache=cache)
+        assert adapters['group'].revalidating_cache is cache
+        assert adapters['permission'].revalidating_cache is cache
+
+
+class TestWarmUp(_BaseSqlAdapterTester):
+    """Tests for the warm-up of the adapters"""
+    
+    def setUp(self):
+        super(TestWarmUp, self).setUp()
+        databasesetup.setup_database()
+        self.dbsession = databasesetup.QueryCounter(databasesetup.DBSession)
+        self.adapters = configure_sql_adapters(
+            databasesetup.User, databasesetup.Group, databasesetup.Permission,
+            self.dbsession)
+    
+    def test_hot_users_are_preloaded(self):
+        cache = RevalidatingCache()
+        for adapter in self.adapters.values():
+            adapter.revalidating_cache = cache
+        warm_up_sql_adapters(self.adapters, hot_users=(u'rms', u'gustavo'))
+        for adapter in self.adapters.values():
+            self.assertEqual(adapter.loaded_sections, {})
+        queries = self.dbsession.queries
+        self.assertEqual(
+            self.adapters['group'].find_sections({'repoze.what.userid': u'rms'}),
+            set((u'admins', u'developers')))
+        self.assertEqual(
+            self.adapters['permission'].find_sections(u'developers'),
+            set((u'commit', u'edit-site')))
+        self.assertEqual(self.dbsession.queries, queries)
+    
+    def test_hot_users_without_cache(self):
+        self.assertRaises(ValueError, warm_up_sql_adapters, self.adapters,
+                          hot_users=(u'rms', ))
+        self.assertEqual(self.dbsession.queries, 0)
+        for adapter in self.adapters.values():
+            assert not adapter.warmed_up
+    
+    def test_members_are_preloaded(self):
+        warm_up_sql_adapters(self.adapters, hot_users=(u'rms', u'gustavo'),
+                             load_members=True)
+        groups = self.adapters['group']
+        permissions = self.adapters['permission']
+        self.assertEqual(groups.loaded_sections, {
+            u'admins': set((u'rms', )),
+            u'developers': set((u'rms', u'linus'))})
+        self.assertEqual(permissions.loaded_sections, {
+            u'edit-site': set((u'admins', u'developers')),
+            u'commit': set((u'developers', ))})
+        queries = self.dbsession.queries
+        groups.get_section_items(u'developers')
+        permissions.get_section_items(u'commit')
+        self.assertEqual(self.dbsession.queries, queries)
+    
+    def test_readiness_flag(self):
+        for adapter in self.adapters.values():
+            assert not adapter.warmed_up
+        warm_up_sql_adapters(self.adapters)
+        for adapter in self.adapters.values():
+            assert adapter.warmed_up
+            self.assertEqual(adapter.loaded_sections, {})
+    
+    def test_invalid_translations(self):
+        self.adapters['permission'].translations['items'] = 'teams'
+        self.assertRaises(SourceError, warm_up_sql_adapters, self.adapters)
+        for adapter in self.adapters.values():
+            assert not adapter.warmed_up
+    
+    def test_invalid_user_record_columns(self):
+        self.adapters['group'].user_record_columns = ('user_id', 'email')
+        self.assertRaises(SourceError, warm_up_sql_adapters, self.adapters)
+    
+    def test_core_adapters(self):
+        adapter = SqlCorePermissionsAdapter(model.Permission.__table__,
+                                            model.Group.__table__,
+                                            model.group_permission_table,
+                                            self.dbsession)
+        warm_up_sql_adapters({'permission': adapter})
+        assert adapter.warmed_up
+        adapter.translations['item_name'] = 'team_name'
+        self.assertRaises(SourceError, warm_up_sql_adapters,
+                          {'permission': adapter})
+    
+    def test_pool_is_filled(self):
+        from sqlalchemy.pool import QueuePool
+        directory = tempfile.mkdtemp()
+        try:
+            dbsession = databasesetup.setup_file_database(
+                os.path.join(directory, 'acl.db'), poolclass=QueuePool,
+                pool_size=3)
+            adapters = configure_sql_adapters(
+                databasesetup.User, databasesetup.Group,
+                databasesetup.Permission, dbsession)
+            pool = dbsession.get_bind().pool
+            warm_up_sql_adapters(adapters, pool_size=2)
+            self.assertEqual(pool.checkedin(), 2)
+            warm_up_sql_adapters(adapters)
+            self.assertEqual(pool.checkedin(), 3)
+            dbsession.remove()
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestSectionStatements(_BaseSqlAdapterTester):
+    """Tests for the renaming and removal of sections without loading them"""
+    
+    def setUp(self):
+        super(TestSectionStatements, self).setUp()
+        databasesetup.setup_database()
+        self.dbsession = databasesetup.DBSession
+        self.adapters = configure_sql_adapters(
+            databasesetup.User, databasesetup.Group, databasesetup.Permission,
+            self.dbsession)
+        self.groups = self.adapters['group']
+        self.dbsession.expunge_all()
+    
+    def _get_loaded(self, mapped_class):
+        return [i for i in self.dbsession.identity_map.values()
+                if isinstance(i, mapped_class)]
+    
+    def test_section_is_renamed_without_loading_it(self):
+        self.groups.edit_section(u'developers', u'hackers')
+        self.assertEqual(self._get_loaded(Group), [])
+        self.assertEqual(self.groups.get_section_items(u'hackers'),
+                         set((u'rms', u'linus')))
+        assert not self.groups._section_exists(u'developers')
+    
+    def test_renamed_section_in_session(self):
+        developers = self.groups._get_section_as_row(u'developers')
+        self.groups.edit_section(u'developers', u'hackers')
+        self.assertEqual(developers.group_name, u'hackers')
+    
+    def test_renaming_pending_section(self):
+        with self.groups.batch():
+            self.groups.create_section(u'designers')
+            self.groups.edit_section(u'designers', u'artists')
+        assert self.groups._section_exists(u'artists')
+        assert not self.groups._section_exists(u'designers')
+    
+    def test_section_is_deleted_without_loading_its_items(self):
+        self.groups.delete_section(u'developers')
+        self.assertEqual(self._get_loaded(Group), [])
+        self.assertEqual(self._get_loaded(User), [])
+        assert not self.groups._section_exists(u'developers')
+        rows = self.dbsession.execute(model.user_group_table.select())
+        self.assertEqual(len(rows.fetchall()), 2)
+        self.assertEqual(self.adapters['permission'].get_section_items(
+            u'commit'), set())
+    
+    def test_deleted_section_in_session(self):
+        rms = self.groups._get_item_as_row(u'rms')
+        self.assertEqual(len(rms.groups), 2)
+        self.groups.delete_section(u'developers')
+        self.assertEqual([g.group_name for g in rms.groups], [u'admins'])
+        self.assertEqual(self._get_loaded(Group), rms.groups)
+        credentials = {'repoze.what.userid': u'rms'}
+        self.assertEqual(self.groups.find_sections(credentials),
+                         set((u'admins', )))
+    
+    def test_deleting_section_with_pending_items(self):
+        with self.groups.batch():
+            self.groups.include_items(u'trolls', (u'guido', ))
+            self.groups.delete_section(u'trolls')
+        rows = self.dbsession.execute(model.user_group_table.select())
+        self.assertEqual(len(rows.fetchall()), 3)
+    
+    def test_computed_sections(self):
+        self.groups.translations['sections'] = 'fake_groups'
+        self.groups.delete_section(u'developers')
+        assert not self.groups._section_exists(u'developers')
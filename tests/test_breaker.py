@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Test suite for the circuit breaker of the database calls."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from repoze.what.adapters import SourceError
+
+from repoze.what.plugins.sql import SqlGroupsAdapter, SqlPermissionsAdapter
+from repoze.what.plugins.sql.breaker import CircuitBreaker, \
+                                            CircuitOpenError, CLOSED, OPEN, \
+                                            HALF_OPEN
+
+import databasesetup
+
+
+RMS_GROUPS = set((u'admins', u'developers'))
+
+
+def fail():
+    raise ValueError('database is down')
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Tests for the circuit breaker on its own"""
+
+    def _fail(self, breaker, calls=1):
+        for i in range(calls):
+            self.assertRaises(ValueError, breaker.call, fail)
+
+    def _trip(self, breaker):
+        while breaker.state == CLOSED:
+            self._fail(breaker)
+
+    def test_successful_calls(self):
+        breaker = CircuitBreaker(min_calls=2)
+        self.assertEqual(breaker.call(lambda: 'result'), 'result')
+        self.assertEqual(breaker.call(lambda: 'result'), 'result')
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_opening_on_failures(self):
+        breaker = CircuitBreaker(failure_rate=0.5, min_calls=4)
+        breaker.call(lambda: None)
+        breaker.call(lambda: None)
+        self._fail(breaker)
+        self.assertEqual(breaker.state, CLOSED)
+        self._fail(breaker)
+        self.assertEqual(breaker.state, OPEN)
+        self.assertRaises(CircuitOpenError, breaker.call, lambda: None)
+
+    def test_only_recent_calls_count(self):
+        breaker = CircuitBreaker(failure_rate=0.5, window_size=4, min_calls=4)
+        self._fail(breaker)
+        for i in range(4):
+            breaker.call(lambda: None)
+        self._fail(breaker)
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_opening_on_slow_calls(self):
+        breaker = CircuitBreaker(min_calls=2, slow_call_duration=0.01)
+        def slow():
+            time.sleep(0.02)
+            return 'result'
+        self.assertEqual(breaker.call(slow), 'result')
+        self.assertEqual(breaker.call(slow), 'result')
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_source_errors_are_not_failures(self):
+        breaker = CircuitBreaker(min_calls=2)
+        def missing():
+            raise SourceError('No such group')
+        for i in range(4):
+            self.assertRaises(SourceError, breaker.call, missing)
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_last_known_good_results(self):
+        breaker = CircuitBreaker(min_calls=2)
+        self.assertEqual(breaker.call(lambda: 'old', 'key'), 'old')
+        self._trip(breaker)
+        self.assertEqual(breaker.call(fail, 'key'), 'old')
+        self.assertRaises(CircuitOpenError, breaker.call, fail, 'other')
+        self.assertRaises(CircuitOpenError, breaker.call, fail)
+
+    def test_forgetting_known_results(self):
+        breaker = CircuitBreaker(min_calls=2)
+        breaker.call(lambda: 'a', 'a')
+        breaker.call(lambda: 'b', 'b')
+        breaker.discard('a')
+        breaker.discard('c')
+        self.assertEqual(breaker.get_stats()['known_results'], 1)
+        breaker.clear()
+        self.assertEqual(breaker.get_stats()['known_results'], 0)
+
+    def test_calls_started_before_clearing_are_not_kept(self):
+        breaker = CircuitBreaker()
+        self.assertEqual(breaker.call(breaker.clear, 'key'), None)
+        self.assertEqual(breaker.get_stats()['known_results'], 0)
+
+    def test_known_results_are_bounded(self):
+        breaker = CircuitBreaker(max_results=2)
+        for key in 'abc':
+            breaker.call(lambda: key, key)
+        self.assertEqual(breaker.get_stats()['known_results'], 2)
+        assert 'a' not in breaker._results
+
+    def test_closing_after_successful_probes(self):
+        breaker = CircuitBreaker(min_calls=2, reset_timeout=0.01,
+                                 half_open_calls=2)
+        self._trip(breaker)
+        time.sleep(0.02)
+        self.assertEqual(breaker.state, HALF_OPEN)
+        breaker.call(lambda: None)
+        self.assertEqual(breaker.state, HALF_OPEN)
+        breaker.call(lambda: None)
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(breaker.get_stats()['calls'], 0)
+
+    def test_reopening_after_failed_probe(self):
+        breaker = CircuitBreaker(min_calls=2, reset_timeout=0.01)
+        self._trip(breaker)
+        time.sleep(0.02)
+        self.assertRaises(ValueError, breaker.call, fail)
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(breaker.get_stats()['trips'], 2)
+
+    def test_probes_are_limited(self):
+        breaker = CircuitBreaker(min_calls=2, reset_timeout=0.01)
+        self._trip(breaker)
+        time.sleep(0.02)
+        def probe():
+            # Another call while this probe is in progress:
+            self.assertRaises(CircuitOpenError, breaker.call, lambda: None)
+            return 'result'
+        self.assertEqual(breaker.call(probe), 'result')
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_check(self):
+        breaker = CircuitBreaker(min_calls=2, reset_timeout=0.01)
+        breaker.check()
+        self._trip(breaker)
+        self.assertRaises(CircuitOpenError, breaker.check)
+        time.sleep(0.02)
+        # No writes while probing either:
+        self.assertRaises(CircuitOpenError, breaker.check)
+
+    def test_reset(self):
+        breaker = CircuitBreaker(min_calls=2)
+        self._trip(breaker)
+        breaker.reset()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(breaker.call(lambda: 'result'), 'result')
+
+    def test_stats(self):
+        breaker = CircuitBreaker(min_calls=3)
+        breaker.call(lambda: 'result', 'key')
+        self._fail(breaker, 2)
+        self.assertRaises(CircuitOpenError, breaker.call, lambda: None)
+        self.assertEqual(breaker.get_stats(), {
+            'state': OPEN,
+            'calls': 3,
+            'failed': 2,
+            'rejected_calls': 1,
+            'trips': 1,
+            'known_results': 1,
+            })
+
+
+class TestAdaptersWithFaultyDatabase(unittest.TestCase):
+    """Tests for the adapters behind a circuit breaker, on a faulty database"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.session = databasesetup.setup_file_database(
+            os.path.join(self.directory, 'acl.db'))
+        self.engine = self.session.get_bind()
+        self.fault = None
+        event.listen(self.engine, 'before_cursor_execute', self._inject_fault)
+        self.breaker = CircuitBreaker(min_calls=2, reset_timeout=0.05)
+        self.groups = SqlGroupsAdapter(databasesetup.Group,
+                                       databasesetup.User, self.session)
+        self.permissions = SqlPermissionsAdapter(databasesetup.Permission,
+                                                 databasesetup.Group,
+                                                 self.session)
+        self.groups.circuit_breaker = self.breaker
+        self.permissions.circuit_breaker = self.breaker
+
+    def tearDown(self):
+        self.session.remove()
+        self.engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def _inject_fault(self, conn, cursor, statement, parameters, context,
+                      executemany):
+        if self.fault == 'error':
+            raise OperationalError(statement, parameters,
+                                   Exception('database is down'))
+        if self.fault == 'slow':
+            time.sleep(0.05)
+
+    def _find_groups(self, user_name):
+        return self.groups.find_sections({'repoze.what.userid': user_name})
+
+    def _fail_reads(self):
+        self.fault = 'error'
+        while self.breaker.state == CLOSED:
+            self.session.remove()
+            self.assertRaises(OperationalError, self._find_groups, u'linus')
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_reads_fall_back_to_last_known_good(self):
+        self.assertEqual(self._find_groups(u'rms'), RMS_GROUPS)
+        self.assertEqual(self.permissions.find_sections(u'developers'),
+                         set((u'commit', u'edit-site')))
+        self._fail_reads()
+        self.assertEqual(self._find_groups(u'rms'), RMS_GROUPS)
+        self.assertEqual(self.permissions.find_sections(u'developers'),
+                         set((u'commit', u'edit-site')))
+        self.assertRaises(CircuitOpenError, self._find_groups, u'guido')
+
+    def test_slow_reads_open_the_breaker(self):
+        self.breaker.slow_call_duration = 0.02
+        self.fault = 'slow'
+        self.assertEqual(self._find_groups(u'rms'), RMS_GROUPS)
+        self.assertEqual(self._find_groups(u'linus'), set((u'developers', )))
+        self.assertEqual(self.breaker.state, OPEN)
+        started = time.time()
+        self.assertEqual(self._find_groups(u'rms'), RMS_GROUPS)
+        assert time.time() - started < 0.02
+
+    def test_writes_fail_fast(self):
+        self._find_groups(u'rms')
+        self._fail_reads()
+        self.fault = None
+        self.session.remove()
+        self.assertRaises(CircuitOpenError, self.groups.include_item,
+                          u'admins', u'rms')
+        self.assertRaises(CircuitOpenError, self.groups.create_sections,
+                          [u'designers'])
+        self.assertEqual(self.session.query(databasesetup.Group).filter_by(
+            group_name=u'designers').count(), 0)
+
+    def test_writes_forget_known_results(self):
+        self.assertEqual(self._find_groups(u'rms'), RMS_GROUPS)
+        self.groups.exclude_item(u'admins', u'rms')
+        self._fail_reads()
+        # The membership just revoked doesn't come back:
+        self.assertRaises(CircuitOpenError, self._find_groups, u'rms')
+
+    def test_writes_in_batch_forget_known_results(self):
+        self.assertEqual(self._find_groups(u'rms'), RMS_GROUPS)
+        with self.groups.batch():
+            self.groups.exclude_item(u'admins', u'rms')
+            # Not until the batch is committed:
+            assert self.breaker.get_stats()['known_results']
+        self.assertEqual(self.breaker.get_stats()['known_results'], 0)
+
+    def test_recovery(self):
+        self._fail_reads()
+        self.fault = None
+        self.session.remove()
+        time.sleep(0.06)
+        self.assertEqual(self._find_groups(u'linus'), set((u'developers', )))
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.groups.include_item(u'admins', u'linus')
+        self.assertEqual(self._find_groups(u'linus'),
+                         set((u'admins', u'developers')))
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Test suite for the bulk export and import of sections."""
+
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from repoze.what.adapters import NonExistingSectionError, SourceError
+
+from repoze.what.plugins.sql import configure_sql_adapters, \
+                                    SqlCoreGroupsAdapter
+from repoze.what.plugins.sql.bulk import export_sections, import_sections
+
+import databasesetup
+from fixture import model
+
+
+GROUPS_JSONL = """\
+{"item": "rms", "section": "admins"}
+{"item": "linus", "section": "developers"}
+{"item": "rms", "section": "developers"}
+{"item": null, "section": "nogroup"}
+{"item": null, "section": "php"}
+{"item": null, "section": "python"}
+{"item": "sballmer", "section": "trolls"}
+"""
+
+GROUPS_CSV = """\
+section,item\r
+admins,rms\r
+developers,linus\r
+developers,rms\r
+nogroup,\r
+php,\r
+python,\r
+trolls,sballmer\r
+"""
+
+
+class _BaseBulkTester(unittest.TestCase):
+
+    def setUp(self):
+        databasesetup.setup_database()
+        adapters = configure_sql_adapters(
+            databasesetup.User, databasesetup.Group, databasesetup.Permission,
+            databasesetup.DBSession)
+        self.groups = adapters['group']
+        self.permissions = adapters['permission']
+
+    def tearDown(self):
+        databasesetup.teardownDatabase()
+
+
+class TestExport(_BaseBulkTester):
+    """Tests for the export of sections"""
+
+    def test_jsonl(self):
+        stream = StringIO()
+        stats = export_sections(self.groups, stream)
+        self.assertEqual(stream.getvalue(), GROUPS_JSONL)
+        self.assertEqual(stats['records'], 7)
+
+    def test_csv(self):
+        stream = StringIO()
+        export_sections(self.groups, stream, 'csv')
+        self.assertEqual(stream.getvalue(), GROUPS_CSV)
+
+    def test_chunks(self):
+        progress = []
+        export_sections(self.groups, StringIO(), chunk_size=3,
+                        progress=progress.append)
+        self.assertEqual([stats['records'] for stats in progress], [3, 6, 7])
+
+    def test_without_association_table(self):
+        self.groups.translations['sections'] = 'fake_groups'
+        stream = StringIO()
+        export_sections(self.groups, stream)
+        self.assertEqual(stream.getvalue(), GROUPS_JSONL)
+
+    def test_core_adapter(self):
+        adapter = SqlCoreGroupsAdapter(model.Group.__table__,
+                                       model.User.__table__,
+                                       model.user_group_table,
+                                       databasesetup.DBSession)
+        stream = StringIO()
+        export_sections(adapter, stream)
+        self.assertEqual(stream.getvalue(), GROUPS_JSONL)
+
+    def test_unsupported_format(self):
+        self.assertRaises(ValueError, export_sections, self.groups,
+                          StringIO(), 'xml')
+
+
+class TestImport(_BaseBulkTester):
+    """Tests for the import of sections"""
+
+    def test_new_and_existing_sections(self):
+        stream = StringIO(
+            '{"section": "designers", "item": "guido"}\n'
+            '{"section": "designers", "item": "rasmus"}\n'
+            '{"section": "admins", "item": "rms"}\n'
+            '{"section": "admins", "item": "linus"}\n'
+            '{"section": "admins", "item": "linus"}\n'
+            '{"section": "testers", "item": null}\n'
+            '\n')
+        stats = import_sections(self.groups, stream, chunk_size=2)
+        self.assertEqual(stats['records'], 6)
+        self.assertEqual(stats['included'], 3)
+        self.assertEqual(stats['sections_created'], 2)
+        sections = self.groups.get_all_sections()
+        self.assertEqual(sections[u'designers'], set((u'guido', u'rasmus')))
+        self.assertEqual(sections[u'admins'], set((u'rms', u'linus')))
+        self.assertEqual(sections[u'testers'], set())
+        # The ORM collections were refreshed:
+        linus = databasesetup.DBSession.query(model.User).filter_by(
+            user_name=u'linus').one()
+        self.assertEqual(set([g.group_name for g in linus.groups]),
+                         set((u'admins', u'developers')))
+
+    def test_csv(self):
+        stream = StringIO('section,item\r\ndesigners,guido\r\ntesters,\r\n')
+        import_sections(self.groups, stream, 'csv')
+        self.assertEqual(self.groups.get_section_items(u'designers'),
+                         set((u'guido', )))
+        self.assertEqual(self.groups.get_section_items(u'testers'), set())
+
+    def test_round_trip(self):
+        exported = StringIO()
+        export_sections(self.permissions, exported, 'csv')
+        databasesetup.teardownDatabase()
+        databasesetup.setup_database()
+        for permission in list(self.permissions.get_all_sections()):
+            self.permissions.delete_section(permission)
+        self.assertEqual(self.permissions.get_all_sections(), {})
+        import_sections(self.permissions, StringIO(exported.getvalue()),
+                        'csv')
+        self.assertEqual(self.permissions.get_all_sections(), {
+            u'see-site': set((u'trolls', )),
+            u'edit-site': set((u'admins', u'developers')),
+            u'commit': set((u'developers', )),
+            u'nopermission': set()})
+
+    def test_unknown_items(self):
+        stream = StringIO('{"section": "designers", "item": "guido"}\n'
+                          '{"section": "designers", "item": "gustavo"}\n')
+        self.assertRaises(SourceError, import_sections, self.groups, stream)
+        assert not self.groups._section_exists(u'designers')
+
+    def test_batch(self):
+        stream = StringIO('{"section": "designers", "item": "guido"}\n'
+                          '{"section": "testers", "item": "gustavo"}\n')
+        try:
+            with self.groups.batch():
+                import_sections(self.groups, stream, chunk_size=1)
+        except SourceError:
+            pass
+        else:
+            self.fail('The unknown user should have aborted the import')
+        databasesetup.DBSession.rollback()
+        assert not self.groups._section_exists(u'designers')
+
+    def test_without_association_table(self):
+        self.groups.translations['sections'] = 'fake_groups'
+        stream = StringIO('{"section": "designers", "item": "guido"}\n'
+                          '{"section": "admins", "item": "rms"}\n'
+                          '{"section": "admins", "item": "linus"}\n')
+        stats = import_sections(self.groups, stream)
+        self.assertEqual(stats['included'], 2)
+        self.assertEqual(stats['sections_created'], 1)
+        self.assertEqual(self.groups.get_section_items(u'admins'),
+                         set((u'rms', u'linus')))
+
+    def test_without_association_table_in_batch(self):
+        self.groups.translations['sections'] = 'fake_groups'
+        stream = StringIO('{"section": "admins", "item": "linus"}\n'
+                          '{"section": "php", "item": "guido"}\n')
+        with self.groups.batch():
+            stats = import_sections(self.groups, stream, chunk_size=1)
+        self.assertEqual(stats['included'], 2)
+        # Checking the rows in the database, rather than the ORM collections:
+        rows = databasesetup.DBSession.execute(
+            model.user_group_table.select()).fetchall()
+        groups = dict([(g.group_id, g.group_name) for g in
+                       databasesetup.DBSession.query(model.Group)])
+        users = dict([(u.user_id, u.user_name) for u in
+                      databasesetup.DBSession.query(model.User)])
+        memberships = set([(groups[row.group_id], users[row.user_id])
+                           for row in rows])
+        assert (u'admins', u'linus') in memberships
+        assert (u'php', u'guido') in memberships
+
+    def test_core_adapter(self):
+        adapter = SqlCoreGroupsAdapter(model.Group.__table__,
+                                       model.User.__table__,
+                                       model.user_group_table,
+                                       databasesetup.DBSession)
+        stream = StringIO('{"section": "designers", "item": "guido"}\n')
+        import_sections(adapter, stream)
+        self.assertEqual(adapter.get_section_items(u'designers'),
+                         set((u'guido', )))
+
+    def test_cache_is_cleared(self):
+        self.groups.get_section_items(u'admins')
+        stream = StringIO('{"section": "admins", "item": "linus"}\n')
+        import_sections(self.groups, stream)
+        self.assertEqual(self.groups.get_section_items(u'admins'),
+                         set((u'rms', u'linus')))
+
+
+class TestReconcile(_BaseBulkTester):
+    """Tests for the reconciliation of sections"""
+
+    desired = {
+        u'admins': set((u'rms', )),
+        u'developers': set((u'linus', u'guido')),
+        u'php': set((u'rasmus', )),
+        }
+
+    expected_changes = {
+        u'developers': {'included': set((u'guido', )),
+                        'excluded': set((u'rms', ))},
+        u'php': {'included': set((u'rasmus', )), 'excluded': set()},
+        }
+
+    def _check_sections(self, adapter):
+        sections = adapter.get_all_sections()
+        self.assertEqual(sections[u'admins'], set((u'rms', )))
+        self.assertEqual(sections[u'developers'], set((u'linus', u'guido')))
+        self.assertEqual(sections[u'php'], set((u'rasmus', )))
+        # The other sections are left alone:
+        self.assertEqual(sections[u'trolls'], set((u'sballmer', )))
+
+    def test_changes(self):
+        changes = self.groups.reconcile(self.desired)
+        self.assertEqual(changes, self.expected_changes)
+        self._check_sections(self.groups)
+
+    def test_queries(self):
+        self.groups.dbsession = databasesetup.QueryCounter(
+            databasesetup.DBSession)
+        self.groups.reconcile(self.desired)
+        # The sections, their items, the new items, one DELETE for
+        # "developers" and one INSERT:
+        self.assertEqual(self.groups.dbsession.queries, 5)
+
+    def test_chunks(self):
+        changes = self.groups.reconcile(self.desired, chunk_size=1)
+        self.assertEqual(changes, self.expected_changes)
+        self._check_sections(self.groups)
+
+    def test_chunks_within_section(self):
+        self.groups.dbsession = databasesetup.QueryCounter(
+            databasesetup.DBSession)
+        desired = {u'developers': set((u'guido', u'rasmus', u'sballmer'))}
+        changes = self.groups.reconcile(desired, chunk_size=1)
+        self.assertEqual(changes, {u'developers': {
+            'included': desired[u'developers'],
+            'excluded': set((u'rms', u'linus'))}})
+        # The section, its items, one query per new item, one DELETE per
+        # excluded item and one INSERT:
+        self.assertEqual(self.groups.dbsession.queries, 8)
+        self.assertEqual(self.groups.get_section_items(u'developers'),
+                         desired[u'developers'])
+
+    def test_nothing_to_change(self):
+        desired = {u'admins': set((u'rms', )), u'python': set()}
+        self.assertEqual(self.groups.reconcile(desired), {})
+
+    def test_unknown_section(self):
+        desired = {u'admins': set(), u'designers': set((u'guido', ))}
+        self.assertRaises(NonExistingSectionError, self.groups.reconcile,
+                          desired)
+        self.assertEqual(self.groups.get_section_items(u'admins'),
+                         set((u'rms', )))
+
+    def test_unknown_item(self):
+        desired = {u'admins': set(), u'php': set((u'gustavo', ))}
+        self.assertRaises(SourceError, self.groups.reconcile, desired)
+        self.assertEqual(self.groups.get_section_items(u'admins'),
+                         set((u'rms', )))
+
+    def test_cache_is_updated(self):
+        self.groups.get_section_items(u'developers')
+        self.groups.reconcile(self.desired)
+        self.assertEqual(self.groups.get_section_items(u'developers'),
+                         set((u'linus', u'guido')))
+
+    def test_orm_collections_are_expired(self):
+        rms = databasesetup.DBSession.query(model.User).filter_by(
+            user_name=u'rms').one()
+        developers = databasesetup.DBSession.query(model.Group).filter_by(
+            group_name=u'developers').one()
+        self.assertEqual(len(rms.groups), 2)
+        self.assertEqual(len(developers.users), 2)
+        with self.groups.batch():
+            self.groups.reconcile(self.desired)
+            self.assertEqual([g.group_name for g in rms.groups], [u'admins'])
+            self.assertEqual(set([u.user_name for u in developers.users]),
+                             set((u'linus', u'guido')))
+
+    def test_without_association_table(self):
+        self.groups.translations['sections'] = 'fake_groups'
+        changes = self.groups.reconcile(self.desired)
+        self.assertEqual(changes, self.expected_changes)
+        self._check_sections(self.groups)
+
+    def test_core_adapter(self):
+        adapter = SqlCoreGroupsAdapter(model.Group.__table__,
+                                       model.User.__table__,
+                                       model.user_group_table,
+                                       databasesetup.DBSession)
+        self.assertEqual(adapter.reconcile(self.desired),
+                         self.expected_changes)
+        self._check_sections(adapter)
+
+
+class TestCreateSections(_BaseBulkTester):
+    """Tests for the creation of many sections at once"""
+
+    new_sections = [u'designers', u'admins', u'artists', u'designers']
+
+    def _check_sections(self, adapter):
+        sections = adapter.get_all_sections()
+        self.assertEqual(sections[u'designers'], set())
+        self.assertEqual(sections[u'artists'], set())
+        self.assertEqual(sections[u'admins'], set((u'rms', )))
+
+    def test_creation(self):
+        created = self.groups.create_sections(self.new_sections)
+        self.assertEqual(created, set((u'designers', u'artists')))
+        self._check_sections(self.groups)
+
+    def test_queries(self):
+        self.groups.dbsession = databasesetup.QueryCounter(
+            databasesetup.CommitCounter(databasesetup.DBSession))
+        self.groups.create_sections(self.new_sections, chunk_size=2)
+        # Two lookups and one INSERT:
+        self.assertEqual(self.groups.dbsession.queries, 3)
+        self.assertEqual(self.groups.dbsession.commits, 1)
+
+    def test_nothing_to_create(self):
+        self.groups.dbsession = databasesetup.QueryCounter(
+            databasesetup.CommitCounter(databasesetup.DBSession))
+        self.assertEqual(self.groups.create_sections([u'admins', u'php']),
+                         set())
+        self.assertEqual(self.groups.dbsession.queries, 1)
+        self.assertEqual(self.groups.dbsession.commits, 0)
+
+    def test_cache_is_updated(self):
+        self.groups.get_all_sections()
+        self.groups.create_sections(self.new_sections)
+        assert self.groups.all_sections_loaded
+        self._check_sections(self.groups)
+
+    def test_in_batch(self):
+        with self.groups.batch():
+            self.groups.create_sections(self.new_sections)
+            self.groups.include_items(u'designers', (u'guido', ))
+        self.assertEqual(self.groups.get_section_items(u'designers'),
+                         set((u'guido', )))
+
+    def test_without_association_table(self):
+        self.groups.translations['sections'] = 'fake_groups'
+        created = self.groups.create_sections(self.new_sections)
+        self.assertEqual(created, set((u'designers', u'artists')))
+        self._check_sections(self.groups)
+
+    def test_core_adapter(self):
+        adapter = SqlCoreGroupsAdapter(model.Group.__table__,
+                                       model.User.__table__,
+                                       model.user_group_table,
+                                       databasesetup.DBSession)
+        created = adapter.create_sections(self.new_sections)
+        self.assertEqual(created, set((u'designers', u'artists')))
+        self._check_sections(adapter)
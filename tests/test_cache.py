@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Test suite for the caching utilities."""
+
+import threading
+import time
+import unittest
+
+from repoze.what.plugins.sql.cache import NegativeCache, SingleFlight, \
+                                          SingleFlightTimeout, \
+                                          RevalidatingCache
+
+
+class TestNegativeCache(unittest.TestCase):
+    """Tests for the cache of items that don't exist"""
+    
+    def test_adding_and_discarding(self):
+        cache = NegativeCache()
+        assert 'gustavo' not in cache
+        cache.add('gustavo')
+        assert 'gustavo' in cache
+        cache.discard('gustavo')
+        assert 'gustavo' not in cache
+        # Discarding unknown keys is fine:
+        cache.discard('gustavo')
+    
+    def test_entries_expire(self):
+        cache = NegativeCache(ttl=0.01)
+        cache.add('gustavo')
+        time.sleep(0.02)
+        assert 'gustavo' not in cache
+        self.assertEqual(len(cache), 0)
+    
+    def test_size_is_bounded(self):
+        cache = NegativeCache(max_size=2)
+        cache.add('a')
+        cache.add('b')
+        cache.add('c')
+        self.assertEqual(len(cache), 2)
+        assert 'a' not in cache
+        assert 'b' in cache
+        assert 'c' in cache
+    
+    def test_clearing(self):
+        cache = NegativeCache()
+        cache.add('a')
+        cache.clear()
+        assert 'a' not in cache
+
+
+class TestRevalidatingCache(unittest.TestCase):
+    """Tests for the stale-while-revalidate cache"""
+    
+    def _make_loader(self, delay=0):
+        """Return a loader which counts its calls, and the list of them"""
+        calls = []
+        def load():
+            calls.append(None)
+            time.sleep(delay)
+            return len(calls)
+        return (load, calls)
+    
+    def _wait_for_refreshes(self, cache):
+        while cache._refreshing:
+            time.sleep(0.01)
+    
+    def test_fresh_entries_are_cached(self):
+        cache = RevalidatingCache(ttl=60)
+        (load, calls) = self._make_loader()
+        self.assertEqual(cache.get('a', load, load), 1)
+        self.assertEqual(cache.get('a', load, load), 1)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(cache), 1)
+    
+    def test_expired_entries_are_served_while_refreshed(self):
+        cache = RevalidatingCache(ttl=0.01, grace=60)
+        (load, calls) = self._make_loader()
+        (refresh, refreshes) = self._make_loader(delay=0.2)
+        cache.get('a', load, refresh)
+        time.sleep(0.02)
+        started = time.time()
+        self.assertEqual(cache.get('a', load, refresh), 1)
+        # The refresh didn't hold up the lookup:
+        assert time.time() - started < 0.1
+        self._wait_for_refreshes(cache)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(refreshes), 1)
+        self.assertEqual(cache.get('a', load, refresh), 1)
+        self.assertEqual(cache._entries['a'][0], 1)
+        assert cache._entries['a'][1] > time.time()
+    
+    def test_refreshes_are_not_repeated(self):
+        cache = RevalidatingCache(ttl=0.01, grace=60)
+        (refresh, refreshes) = self._make_loader(delay=0.2)
+        cache.get('a', lambda: 'old', refresh)
+        time.sleep(0.02)
+        for i in range(5):
+            self.assertEqual(cache.get('a', None, refresh), 'old')
+        self._wait_for_refreshes(cache)
+        self.assertEqual(len(refreshes), 1)
+    
+    def test_refreshes_in_progress_are_bounded(self):
+        cache = RevalidatingCache(ttl=0.01, grace=60, max_refreshes=2)
+        (refresh, refreshes) = self._make_loader(delay=0.2)
+        for key in 'abcd':
+            cache.get(key, lambda: 'old', refresh)
+        time.sleep(0.02)
+        for key in 'abcd':
+            self.assertEqual(cache.get(key, None, refresh), 'old')
+        self.assertEqual(len(cache._refreshing), 2)
+        self._wait_for_refreshes(cache)
+        self.assertEqual(len(refreshes), 2)
+    
+    def test_entries_beyond_the_grace_period_are_loaded(self):
+        cache = RevalidatingCache(ttl=0.01, grace=0.01)
+        (load, calls) = self._make_loader()
+        (refresh, refreshes) = self._make_loader()
+        cache.get('a', load, refresh)
+        time.sleep(0.03)
+        self.assertEqual(cache.get('a', load, refresh), 2)
+        self.assertEqual(refreshes, [])
+    
+    def test_expired_entries_are_loaded_without_refresh(self):
+        cache = RevalidatingCache(ttl=0.01, grace=60)
+        (load, calls) = self._make_loader()
+        cache.get('a', load)
+        time.sleep(0.02)
+        self.assertEqual(cache.get('a', load), 2)
+    
+    def test_failed_refreshes_keep_the_entry(self):
+        cache = RevalidatingCache(ttl=0.01, grace=60)
+        def fail():
+            raise ValueError('database is down')
+        cache.get('a', lambda: 'old', fail)
+        time.sleep(0.02)
+        self.assertEqual(cache.get('a', None, fail), 'old')
+        self._wait_for_refreshes(cache)
+        self.assertEqual(cache.get('a', None, fail), 'old')
+    
+    def test_refreshes_started_before_clearing_are_dropped(self):
+        cache = RevalidatingCache(ttl=0.01, grace=60)
+        (refresh, refreshes) = self._make_loader(delay=0.2)
+        cache.get('a', lambda: 'old', refresh)
+        time.sleep(0.02)
+        cache.get('a', None, refresh)
+        cache.clear()
+        self._wait_for_refreshes(cache)
+        self.assertEqual(len(cache), 0)
+    
+    def test_size_is_bounded(self):
+        cache = RevalidatingCache(max_size=2)
+        for key in 'abc':
+            cache.get(key, lambda: key)
+        self.assertEqual(len(cache), 2)
+        assert 'a' not in cache._entries
+    
+    def test_discarding(self):
+        cache = RevalidatingCache()
+        cache.get('a', lambda: 1)
+        cache.discard('a')
+        cache.discard('b')
+        self.assertEqual(cache.get('a', lambda: 2), 2)
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Tests for the coalescing of concurrent identical calls"""
+    
+    def _run_threads(self, flight, function, threads=30, key='key'):
+        """Call ``function`` through ``flight`` from many threads at once"""
+        outcomes = []
+        start = threading.Event()
+        def run():
+            start.wait()
+            try:
+                outcomes.append(('result', flight.do(key, function)))
+            except Exception as exc:
+                outcomes.append(('error', exc))
+        workers = [threading.Thread(target=run) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        start.set()
+        for worker in workers:
+            worker.join()
+        return outcomes
+    
+    def test_concurrent_calls_are_coalesced(self):
+        calls = []
+        def slow_lookup():
+            calls.append(None)
+            time.sleep(0.3)
+            return set(['admins'])
+        outcomes = self._run_threads(SingleFlight(), slow_lookup)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(outcomes, [('result', set(['admins']))] * 30)
+    
+    def test_errors_are_propagated_to_all_waiters(self):
+        error = ValueError('database is down')
+        def failing_lookup():
+            time.sleep(0.3)
+            raise error
+        outcomes = self._run_threads(SingleFlight(), failing_lookup)
+        self.assertEqual(outcomes, [('error', error)] * 30)
+    
+    def test_waiters_time_out(self):
+        def slow_lookup():
+            time.sleep(0.5)
+            return 'result'
+        outcomes = self._run_threads(SingleFlight(timeout=0.05), slow_lookup,
+                                     threads=5)
+        kinds = sorted([outcome[0] for outcome in outcomes])
+        self.assertEqual(kinds, ['error'] * 4 + ['result'])
+        for (kind, value) in outcomes:
+            if kind == 'error':
+                assert isinstance(value, SingleFlightTimeout)
+    
+    def test_sequential_calls_are_not_coalesced(self):
+        flight = SingleFlight()
+        calls = []
+        def lookup():
+            calls.append(None)
+            return len(calls)
+        self.assertEqual(flight.do('key', lookup), 1)
+        self.assertEqual(flight.do('key', lookup), 2)
+    
+    def test_different_keys_are_not_coalesced(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do('a', lambda: 'a'), 'a')
+        self.assertEqual(flight.do('b', lambda: 'b'), 'b')
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Test suite for the change log of the SQL adapters."""
+
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from sqlalchemy import MetaData
+
+from repoze.what.plugins.sql import configure_sql_adapters, \
+                                    SqlCorePermissionsAdapter
+from repoze.what.plugins.sql.bulk import import_sections
+from repoze.what.plugins.sql.changelog import ChangeLog, Change, \
+                                              make_changelog_table
+from repoze.what.plugins.sql.tenancy import current_tenant
+
+import databasesetup
+import databasesetup_tenants
+from fixture import model, model_tenants
+
+
+class TestChangeLog(unittest.TestCase):
+    """Tests for the change log"""
+
+    def setUp(self):
+        databasesetup.setup_database()
+        self.metadata = MetaData()
+        self.changelog = ChangeLog(make_changelog_table(self.metadata))
+        self.metadata.create_all(databasesetup.engine)
+        self.dbsession = databasesetup.DBSession
+        adapters = configure_sql_adapters(
+            databasesetup.User, databasesetup.Group, databasesetup.Permission,
+            self.dbsession, changelog=self.changelog)
+        self.groups = adapters['group']
+        self.permissions = adapters['permission']
+
+    def tearDown(self):
+        self.dbsession.rollback()
+        self.metadata.drop_all(databasesetup.engine)
+        databasesetup.teardownDatabase()
+
+    def _get_changes(self, mark=0):
+        return [tuple(change)[1:5] for change in
+                self.changelog.changes_since(self.dbsession, mark)]
+
+    def test_empty_log(self):
+        self.assertEqual(self.changelog.latest_mark(self.dbsession), 0)
+        self.assertEqual(self.changelog.changes_since(self.dbsession), [])
+
+    def test_write_operations_are_recorded(self):
+        self.groups.create_section(u'designers')
+        self.groups.include_items(u'designers', (u'guido', ))
+        self.groups.exclude_items(u'designers', (u'guido', ))
+        self.groups.edit_section(u'designers', u'artists')
+        self.permissions.delete_section(u'commit')
+        self.assertEqual(self._get_changes(), [
+            (u'group', u'create', u'designers', None),
+            (u'group', u'include', u'designers', u'guido'),
+            (u'group', u'exclude', u'designers', u'guido'),
+            (u'group', u'edit', u'designers', u'artists'),
+            (u'permission', u'delete', u'commit', None),
+            ])
+        # The adapters are not shared by many tenants:
+        for change in self.changelog.changes_since(self.dbsession):
+            self.assertEqual(change.tenant, None)
+
+    def test_changes_since_mark(self):
+        self.groups.create_section(u'designers')
+        mark = self.changelog.latest_mark(self.dbsession)
+        self.groups.include_items(u'designers', (u'guido', u'rasmus'))
+        changes = self.changelog.changes_since(self.dbsession, mark)
+        self.assertEqual(len(changes), 2)
+        assert isinstance(changes[0], Change)
+        self.assertEqual(changes[0].mark, mark + 1)
+        self.assertEqual(set([change.item for change in changes]),
+                         set((u'guido', u'rasmus')))
+        self.assertEqual(self.changelog.latest_mark(self.dbsession),
+                         changes[-1].mark)
+        self.assertEqual(len(self.changelog.changes_since(self.dbsession,
+                                                          limit=2)), 2)
+
+    def test_rolled_back_changes_are_not_recorded(self):
+        try:
+            with self.groups.batch():
+                self.groups.create_section(u'designers')
+                self.groups.include_items(u'designers', (u'gustavo', ))
+        except Exception:
+            pass
+        self.dbsession.rollback()
+        self.assertEqual(self._get_changes(), [])
+
+    def test_core_adapters(self):
+        adapter = SqlCorePermissionsAdapter(model.Permission.__table__,
+                                            model.Group.__table__,
+                                            model.group_permission_table,
+                                            self.dbsession)
+        adapter.changelog = self.changelog
+        adapter.include_items(u'commit', (u'trolls', ))
+        adapter.delete_section(u'see-site')
+        self.assertEqual(self._get_changes(), [
+            (u'permission', u'include', u'commit', u'trolls'),
+            (u'permission', u'delete', u'see-site', None),
+            ])
+
+    def test_bulk_import(self):
+        stream = StringIO('{"section": "designers", "item": "guido"}\n'
+                          '{"section": "admins", "item": "rms"}\n')
+        import_sections(self.groups, stream)
+        self.assertEqual(self._get_changes(), [
+            (u'group', u'create', u'designers', None),
+            (u'group', u'include', u'designers', u'guido'),
+            ])
+
+    def test_reconcile(self):
+        self.groups.reconcile({u'developers': set((u'linus', u'guido'))})
+        self.assertEqual(self._get_changes(), [
+            (u'group', u'exclude', u'developers', u'rms'),
+            (u'group', u'include', u'developers', u'guido'),
+            ])
+
+    def test_prune(self):
+        self.groups.create_section(u'designers')
+        self.groups.create_section(u'artists')
+        self.changelog.prune(self.dbsession, 1)
+        self.assertEqual(self._get_changes(), [
+            (u'group', u'create', u'artists', None)])
+
+
+class TestChangeLogWithTenants(unittest.TestCase):
+    """Tests for the change log of the adapters shared by many tenants"""
+
+    def setUp(self):
+        databasesetup_tenants.setup_database()
+        self.metadata = MetaData()
+        self.changelog = ChangeLog(make_changelog_table(self.metadata))
+        self.metadata.create_all(databasesetup_tenants.engine)
+        self.dbsession = model_tenants.DBSession
+        adapters = configure_sql_adapters(
+            model_tenants.User, model_tenants.Group, model_tenants.Permission,
+            self.dbsession, tenant_attribute='tenant_id',
+            changelog=self.changelog)
+        self.groups = adapters['group']
+
+    def tearDown(self):
+        self.dbsession.remove()
+        self.metadata.drop_all(databasesetup_tenants.engine)
+        databasesetup_tenants.teardownDatabase()
+
+    def test_tenants_are_recorded(self):
+        for tenant in (u'acme', u'globex'):
+            with current_tenant(tenant):
+                self.groups.create_section(u'designers')
+        changes = self.changelog.changes_since(self.dbsession)
+        self.assertEqual([(change.section, change.tenant)
+                          for change in changes],
+                         [(u'designers', u'acme'), (u'designers', u'globex')])
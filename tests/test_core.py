@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Test suite for the SQLAlchemy Core-based adapters."""
+
+import unittest
+
+from sqlalchemy import Table, Column, Integer, MetaData
+
+from repoze.what.adapters import SourceError
+from repoze.what.adapters.testutil import GroupsAdapterTester, \
+                                          PermissionsAdapterTester
+
+from repoze.what.plugins.sql import SqlCoreGroupsAdapter, \
+                                    SqlCorePermissionsAdapter
+
+import databasesetup
+import databasesetup_translations
+from fixture import model, model_translations
+
+
+class _BaseSqlCoreAdapterTester(unittest.TestCase):
+    """Base class for the test suite of the SQL Core source adapters"""
+    
+    def tearDown(self):
+        databasesetup.teardownDatabase()
+
+
+class TestSqlCoreGroupsAdapter(GroupsAdapterTester, _BaseSqlCoreAdapterTester):
+    """Test suite for the SQL Core group source adapter"""
+    
+    def setUp(self):
+        super(TestSqlCoreGroupsAdapter, self).setUp()
+        databasesetup.setup_database()
+        self.adapter = SqlCoreGroupsAdapter(model.Group.__table__,
+                                            model.User.__table__,
+                                            model.user_group_table,
+                                            databasesetup.DBSession)
+        self.all_sections['nogroup'] = set()
+        # GroupsAdapterTester pops items from its class-level set otherwise:
+        self.new_items = set((u'guido', u'rasmus'))
+    
+    def test_including_items_twice(self):
+        self.adapter._include_items(u'admins', (u'rms', u'guido'))
+        self.assertEqual(self.adapter._get_section_items(u'admins'),
+                         set((u'rms', u'guido')))
+        query = model.user_group_table.select()
+        self.assertEqual(len(databasesetup.DBSession.execute(query).fetchall()),
+                         5)
+    
+    def test_including_non_existing_items(self):
+        self.assertRaises(SourceError, self.adapter._include_items, u'admins',
+                          (u'guido', u'gustavo'))
+    
+    def test_getting_items_of_non_existing_section(self):
+        self.assertRaises(SourceError, self.adapter._get_section_items,
+                          u'designers')
+    
+    def test_deleting_section_with_items(self):
+        self.adapter._delete_section(u'developers')
+        self.assertEqual(self.adapter._find_sections({'repoze.what.userid':
+                                                      u'rms'}),
+                         set((u'admins', )))
+
+
+class TestSqlCorePermissionsAdapter(PermissionsAdapterTester,
+                                    _BaseSqlCoreAdapterTester):
+    """Test suite for the SQL Core permission source adapter"""
+    
+    def setUp(self):
+        super(TestSqlCorePermissionsAdapter, self).setUp()
+        databasesetup.setup_database()
+        self.adapter = SqlCorePermissionsAdapter(model.Permission.__table__,
+                                                 model.Group.__table__,
+                                                 model.group_permission_table,
+                                                 databasesetup.DBSession)
+        self.all_sections['nopermission'] = set()
+        self.new_items = set((u'python', u'php'))
+
+
+class TestSqlCoreGroupsAdapterWithTranslations(GroupsAdapterTester,
+                                               _BaseSqlCoreAdapterTester):
+    """Test suite for the SQL Core group source adapter with translations"""
+    
+    def setUp(self):
+        super(TestSqlCoreGroupsAdapterWithTranslations, self).setUp()
+        databasesetup_translations.setup_database()
+        self.adapter = SqlCoreGroupsAdapter(
+            model_translations.Team.__table__,
+            model_translations.Member.__table__,
+            model_translations.user_group_table,
+            databasesetup_translations.DBSession)
+        self.adapter.translations.update({'item_name': 'member_name',
+                                          'section_name': 'team_name'})
+        self.new_items = set((u'guido', u'rasmus'))
+
+
+class TestSqlCorePermissionsAdapterWithTranslations(PermissionsAdapterTester,
+                                                    _BaseSqlCoreAdapterTester):
+    """Test suite for the SQL Core permission source adapter with translations"""
+    
+    def setUp(self):
+        super(TestSqlCorePermissionsAdapterWithTranslations, self).setUp()
+        databasesetup_translations.setup_database()
+        self.adapter = SqlCorePermissionsAdapter(
+            model_translations.Right.__table__,
+            model_translations.Team.__table__,
+            model_translations.group_permission_table,
+            databasesetup_translations.DBSession)
+        self.adapter.translations.update({'item_name': 'team_name',
+                                          'section_name': 'right_name'})
+        self.new_items = set((u'python', u'php'))
+
+
+class TestForeignKeys(unittest.TestCase):
+    """Tests for the detection of the keys in the association table"""
+    
+    def test_association_without_foreign_key(self):
+        association = Table('unrelated', MetaData(),
+                            Column('group_id', Integer),
+                            Column('user_id', Integer))
+        adapter = SqlCoreGroupsAdapter(model.Group.__table__,
+                                       model.User.__table__, association,
+                                       databasesetup.DBSession)
+        self.assertRaises(SourceError, adapter._get_tables)
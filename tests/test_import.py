@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Regression tests for the import-time cost of the SQL plugin."""
+
+import subprocess
+import sys
+import unittest
+
+
+_SCRIPT = """
+import sys
+from repoze.what.plugins.sql import SqlGroupsAdapter, SqlPermissionsAdapter, \\
+                                    configure_sql_adapters
+loaded = [m for m in sys.modules if m == 'sqlalchemy' or
+          m.startswith('sqlalchemy.')]
+sys.stdout.write(','.join(sorted(loaded)))
+"""
+
+
+class TestLazyImport(unittest.TestCase):
+    """SQLAlchemy must not be imported until the adapters hit the database"""
+    
+    def test_sqlalchemy_is_not_imported_by_the_package(self):
+        process = subprocess.Popen([sys.executable, '-c', _SCRIPT],
+                                   stdout=subprocess.PIPE)
+        output = process.communicate()[0].decode('ascii')
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(output, '', 'SQLAlchemy modules loaded: %s' % output)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Test suite for the indexes needed by the SQL adapters."""
+
+import unittest
+import warnings
+
+from repoze.what.plugins.sql import configure_sql_adapters, \
+                                    SqlCoreGroupsAdapter, \
+                                    SqlCorePermissionsAdapter
+from repoze.what.plugins.sql.indexes import RecommendedIndex, \
+                                            MissingIndexWarning, \
+                                            recommend_indexes, \
+                                            find_missing_indexes, \
+                                            get_index_ddl
+
+import databasesetup
+from fixture import model
+
+
+class _BaseIndexesTester(unittest.TestCase):
+    """Base test case for the index utilities"""
+
+    def setUp(self):
+        databasesetup.setup_database()
+        self.adapters = configure_sql_adapters(
+            databasesetup.User, databasesetup.Group, databasesetup.Permission,
+            databasesetup.DBSession)
+
+    def tearDown(self):
+        databasesetup.teardownDatabase()
+
+    def _get_names(self, indexes):
+        return [(index.table.name, index.columns, index.unique)
+                for index in indexes]
+
+    def _get_missing_index_warnings(self, caught):
+        return [warning for warning in caught
+                if issubclass(warning.category, MissingIndexWarning)]
+
+
+class TestRecommendedIndexes(_BaseIndexesTester):
+    """Tests for recommend_indexes()"""
+
+    association_indexes = [
+        ('tg_user_group', ('group_id', 'user_id'), False),
+        ('tg_user_group', ('user_id', 'group_id'), False),
+        ('tg_group_permission', ('permission_id', 'group_id'), False),
+        ('tg_group_permission', ('group_id', 'permission_id'), False),
+        ]
+
+    def test_recommendations(self):
+        self.assertEqual(
+            sorted(self._get_names(recommend_indexes(self.adapters))),
+            sorted(self.association_indexes + [
+                ('tg_group', ('group_name', ), True),
+                ('tg_user', ('user_name', ), True),
+                ('tg_permission', ('permission_name', ), True),
+                ]))
+
+    def test_core_adapters(self):
+        adapters = {
+            'group': SqlCoreGroupsAdapter(model.Group.__table__,
+                                          model.User.__table__,
+                                          model.user_group_table,
+                                          databasesetup.DBSession),
+            'permission': SqlCorePermissionsAdapter(
+                model.Permission.__table__, model.Group.__table__,
+                model.group_permission_table, databasesetup.DBSession),
+            }
+        self.assertEqual(
+            sorted(self._get_names(recommend_indexes(adapters))),
+            sorted(self._get_names(recommend_indexes(self.adapters))))
+
+    def test_computed_sections(self):
+        self.adapters['group'].translations['sections'] = 'fake_groups'
+        self.assertEqual(len(recommend_indexes(self.adapters)), 4)
+
+    def test_satisfied_indexes(self):
+        index = RecommendedIndex(model.user_group_table,
+                                 ('user_id', 'group_id'), False)
+        assert index.is_satisfied_by(('user_id', 'group_id'), False)
+        assert index.is_satisfied_by(['user_id', 'group_id', 'extra'], True)
+        assert not index.is_satisfied_by(('group_id', 'user_id'), False)
+        assert not index.is_satisfied_by(('user_id', ), True)
+        index = RecommendedIndex(model.Group.__table__, ('group_name', ),
+                                 True)
+        assert index.is_satisfied_by(('group_name', ), True)
+        assert not index.is_satisfied_by(('group_name', ), False)
+        assert not index.is_satisfied_by(('group_name', 'group_id'), True)
+
+
+class TestMissingIndexes(_BaseIndexesTester):
+    """Tests for find_missing_indexes() and get_index_ddl()"""
+
+    def test_missing_indexes(self):
+        missing = find_missing_indexes(self.adapters)
+        self.assertEqual(sorted(self._get_names(missing)),
+                         sorted(TestRecommendedIndexes.association_indexes))
+
+    def test_ddl(self):
+        missing = find_missing_indexes(self.adapters)
+        ddl = get_index_ddl(missing, databasesetup.engine.dialect)
+        self.assertEqual(ddl[0], 'CREATE INDEX %s ON %s (%s)' % (
+            missing[0].name, missing[0].table.name,
+            ', '.join(missing[0].columns)))
+        for statement in ddl:
+            databasesetup.engine.execute(statement)
+        self.assertEqual(find_missing_indexes(self.adapters), [])
+        # The metadata is left untouched:
+        self.assertEqual(model.user_group_table.indexes, set())
+
+    def test_unique_ddl(self):
+        index = RecommendedIndex(model.Group.__table__, ('group_name', ),
+                                 True)
+        self.assertEqual(get_index_ddl([index], databasesetup.engine.dialect),
+                         ['CREATE UNIQUE INDEX ix_tg_group_group_name ON '
+                          'tg_group (group_name)'])
+
+    def test_wider_indexes_are_used(self):
+        databasesetup.engine.execute('CREATE INDEX custom ON tg_user_group '
+                                     '(user_id, group_id)')
+        missing = find_missing_indexes(self.adapters)
+        self.assertEqual(len(missing), 3)
+        assert ('tg_user_group', ('user_id', 'group_id'), False) not in \
+               self._get_names(missing)
+
+    def test_configure_time_check(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            configure_sql_adapters(
+                databasesetup.User, databasesetup.Group,
+                databasesetup.Permission, databasesetup.DBSession)
+            self.assertEqual(self._get_missing_index_warnings(caught), [])
+            configure_sql_adapters(
+                databasesetup.User, databasesetup.Group,
+                databasesetup.Permission, databasesetup.DBSession,
+                check_indexes=True)
+        # Other warnings (e.g., SQLAlchemy's) are ignored:
+        caught = self._get_missing_index_warnings(caught)
+        self.assertEqual(len(caught), 4)
+        assert 'tg_user_group' in str(caught[0].message)
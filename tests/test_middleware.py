@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Test suite for the WSGI middleware of the SQL plugin."""
+
+import unittest
+
+from repoze.what.plugins.sql import configure_sql_adapters, \
+                                    SqlCorePermissionsAdapter
+from repoze.what.plugins.sql.cache import get_request_memo
+from repoze.what.plugins.sql.middleware import AdapterMemoMiddleware
+
+import databasesetup
+from fixture import model
+
+
+class _RequestRecorder(object):
+    """WSGI application which runs ``function`` and records what happened"""
+    
+    def __init__(self, function):
+        self.function = function
+        self.results = []
+    
+    def __call__(self, environ, start_response):
+        self.environ = environ
+        self.memo = get_request_memo()
+        self.results.append(self.function())
+        start_response('200 OK', [])
+        return ['']
+
+
+class TestAdapterMemoMiddleware(unittest.TestCase):
+    """Tests for the request-scoped memoization of the adapters"""
+    
+    def setUp(self):
+        databasesetup.setup_database()
+        self.dbsession = databasesetup.QueryCounter(databasesetup.DBSession)
+        adapters = configure_sql_adapters(
+            databasesetup.User, databasesetup.Group, databasesetup.Permission,
+            self.dbsession)
+        self.groups = adapters['group']
+        self.permissions = adapters['permission']
+    
+    def tearDown(self):
+        databasesetup.teardownDatabase()
+    
+    def _call(self, function):
+        app = _RequestRecorder(function)
+        AdapterMemoMiddleware(app)({}, lambda status, headers: None)
+        return app
+    
+    def test_memo_lives_during_the_request(self):
+        app = self._call(lambda: None)
+        assert app.memo == {}
+        assert AdapterMemoMiddleware.environ_key not in app.environ
+        self.assertEqual(get_request_memo(), None)
+    
+    def test_repeated_lookups_are_memoized(self):
+        def find_permissions():
+            for i in range(3):
+                permissions = self.permissions.find_sections(u'developers')
+                assert self.permissions._item_is_included(u'commit',
+                                                          u'developers')
+            return permissions
+        app = self._call(find_permissions)
+        self.assertEqual(app.results, [set((u'commit', u'edit-site'))])
+        self.assertEqual(self.dbsession.queries, 2)
+    
+    def test_memoized_sets_are_copied(self):
+        def find_groups():
+            credentials = {'repoze.what.userid': u'rms'}
+            self.groups.find_sections(credentials).clear()
+            return self.groups.find_sections(credentials)
+        app = self._call(find_groups)
+        self.assertEqual(app.results, [set((u'admins', u'developers'))])
+    
+    def test_memo_is_discarded_between_requests(self):
+        function = lambda: self.permissions.find_sections(u'trolls')
+        self._call(function)
+        self._call(function)
+        self.assertEqual(self.dbsession.queries, 2)
+    
+    def test_writes_discard_the_memo(self):
+        def change_permissions():
+            before = self.permissions.find_sections(u'trolls')
+            self.permissions.include_items(u'commit', (u'trolls', ))
+            return before, self.permissions.find_sections(u'trolls')
+        app = self._call(change_permissions)
+        self.assertEqual(app.results, [(set((u'see-site', )),
+                                        set((u'see-site', u'commit')))])
+    
+    def test_core_adapters(self):
+        adapter = SqlCorePermissionsAdapter(model.Permission.__table__,
+                                            model.Group.__table__,
+                                            model.group_permission_table,
+                                            self.dbsession)
+        def find_permissions():
+            for i in range(3):
+                permissions = adapter.find_sections(u'developers')
+            return permissions
+        app = self._call(find_permissions)
+        self.assertEqual(app.results, [set((u'commit', u'edit-site'))])
+        self.assertEqual(self.dbsession.queries, 1)
+    
+    def test_no_memoization_outside_requests(self):
+        self.permissions.find_sections(u'trolls')
+        self.permissions.find_sections(u'trolls')
+        self.assertEqual(self.dbsession.queries, 2)
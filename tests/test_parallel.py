@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Test suite for the concurrent use of the SQL adapters."""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from sqlalchemy import create_engine
+
+from repoze.what.plugins.sql import configure_sql_adapters
+from repoze.what.plugins.sql.cache import get_request_memo, set_request_memo
+from repoze.what.plugins.sql.parallel import WorkerPool, find_permissions
+from repoze.what.plugins.sql.tenancy import current_tenant, \
+                                            get_current_tenant
+
+import databasesetup
+import databasesetup_tenants
+from fixture import model_tenants
+
+
+class TestWorkerPool(unittest.TestCase):
+    """Tests for the pool of threads"""
+
+    def setUp(self):
+        self.pool = WorkerPool(3)
+
+    def test_results_are_in_order(self):
+        self.assertEqual(self.pool.map(lambda n: n * 2, range(10)),
+                         [n * 2 for n in range(10)])
+        self.assertEqual(len(self.pool._threads), 3)
+
+    def test_calls_run_in_the_pool(self):
+        threads = self.pool.map(lambda n: threading.currentThread(), range(6))
+        assert threading.currentThread() not in threads
+        assert set(threads) <= set(self.pool._threads)
+
+    def test_no_arguments(self):
+        self.assertEqual(self.pool.map(lambda n: n, []), [])
+
+    def test_errors_are_raised(self):
+        def fail_on_odd_numbers(n):
+            if n % 2:
+                raise ZeroDivisionError(n)
+            return n
+        self.assertRaises(ZeroDivisionError, self.pool.map,
+                          fail_on_odd_numbers, range(4))
+        # The pool is still usable:
+        self.assertEqual(self.pool.map(fail_on_odd_numbers, [0, 2]), [0, 2])
+
+    def test_request_memo_is_shared(self):
+        memo = {}
+        previous_memo = set_request_memo(memo)
+        try:
+            memos = self.pool.map(lambda n: get_request_memo(), range(3))
+        finally:
+            set_request_memo(previous_memo)
+        assert all(m is memo for m in memos)
+        self.assertEqual(self.pool.map(lambda n: get_request_memo(), [1]),
+                         [None])
+
+    def test_tenant_is_shared(self):
+        with current_tenant(u'acme'):
+            tenants = self.pool.map(lambda n: get_current_tenant(), range(3))
+        self.assertEqual(tenants, [u'acme'] * 3)
+        self.assertEqual(self.pool.map(lambda n: get_current_tenant(), [1]),
+                         [None])
+
+
+class TestFindPermissions(unittest.TestCase):
+    """Tests for the concurrent look up of permissions"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dbsession = databasesetup.setup_file_database(
+            os.path.join(self.directory, 'acl.db'))
+        adapters = configure_sql_adapters(
+            databasesetup.User, databasesetup.Group, databasesetup.Permission,
+            self.dbsession)
+        self.groups = adapters['group']
+        self.permissions = adapters['permission']
+        self.pool = WorkerPool(2)
+
+    def tearDown(self):
+        self.dbsession.remove()
+        shutil.rmtree(self.directory)
+
+    def test_permissions_of_many_groups(self):
+        groups = (u'admins', u'developers', u'trolls', u'php')
+        self.assertEqual(find_permissions(self.permissions, groups, self.pool),
+                         set((u'edit-site', u'commit', u'see-site')))
+
+    def test_batch_size(self):
+        groups = (u'admins', u'developers', u'trolls')
+        permissions = find_permissions(self.permissions, groups, self.pool,
+                                       batch_size=1)
+        self.assertEqual(permissions,
+                         set((u'edit-site', u'commit', u'see-site')))
+
+    def test_permissions_of_user(self):
+        groups = self.groups.find_sections({'repoze.what.userid': u'rms'})
+        self.assertEqual(find_permissions(self.permissions, groups, self.pool),
+                         set((u'edit-site', u'commit')))
+
+    def test_no_groups(self):
+        self.assertEqual(find_permissions(self.permissions, (), self.pool),
+                         set())
+
+    def test_sessions_are_removed(self):
+        sessions = []
+        find_sections = self.permissions.find_sections
+        def record_session(group):
+            sessions.append(self.dbsession())
+            return find_sections(group)
+        self.permissions.find_sections = record_session
+        find_permissions(self.permissions, (u'admins', u'trolls'), self.pool,
+                         batch_size=1)
+        self.assertEqual(len(sessions), 2)
+        for session in sessions:
+            assert session is not self.dbsession()
+            self.assertEqual(len(session.identity_map), 0)
+
+    def test_plain_sessions_are_rejected(self):
+        self.permissions.dbsession = self.dbsession()
+        self.assertRaises(ValueError, find_permissions, self.permissions,
+                          (u'admins', ), self.pool)
+
+    def test_tenants(self):
+        engine = create_engine('sqlite:///%s' %
+                               os.path.join(self.directory, 'tenants.db'))
+        # Binding the session to this engine, even if other tests used it:
+        model_tenants.DBSession.remove()
+        databasesetup_tenants.setup_database(engine)
+        try:
+            permissions = configure_sql_adapters(
+                model_tenants.User, model_tenants.Group,
+                model_tenants.Permission, model_tenants.DBSession,
+                tenant_attribute='tenant_id')['permission']
+            groups = (u'admins', u'developers', u'trolls')
+            with current_tenant(u'acme'):
+                self.assertEqual(
+                    find_permissions(permissions, groups, self.pool),
+                    set((u'edit-site', u'commit')))
+            with current_tenant(u'globex'):
+                self.assertEqual(
+                    find_permissions(permissions, groups, self.pool),
+                    set((u'edit-site', u'see-site')))
+        finally:
+            databasesetup_tenants.teardownDatabase(engine)
+            model_tenants.DBSession.remove()
+            engine.dispose()
+
+
+class TestBatchesPerThread(unittest.TestCase):
+    """Tests for the thread-safety of the batches"""
+
+    def setUp(self):
+        databasesetup.setup_database()
+        adapters = configure_sql_adapters(
+            databasesetup.User, databasesetup.Group, databasesetup.Permission,
+            databasesetup.DBSession)
+        self.groups = adapters['group']
+
+    def tearDown(self):
+        databasesetup.teardownDatabase()
+
+    def test_batch_is_not_seen_by_other_threads(self):
+        in_batch = []
+        with self.groups.batch():
+            assert self.groups._in_batch
+            thread = threading.Thread(
+                target=lambda: in_batch.append(self.groups._in_batch))
+            thread.start()
+            thread.join()
+        self.assertEqual(in_batch, [False])
+        assert not self.groups._in_batch
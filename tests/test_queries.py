@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Test suite for the direct queries on the SQL adapters."""
+
+import unittest
+
+from sqlalchemy.sql import literal_column
+
+from repoze.what.plugins.sql import configure_sql_adapters, \
+                                    SqlGroupsAdapter, SqlPermissionsAdapter, \
+                                    SqlCoreGroupsAdapter, \
+                                    SqlCorePermissionsAdapter
+from repoze.what.plugins.sql.cache import set_request_memo
+from repoze.what.plugins.sql.queries import has_permission, \
+                                            check_permissions, \
+                                            check_memberships, \
+                                            get_permission_users, \
+                                            iter_permission_users
+
+import databasesetup, databasesetup_translations
+from fixture import model
+from fixture.model_translations import Member, Team, Right
+
+
+class _BaseQueriesTester(unittest.TestCase):
+    """Base test case for the direct queries"""
+
+    def setUp(self):
+        databasesetup.setup_database()
+        self.dbsession = databasesetup.QueryCounter(databasesetup.DBSession)
+        adapters = configure_sql_adapters(
+            databasesetup.User, databasesetup.Group, databasesetup.Permission,
+            self.dbsession)
+        self.groups = adapters['group']
+        self.permissions = adapters['permission']
+
+    def tearDown(self):
+        set_request_memo(None)
+        databasesetup.teardownDatabase()
+
+
+class TestHasPermission(_BaseQueriesTester):
+    """Tests for has_permission()"""
+
+    def _check(self):
+        assert has_permission(self.groups, self.permissions, u'rms',
+                              u'edit-site')
+        assert has_permission(self.groups, self.permissions, u'rms',
+                              u'commit')
+        assert has_permission(self.groups, self.permissions, u'sballmer',
+                              u'see-site')
+        assert not has_permission(self.groups, self.permissions, u'rms',
+                                  u'see-site')
+        assert not has_permission(self.groups, self.permissions, u'guido',
+                                  u'see-site')
+        assert not has_permission(self.groups, self.permissions, u'gustavo',
+                                  u'see-site')
+        assert not has_permission(self.groups, self.permissions, u'rms',
+                                  u'fly')
+
+    def test_orm_adapters(self):
+        self._check()
+
+    def test_single_query(self):
+        has_permission(self.groups, self.permissions, u'rms', u'commit')
+        self.assertEqual(self.dbsession.queries, 1)
+
+    def test_memoized_in_request(self):
+        set_request_memo({})
+        has_permission(self.groups, self.permissions, u'rms', u'commit')
+        has_permission(self.groups, self.permissions, u'rms', u'commit')
+        self.assertEqual(self.dbsession.queries, 1)
+        self.permissions.exclude_items(u'commit', (u'developers', ))
+        assert not has_permission(self.groups, self.permissions, u'rms',
+                                  u'commit')
+
+    def test_core_adapters(self):
+        self.groups = SqlCoreGroupsAdapter(model.Group.__table__,
+                                           model.User.__table__,
+                                           model.user_group_table,
+                                           self.dbsession)
+        self.permissions = SqlCorePermissionsAdapter(
+            model.Permission.__table__, model.Group.__table__,
+            model.group_permission_table, self.dbsession)
+        self._check()
+        self.assertEqual(self.dbsession.queries, 7)
+
+    def test_different_keys(self):
+        """The groups table is joined if it's referred to by other keys"""
+        tables = self.permissions._get_tables()
+        tables.item_key = literal_column('tg_group.group_id')
+        self.permissions._get_tables = lambda: tables
+        self._check()
+
+    def test_computed_groups(self):
+        self.groups.translations['sections'] = 'fake_groups'
+        self.permissions.include_items(u'see-site', (u'nogroup', ))
+        assert has_permission(self.groups, self.permissions, u'rms',
+                              u'see-site')
+        assert not has_permission(self.groups, self.permissions, u'rms',
+                                  u'commit')
+
+    def test_computed_permissions(self):
+        self.permissions.translations['sections'] = 'fake_permissions'
+        assert has_permission(self.groups, self.permissions, u'rms',
+                              u'nopermission')
+        assert not has_permission(self.groups, self.permissions, u'rms',
+                                  u'commit')
+        assert not has_permission(self.groups, self.permissions, u'guido',
+                                  u'nopermission')
+
+    def test_translations(self):
+        databasesetup_translations.setup_database()
+        try:
+            self.groups = SqlGroupsAdapter(Team, Member,
+                                           databasesetup_translations.DBSession)
+            self.groups.translations.update({
+                'item_name': 'member_name',
+                'items': 'members',
+                'section_name': 'team_name',
+                'sections': 'teams'})
+            self.permissions = SqlPermissionsAdapter(
+                Right, Team, databasesetup_translations.DBSession)
+            self.permissions.translations.update({
+                'item_name': 'team_name',
+                'items': 'teams',
+                'section_name': 'right_name',
+                'sections': 'rights'})
+            self._check()
+        finally:
+            databasesetup_translations.teardownDatabase()
+
+
+class TestBatchChecks(_BaseQueriesTester):
+    """Tests for check_permissions() and check_memberships()"""
+
+    permission_pairs = [
+        (u'rms', u'commit'),
+        (u'rms', u'see-site'),
+        (u'sballmer', u'see-site'),
+        (u'gustavo', u'commit'),
+        (u'linus', u'edit-site'),
+        (u'rms', u'commit'),
+        (u'guido', u'edit-site'),
+        ]
+    membership_pairs = [
+        (u'rms', u'admins'),
+        (u'linus', u'admins'),
+        (u'linus', u'developers'),
+        (u'gustavo', u'trolls'),
+        (u'sballmer', u'trolls'),
+        ]
+
+    def test_permissions(self):
+        self.assertEqual(
+            check_permissions(self.groups, self.permissions,
+                              self.permission_pairs),
+            [True, False, True, False, True, True, False])
+        self.assertEqual(self.dbsession.queries, 1)
+
+    def test_memberships(self):
+        self.assertEqual(
+            check_memberships(self.groups, self.membership_pairs),
+            [True, False, True, False, True])
+        self.assertEqual(self.dbsession.queries, 1)
+
+    def test_no_pairs(self):
+        self.assertEqual(check_permissions(self.groups, self.permissions, []),
+                         [])
+        self.assertEqual(check_memberships(self.groups, iter([])), [])
+        self.assertEqual(self.dbsession.queries, 0)
+
+    def test_chunks(self):
+        self.assertEqual(
+            check_permissions(self.groups, self.permissions,
+                              self.permission_pairs, chunk_size=2),
+            [True, False, True, False, True, True, False])
+        # There are 6 distinct pairs:
+        self.assertEqual(self.dbsession.queries, 3)
+        self.assertEqual(
+            check_memberships(self.groups, self.membership_pairs,
+                              chunk_size=4),
+            [True, False, True, False, True])
+        self.assertEqual(self.dbsession.queries, 5)
+
+    def test_core_adapters(self):
+        groups = SqlCoreGroupsAdapter(model.Group.__table__,
+                                      model.User.__table__,
+                                      model.user_group_table, self.dbsession)
+        permissions = SqlCorePermissionsAdapter(
+            model.Permission.__table__, model.Group.__table__,
+            model.group_permission_table, self.dbsession)
+        self.assertEqual(
+            check_permissions(groups, permissions, self.permission_pairs),
+            [True, False, True, False, True, True, False])
+        self.assertEqual(
+            check_memberships(groups, self.membership_pairs),
+            [True, False, True, False, True])
+        self.assertEqual(self.dbsession.queries, 2)
+
+    def test_computed_sections(self):
+        self.groups.translations['sections'] = 'fake_groups'
+        self.permissions.include_items(u'see-site', (u'nogroup', ))
+        self.assertEqual(
+            check_permissions(self.groups, self.permissions,
+                              self.permission_pairs),
+            [False, True, True, False, False, False, False])
+        self.assertEqual(
+            check_memberships(self.groups, [(u'rms', u'nogroup'),
+                                            (u'rms', u'admins')]),
+            [True, False])
+
+
+class TestPermissionUsers(_BaseQueriesTester):
+    """Tests for get_permission_users() and iter_permission_users()"""
+
+    def setUp(self):
+        super(TestPermissionUsers, self).setUp()
+        self.groups.include_items(u'admins', (u'guido', u'sballmer'))
+        self.dbsession.queries = 0
+
+    def _get_users(self, *args, **kwargs):
+        return get_permission_users(self.groups, self.permissions, *args,
+                                    **kwargs)
+
+    def test_users(self):
+        self.assertEqual(self._get_users(u'edit-site'),
+                         [u'guido', u'linus', u'rms', u'sballmer'])
+        self.assertEqual(self._get_users(u'see-site'), [u'sballmer'])
+        self.assertEqual(self._get_users(u'nopermission'), [])
+        self.assertEqual(self._get_users(u'fly'), [])
+        self.assertEqual(self.dbsession.queries, 4)
+
+    def test_pages(self):
+        self.assertEqual(self._get_users(u'edit-site', limit=3),
+                         [u'guido', u'linus', u'rms'])
+        self.assertEqual(self._get_users(u'edit-site', after=u'rms'),
+                         [u'sballmer'])
+        self.assertEqual(self._get_users(u'edit-site', after=u'linus',
+                                         limit=1),
+                         [u'rms'])
+
+    def test_stream(self):
+        users = iter_permission_users(self.groups, self.permissions,
+                                      u'edit-site', batch_size=2)
+        self.assertEqual(self.dbsession.queries, 0)
+        self.assertEqual(list(users),
+                         [u'guido', u'linus', u'rms', u'sballmer'])
+        self.assertEqual(self.dbsession.queries, 3)
+
+    def test_core_adapters(self):
+        self.groups = SqlCoreGroupsAdapter(model.Group.__table__,
+                                           model.User.__table__,
+                                           model.user_group_table,
+                                           self.dbsession)
+        self.permissions = SqlCorePermissionsAdapter(
+            model.Permission.__table__, model.Group.__table__,
+            model.group_permission_table, self.dbsession)
+        self.assertEqual(self._get_users(u'edit-site', after=u'guido'),
+                         [u'linus', u'rms', u'sballmer'])
+
+    def test_computed_permissions(self):
+        self.permissions.translations['sections'] = 'fake_permissions'
+        self.assertEqual(self._get_users(u'edit-site', after=u'guido',
+                                         limit=2),
+                         [u'linus', u'rms'])
+        self.assertEqual(self._get_users(u'fly'), [])
+        users = iter_permission_users(self.groups, self.permissions,
+                                      u'edit-site', batch_size=3)
+        self.assertEqual(list(users),
+                         [u'guido', u'linus', u'rms', u'sballmer'])
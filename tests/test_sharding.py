@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Test suite for the adapters spread across many databases."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from repoze.what.adapters import NonExistingSectionError
+
+from repoze.what.plugins.sql import SqlGroupsAdapter, SqlPermissionsAdapter
+from repoze.what.plugins.sql.parallel import WorkerPool
+from repoze.what.plugins.sql.sharding import ShardedSqlAdapter, crc32_router
+
+import databasesetup
+
+
+# The shard of each user:
+USER_SHARDS = {
+    u'rms': 'one',
+    u'guido': 'one',
+    u'linus': 'two',
+    u'rasmus': 'two',
+    u'sballmer': 'three',
+    }
+
+
+def route(user_name):
+    return USER_SHARDS.get(user_name, 'one')
+
+
+class TestCrc32Router(unittest.TestCase):
+    """Tests for the CRC32-based routing function"""
+
+    def test_routing(self):
+        route = crc32_router(['b', 'a', 'c'])
+        self.assertEqual(route(u'rasmus'), 'b')
+        self.assertEqual(route('rasmus'), 'b')
+        self.assertEqual(route(u'rms'), 'c')
+        # Any order of the keys gives the same routes:
+        self.assertEqual(crc32_router(['c', 'b', 'a'])(u'rasmus'), 'b')
+
+    def test_spread(self):
+        route = crc32_router(range(4))
+        counts = [0] * 4
+        for i in range(1000):
+            counts[route(u'user%s' % i)] += 1
+        for count in counts:
+            assert 200 < count < 300, counts
+
+
+class TestShardedSqlAdapter(unittest.TestCase):
+    """Tests for the adapters spread across many SQLite files"""
+
+    pool = None
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sessions = {}
+        shards = {}
+        for key in ('one', 'two', 'three'):
+            session = databasesetup.setup_file_database(
+                os.path.join(self.directory, key + '.db'))
+            # Keeping the users of this shard only:
+            for user in session.query(databasesetup.User).all():
+                if route(user.user_name) != key:
+                    session.delete(user)
+            session.commit()
+            self.sessions[key] = session
+            shards[key] = SqlGroupsAdapter(databasesetup.Group,
+                                           databasesetup.User, session)
+        self.adapter = ShardedSqlAdapter(shards, route, pool=self.pool)
+
+    def tearDown(self):
+        for session in self.sessions.values():
+            session.remove()
+        shutil.rmtree(self.directory)
+
+    def _find_groups(self, user_name):
+        return self.adapter.find_sections({'repoze.what.userid': user_name})
+
+    def _get_users(self, key):
+        session = self.sessions[key]
+        users = [u.user_name for u in session.query(databasesetup.User)]
+        session.remove()
+        return set(users)
+
+    def test_users_are_split(self):
+        self.assertEqual(self._get_users('one'), set((u'rms', u'guido')))
+        self.assertEqual(self._get_users('three'), set((u'sballmer', )))
+
+    def test_find_sections(self):
+        self.assertEqual(self._find_groups(u'rms'),
+                         set((u'admins', u'developers')))
+        self.assertEqual(self._find_groups(u'linus'), set((u'developers', )))
+        self.assertEqual(self._find_groups(u'sballmer'), set((u'trolls', )))
+        self.assertEqual(self._find_groups(u'gustavo'), set())
+
+    def test_items_are_gathered(self):
+        self.assertEqual(self.adapter.get_section_items(u'developers'),
+                         set((u'rms', u'linus')))
+        self.assertRaises(NonExistingSectionError,
+                          self.adapter.get_section_items, u'designers')
+        self.assertEqual(self.adapter.get_all_sections(), {
+            u'admins': set((u'rms', )),
+            u'developers': set((u'rms', u'linus')),
+            u'trolls': set((u'sballmer', )),
+            u'php': set(),
+            u'python': set(),
+            u'nogroup': set(),
+            })
+
+    def test_items_are_routed(self):
+        self.adapter.include_items(u'python', (u'guido', u'rasmus'))
+        assert self.adapter._item_is_included(u'python', u'guido')
+        assert not self.adapter._item_is_included(u'python', u'linus')
+        self.assertEqual(self.adapter.shards['one'].get_section_items(
+            u'python'), set((u'guido', )))
+        self.assertEqual(self.adapter.shards['two'].get_section_items(
+            u'python'), set((u'rasmus', )))
+        self.adapter.exclude_items(u'developers', (u'rms', u'linus'))
+        self.assertEqual(self._find_groups(u'linus'), set())
+
+    def test_sections_are_broadcast(self):
+        self.adapter.create_section(u'designers')
+        self.adapter.include_items(u'designers', (u'sballmer', ))
+        self.adapter.edit_section(u'designers', u'artists')
+        self.adapter.delete_section(u'trolls')
+        for shard in self.adapter.shards.values():
+            assert shard._section_exists(u'artists')
+            assert not shard._section_exists(u'designers')
+            assert not shard._section_exists(u'trolls')
+        self.assertEqual(self._find_groups(u'sballmer'), set((u'artists', )))
+
+    def test_permissions(self):
+        shards = dict([(key, SqlPermissionsAdapter(
+            databasesetup.Permission, databasesetup.Group, session))
+            for (key, session) in self.sessions.items()])
+        adapter = ShardedSqlAdapter(shards, lambda group: 'two',
+                                    pool=self.pool)
+        self.assertEqual(adapter.find_sections(u'developers'),
+                         set((u'commit', u'edit-site')))
+
+
+class TestParallelShardedSqlAdapter(TestShardedSqlAdapter):
+    """Tests for the adapters spread across many SQLite files, in parallel"""
+
+    pool = WorkerPool(3)
+
+    def test_plain_sessions_are_rejected(self):
+        shards = {'one': SqlGroupsAdapter(databasesetup.Group,
+                                          databasesetup.User,
+                                          self.sessions['one']())}
+        self.assertRaises(ValueError, ShardedSqlAdapter, shards, route,
+                          self.pool)
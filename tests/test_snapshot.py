@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Test suite for the shared snapshots of groups and permissions."""
+
+import os
+import shutil
+import struct
+import tempfile
+import time
+import unittest
+
+from repoze.what.adapters import SourceError, NonExistingSectionError
+
+from repoze.what.plugins.sql import configure_sql_adapters
+from repoze.what.plugins.sql.snapshot import Snapshot, build_snapshot, \
+                                             SnapshotGroupsAdapter, \
+                                             SnapshotPermissionsAdapter, \
+                                             SnapshotUpdater
+
+import databasesetup
+
+
+class _BaseSnapshotTester(unittest.TestCase):
+
+    def setUp(self):
+        databasesetup.setup_database()
+        adapters = configure_sql_adapters(
+            databasesetup.User, databasesetup.Group, databasesetup.Permission,
+            databasesetup.DBSession)
+        self.groups = adapters['group']
+        self.permissions = adapters['permission']
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'acl.snapshot')
+        self.stats = build_snapshot(self.groups, self.permissions, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        databasesetup.teardownDatabase()
+
+
+class TestSnapshot(_BaseSnapshotTester):
+    """Tests for the snapshots"""
+
+    def test_stats(self):
+        self.assertEqual(self.stats['users'], 3)
+        self.assertEqual(self.stats['groups'], 6)
+        self.assertEqual(self.stats['permissions'], 4)
+        self.assertEqual(self.stats['bytes'], os.path.getsize(self.path))
+
+    def test_lookups(self):
+        snapshot = Snapshot(self.path)
+        self.assertEqual(snapshot.user_groups(u'rms'),
+                         set((u'admins', u'developers')))
+        self.assertEqual(snapshot.user_groups(u'guido'), set())
+        self.assertEqual(snapshot.group_users(u'developers'),
+                         set((u'rms', u'linus')))
+        self.assertEqual(snapshot.group_users(u'php'), set())
+        self.assertEqual(snapshot.group_permissions(u'developers'),
+                         set((u'commit', u'edit-site')))
+        self.assertEqual(snapshot.permission_groups(u'edit-site'),
+                         set((u'admins', u'developers')))
+        self.assertEqual(snapshot.permission_groups(u'nopermission'), set())
+        self.assertEqual(snapshot.groups(), set(self.groups.get_all_sections()))
+        self.assertEqual(snapshot.permissions(),
+                         set(self.permissions.get_all_sections()))
+        assert snapshot.has_group(u'trolls')
+        assert not snapshot.has_group(u'designers')
+        assert snapshot.has_permission(u'commit')
+        assert not snapshot.has_permission(u'trolls')
+
+    def test_non_ascii_names(self):
+        self.groups.create_section(u'd\xe9veloppeurs')
+        self.groups.include_items(u'd\xe9veloppeurs', (u'guido', ))
+        self.permissions.include_items(u'commit', (u'd\xe9veloppeurs', ))
+        build_snapshot(self.groups, self.permissions, self.path)
+        snapshot = Snapshot(self.path)
+        self.assertEqual(snapshot.user_groups(u'guido'),
+                         set((u'd\xe9veloppeurs', )))
+        self.assertEqual(snapshot.permission_groups(u'commit'),
+                         set((u'developers', u'd\xe9veloppeurs')))
+
+    def test_refresh(self):
+        snapshot = Snapshot(self.path)
+        assert not snapshot.refresh()
+        self.groups.include_items(u'trolls', (u'guido', ))
+        build_snapshot(self.groups, self.permissions, self.path)
+        self.assertEqual(snapshot.user_groups(u'guido'), set())
+        assert snapshot.refresh()
+        self.assertEqual(snapshot.user_groups(u'guido'), set((u'trolls', )))
+        self.assertEqual(os.listdir(self.directory), ['acl.snapshot'])
+
+    def test_check_interval(self):
+        snapshot = Snapshot(self.path, check_interval=0)
+        self.groups.include_items(u'trolls', (u'guido', ))
+        build_snapshot(self.groups, self.permissions, self.path)
+        self.assertEqual(snapshot.user_groups(u'guido'), set((u'trolls', )))
+
+    def test_stamp(self):
+        self.assertEqual(Snapshot(self.path).stamp, 0)
+        build_snapshot(self.groups, self.permissions, self.path, 2 ** 40)
+        self.assertEqual(Snapshot(self.path).stamp, 2 ** 40)
+
+    def test_other_format_versions(self):
+        contents = open(self.path, 'rb').read()
+        snapshot_file = open(self.path, 'wb')
+        snapshot_file.write(contents[:4] + struct.pack('<H', 1) + contents[6:])
+        snapshot_file.close()
+        self.assertRaises(SourceError, Snapshot, self.path)
+
+    def test_invalid_files(self):
+        self.assertRaises(SourceError, Snapshot,
+                          os.path.join(self.directory, 'missing'))
+        for contents in (b'RWSQ', b'\0' * 200):
+            snapshot_file = open(self.path, 'wb')
+            snapshot_file.write(contents)
+            snapshot_file.close()
+            self.assertRaises(SourceError, Snapshot, self.path)
+
+
+class TestSnapshotAdapters(_BaseSnapshotTester):
+    """Tests for the source adapters on top of snapshots"""
+
+    def setUp(self):
+        super(TestSnapshotAdapters, self).setUp()
+        self.snapshot = Snapshot(self.path)
+        self.group_adapter = SnapshotGroupsAdapter(self.snapshot)
+        self.permission_adapter = SnapshotPermissionsAdapter(self.snapshot)
+
+    def test_groups(self):
+        credentials = {'repoze.what.userid': u'rms'}
+        self.assertEqual(self.group_adapter.find_sections(credentials),
+                         set((u'admins', u'developers')))
+        self.assertEqual(self.group_adapter.get_all_sections(),
+                         self.groups.get_all_sections())
+        self.assertEqual(self.group_adapter.get_section_items(u'trolls'),
+                         set((u'sballmer', )))
+        assert self.group_adapter._item_is_included(u'trolls', u'sballmer')
+        self.assertRaises(NonExistingSectionError,
+                          self.group_adapter.get_section_items, u'designers')
+
+    def test_permissions(self):
+        self.assertEqual(self.permission_adapter.find_sections(u'developers'),
+                         set((u'commit', u'edit-site')))
+        self.assertEqual(self.permission_adapter.get_all_sections(),
+                         self.permissions.get_all_sections())
+        self.assertRaises(NonExistingSectionError,
+                          self.permission_adapter.get_section_items, u'trolls')
+
+    def test_read_only(self):
+        self.assertRaises(SourceError, self.group_adapter.include_items,
+                          u'trolls', (u'guido', ))
+        self.assertRaises(SourceError, self.permission_adapter.create_section,
+                          u'deploy')
+
+    def test_refreshed_data_is_not_cached(self):
+        self.group_adapter.get_section_items(u'trolls')
+        self.groups.include_items(u'trolls', (u'guido', ))
+        build_snapshot(self.groups, self.permissions, self.path)
+        self.snapshot.refresh()
+        self.assertEqual(self.group_adapter.get_section_items(u'trolls'),
+                         set((u'sballmer', u'guido')))
+
+    def test_one_query_per_adapter(self):
+        dbsession = databasesetup.QueryCounter(databasesetup.DBSession)
+        self.groups.dbsession = self.permissions.dbsession = dbsession
+        path = os.path.join(self.directory, 'copy.snapshot')
+        build_snapshot(self.groups, self.permissions, path)
+        self.assertEqual(dbsession.queries, 2)
+        self.assertEqual(open(path, 'rb').read(), open(self.path, 'rb').read())
+
+    def test_without_association_table(self):
+        self.groups.translations['sections'] = 'fake_groups'
+        path = os.path.join(self.directory, 'copy.snapshot')
+        build_snapshot(self.groups, self.permissions, path)
+        self.assertEqual(open(path, 'rb').read(), open(self.path, 'rb').read())
+
+    def test_snapshot_of_snapshot(self):
+        path = os.path.join(self.directory, 'copy.snapshot')
+        build_snapshot(self.group_adapter, self.permission_adapter, path)
+        self.assertEqual(open(path, 'rb').read(), open(self.path, 'rb').read())
+
+
+class TestSnapshotUpdater(unittest.TestCase):
+    """Tests for the snapshots kept up-to-date"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dbsession = databasesetup.setup_file_database(
+            os.path.join(self.directory, 'acl.db'))
+        adapters = configure_sql_adapters(
+            databasesetup.User, databasesetup.Group, databasesetup.Permission,
+            self.dbsession)
+        self.groups = adapters['group']
+        self.permissions = adapters['permission']
+        self.path = os.path.join(self.directory, 'acl.snapshot')
+        self.stamp = 1
+        self.updaters = []
+
+    def tearDown(self):
+        for updater in self.updaters:
+            updater.stop()
+        self.dbsession.remove()
+        shutil.rmtree(self.directory)
+
+    def _make_updater(self, **kwargs):
+        kwargs.setdefault('interval', None)
+        updater = SnapshotUpdater(self.path, self.groups, self.permissions,
+                                  lambda: self.stamp, **kwargs)
+        self.updaters.append(updater)
+        return updater
+
+    def _add_guido_to_trolls(self):
+        self.groups.include_items(u'trolls', (u'guido', ))
+        # Committing the session's transaction, so other threads see it:
+        self.dbsession.commit()
+        self.stamp += 1
+
+    def test_missing_snapshot_is_built(self):
+        updater = self._make_updater()
+        updater.start()
+        self.assertEqual(updater.snapshot.stamp, 1)
+        self.assertEqual(updater.snapshot.user_groups(u'rms'),
+                         set((u'admins', u'developers')))
+
+    def test_recent_snapshot_is_used(self):
+        build_snapshot(self.groups, self.permissions, self.path, 1)
+        self.groups.include_items(u'trolls', (u'guido', ))
+        updater = self._make_updater()
+        updater.start()
+        # The stamp didn't change, so the snapshot is trusted:
+        self.assertEqual(updater.snapshot.user_groups(u'guido'), set())
+
+    def test_outdated_snapshot_is_rebuilt(self):
+        build_snapshot(self.groups, self.permissions, self.path, 1)
+        self._add_guido_to_trolls()
+        updater = self._make_updater()
+        updater.start()
+        self.assertEqual(updater.snapshot.stamp, 2)
+        self.assertEqual(updater.snapshot.user_groups(u'guido'),
+                         set((u'trolls', )))
+
+    def test_update(self):
+        updater = self._make_updater()
+        updater.start()
+        assert not updater.update()
+        self._add_guido_to_trolls()
+        assert updater.update()
+        self.assertEqual(updater.snapshot.user_groups(u'guido'),
+                         set((u'trolls', )))
+
+    def test_background_updates(self):
+        build_snapshot(self.groups, self.permissions, self.path, 1)
+        self._add_guido_to_trolls()
+        updater = self._make_updater(interval=0.05, allow_stale=True)
+        updater.start()
+        snapshot = updater.snapshot
+        for i in range(100):
+            if snapshot.stamp == 2:
+                break
+            time.sleep(0.05)
+        self.assertEqual(snapshot.user_groups(u'guido'), set((u'trolls', )))
+        self.assertEqual(updater.last_error, None)
+        updater.stop()
+        assert updater._thread is None
+
+    def test_background_updates_need_scoped_sessions(self):
+        self.groups.dbsession = self.dbsession()
+        updater = self._make_updater(interval=60)
+        self.assertRaises(ValueError, updater.start)
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2011, Gustavo Narea <me@gustavonarea.net>.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Test suite for the support of many tenants in the SQL adapters."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from repoze.what.adapters import SourceError
+from repoze.what.middleware import AuthorizationMetadata
+
+from repoze.what.plugins.sql import configure_sql_adapters
+from repoze.what.plugins.sql.cache import NegativeCache, set_request_memo
+from repoze.what.plugins.sql.middleware import TenantMiddleware
+from repoze.what.plugins.sql.queries import has_permission
+from repoze.what.plugins.sql.snapshot import build_snapshot, Snapshot
+from repoze.what.plugins.sql.tenancy import TenantCaches, current_tenant, \
+                                            get_current_tenant, \
+                                            set_current_tenant
+
+import databasesetup_tenants
+from fixture.model_tenants import User, Group, Permission, DBSession
+
+
+class TestCurrentTenant(unittest.TestCase):
+    """Tests for the tenant of the current thread"""
+
+    def tearDown(self):
+        set_current_tenant(None)
+
+    def test_no_tenant_by_default(self):
+        self.assertEqual(get_current_tenant(), None)
+
+    def test_setting_the_tenant(self):
+        self.assertEqual(set_current_tenant(u'acme'), None)
+        self.assertEqual(set_current_tenant(u'globex'), u'acme')
+        self.assertEqual(get_current_tenant(), u'globex')
+
+    def test_context(self):
+        with current_tenant(u'acme'):
+            self.assertEqual(get_current_tenant(), u'acme')
+            with current_tenant(u'globex'):
+                self.assertEqual(get_current_tenant(), u'globex')
+            self.assertEqual(get_current_tenant(), u'acme')
+        self.assertEqual(get_current_tenant(), None)
+
+    def test_middleware(self):
+        tenants = []
+        def app(environ, start_response):
+            tenants.append(get_current_tenant())
+            return []
+        TenantMiddleware(app)({'repoze.what.tenant': u'acme'}, None)
+        TenantMiddleware(app, lambda environ: environ['HTTP_HOST'][:6])(
+            {'HTTP_HOST': 'globex.example.com'}, None)
+        self.assertEqual(tenants, [u'acme', 'globex'])
+        self.assertEqual(get_current_tenant(), None)
+
+
+class TestTenantCaches(unittest.TestCase):
+    """Tests for the per-tenant caches of sections"""
+
+    def test_tenants_are_bounded(self):
+        caches = TenantCaches(max_tenants=2)
+        caches.get(u'acme')[u'admins'] = set()
+        caches.get(u'globex')
+        caches.get(u'acme')
+        caches.get(u'initech')
+        self.assertEqual(len(caches), 2)
+        assert u'acme' in caches
+        assert u'globex' not in caches
+        self.assertEqual(caches.get(u'acme'), {u'admins': set()})
+
+    def test_sections_are_bounded(self):
+        caches = TenantCaches(max_sections=2)
+        cache = caches.get(u'acme')
+        cache[u'admins'] = set()
+        cache[u'developers'] = set()
+        cache[u'developers'] = set((u'rms', ))
+        self.assertEqual(len(cache), 2)
+        cache[u'trolls'] = set()
+        self.assertEqual(cache, {u'trolls': set()})
+
+    def test_too_many_sections_are_not_kept(self):
+        caches = TenantCaches(max_sections=1)
+        caches.set(u'acme', {u'admins': set()})
+        self.assertEqual(caches.get(u'acme'), {u'admins': set()})
+        caches.set(u'acme', {u'admins': set(), u'trolls': set()})
+        self.assertEqual(caches.get(u'acme'), {})
+        assert caches.get(u'acme').discarded
+
+    def test_clear(self):
+        caches = TenantCaches()
+        caches.get(u'acme')
+        caches.clear()
+        self.assertEqual(len(caches), 0)
+
+
+class TestTenantAdapters(unittest.TestCase):
+    """Tests for the adapters shared by many tenants"""
+
+    def setUp(self):
+        databasesetup_tenants.setup_database()
+        adapters = configure_sql_adapters(User, Group, Permission, DBSession,
+                                          tenant_attribute='tenant_id')
+        self.groups = adapters['group']
+        self.permissions = adapters['permission']
+
+    def tearDown(self):
+        set_current_tenant(None)
+        set_request_memo(None)
+        databasesetup_tenants.teardownDatabase()
+
+    def _find_groups(self, user_name, **credentials):
+        credentials['repoze.what.userid'] = user_name
+        return self.groups.find_sections(credentials)
+
+    def test_tenant_is_required(self):
+        self.assertRaises(SourceError, self._find_groups, u'rms')
+        self.assertRaises(SourceError, self.groups.get_all_sections)
+
+    def test_lookups(self):
+        with current_tenant(u'acme'):
+            self.assertEqual(self._find_groups(u'rms'),
+                             set((u'admins', u'developers')))
+            self.assertEqual(self._find_groups(u'sballmer'), set())
+            self.assertEqual(self.permissions.find_sections(u'admins'),
+                             set((u'edit-site', )))
+            self.assertEqual(self.groups.get_section_items(u'admins'),
+                             set((u'rms', )))
+            assert has_permission(self.groups, self.permissions, u'rms',
+                                  u'commit')
+        with current_tenant(u'globex'):
+            self.assertEqual(self._find_groups(u'rms'), set((u'trolls', )))
+            self.assertEqual(self.permissions.find_sections(u'admins'),
+                             set((u'edit-site', )))
+            self.assertEqual(self.groups.get_section_items(u'admins'),
+                             set((u'sballmer', )))
+            assert not has_permission(self.groups, self.permissions, u'rms',
+                                      u'commit')
+
+    def test_authorization_metadata(self):
+        metadata = AuthorizationMetadata({'sql': self.groups},
+                                         {'sql': self.permissions})
+        identities = []
+        def app(environ, start_response):
+            identity = {'repoze.who.userid': u'rms'}
+            metadata.add_metadata(environ, identity)
+            identities.append(identity)
+            return []
+        app = TenantMiddleware(app)
+        app({'repoze.what.tenant': u'acme'}, None)
+        app({'repoze.what.tenant': u'globex'}, None)
+        self.assertEqual(set(identities[0]['groups']),
+                         set((u'admins', u'developers')))
+        self.assertEqual(set(identities[0]['permissions']),
+                         set((u'edit-site', u'commit')))
+        self.assertEqual(set(identities[1]['groups']), set((u'trolls', )))
+        self.assertEqual(set(identities[1]['permissions']),
+                         set((u'see-site', )))
+        self.assertRaises(SourceError, app, {}, None)
+
+    def test_all_sections(self):
+        with current_tenant(u'acme'):
+            self.assertEqual(self.permissions.get_all_sections(), {
+                u'edit-site': set((u'admins', u'developers')),
+                u'commit': set((u'developers', ))})
+        with current_tenant(u'globex'):
+            self.assertEqual(self.permissions.get_all_sections(), {
+                u'edit-site': set((u'admins', )),
+                u'see-site': set((u'trolls', ))})
+
+    def test_caches_are_partitioned(self):
+        with current_tenant(u'acme'):
+            self.groups.get_all_sections()
+            assert self.groups.all_sections_loaded
+        with current_tenant(u'globex'):
+            assert not self.groups.all_sections_loaded
+            self.assertEqual(self.groups.loaded_sections, {})
+            self.groups.get_section_items(u'admins')
+        self.assertEqual(len(self.groups.tenant_caches), 2)
+
+    def test_sections_beyond_the_limit(self):
+        self.groups.tenant_caches = TenantCaches(max_sections=1)
+        with current_tenant(u'acme'):
+            self.assertEqual(set(self.groups.get_all_sections()),
+                             set((u'admins', u'developers')))
+            assert not self.groups.all_sections_loaded
+            self.assertEqual(self.groups.loaded_sections, {})
+
+    def test_memo_is_partitioned(self):
+        set_request_memo({})
+        with current_tenant(u'acme'):
+            self.assertEqual(self.permissions.find_sections(u'admins'),
+                             set((u'edit-site', )))
+        with current_tenant(u'globex'):
+            self.assertEqual(self.permissions.find_sections(u'trolls'),
+                             set((u'see-site', )))
+        with current_tenant(u'acme'):
+            self.assertEqual(self.permissions.find_sections(u'trolls'), set())
+
+    def test_negative_cache_is_partitioned(self):
+        self.groups.negative_cache = NegativeCache()
+        with current_tenant(u'acme'):
+            self.assertEqual(self._find_groups(u'sballmer'), set())
+        with current_tenant(u'globex'):
+            self.assertEqual(self._find_groups(u'sballmer'),
+                             set((u'admins', )))
+
+    def test_writes(self):
+        with current_tenant(u'globex'):
+            self.groups.create_section(u'developers')
+            self.groups.include_items(u'developers', (u'rms', ))
+            self.groups.edit_section(u'admins', u'owners')
+            self.permissions.delete_section(u'see-site')
+            self.assertEqual(self._find_groups(u'rms'),
+                             set((u'trolls', u'developers')))
+        with current_tenant(u'acme'):
+            self.assertEqual(self.groups.get_section_items(u'developers'),
+                             set((u'rms', u'linus')))
+            assert self.groups._section_exists(u'admins')
+            assert self.permissions._section_exists(u'edit-site')
+        rows = DBSession.query(Group.tenant_id, Group.group_name).all()
+        self.assertEqual(sorted(rows), [
+            (u'acme', u'admins'), (u'acme', u'developers'),
+            (u'globex', u'developers'), (u'globex', u'owners'),
+            (u'globex', u'trolls')])
+        self.assertEqual(DBSession.query(Permission).count(), 3)
+
+    def test_translations_check(self):
+        self.groups._check_translations()
+        self.groups.tenant_attribute = 'tenant'
+        self.assertRaises(SourceError, self.groups._check_translations)
+
+    def test_snapshots(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for tenant in (u'acme', u'globex'):
+                with current_tenant(tenant):
+                    build_snapshot(self.groups, self.permissions,
+                                   os.path.join(directory, tenant))
+            acme = Snapshot(os.path.join(directory, u'acme'))
+            globex = Snapshot(os.path.join(directory, u'globex'))
+            self.assertEqual(acme.user_groups(u'rms'),
+                             set((u'admins', u'developers')))
+            self.assertEqual(globex.user_groups(u'rms'), set((u'trolls', )))
+            assert not globex.has_permission(u'commit')
+        finally:
+            shutil.rmtree(directory)